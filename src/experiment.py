@@ -8,7 +8,7 @@ import pandas as pd
 import geopandas as gpd
 from rasterio.plot import show
 import matplotlib.pyplot as plt
-from utils import kmeans_utils
+from utils import kmeans_utils, nhd_utils
 
 # load the image metadata dataframe
 df = pd.read_csv('data/s2.csv')
@@ -22,9 +22,9 @@ _, sat_bounds, tiff_crs, _, _ = kmeans_utils.read_tif(image_path)
 
 area = 'Vermont' # hard-coded value (be careful if changing the row)
 
-# load the shapefile
+# load the flowlines intersecting the image (in the image CRS)
 shp_path = f'data/nhd/{area}/Shape/NHDFlowline.shp'
-flowline = gpd.read_file(shp_path)
+flowline = nhd_utils.read_bbox(shp_path, sat_bounds, tiff_crs)
 
 vaa_path = f'data/nhd/{area}/Shape/NHDFlowlineVAA.dbf'
 flowline_vaa = gpd.read_file(vaa_path)
@@ -32,10 +32,6 @@ flowline_vaa = gpd.read_file(vaa_path)
 flowline_combined = flowline.merge(flowline_vaa[['permanent_', 'streamorde', 'streamlevel']], on='permanent_')
 major_rivers = flowline_combined[flowline_combined['streamorde'] >= 5]
 
-# convert crs
-if major_rivers.crs != tiff_crs:
-    major_rivers = major_rivers.to_crs(tiff_crs)
-
 # plot 
 fig, ax = plt.subplots(figsize=(10, 10))
 with rasterio.open(image_path) as src:
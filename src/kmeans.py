@@ -13,75 +13,111 @@ This script includes the following steps:
 # import libraris
 import time
 import pandas as pd
-from utils import kmeans_utils, global_utils
-
-# track the runtime
-start = time.time()
-print('\nSTART - KMEANS CLUSTERING MODEL\n')
-
-# set variable
-default_n_clusters = 3
-
-# step 1 - load the dataframe storing the image metadata
-df = pd.read_csv('data/s2_id_with_flood.csv')
-
-# step 2 - add the image data to df
-df_mod, result_df_ndwi  = kmeans_utils.add_image_data(df)
-
-# step 3 - preprocess data
-df_scaled = kmeans_utils.preprocess_data(df_mod)
-
-# step 4 - run default KMeans
-init = 'k-means++'
-results_df_default = kmeans_utils.kmeans_clustering_default(df_scaled, init, default_n_clusters, 'default')
-
-# step 5 - optimize KMeans using different combinations
-# step 5.1 - optimize KMeans by applying PCA to each image
-result_df_pca_i = kmeans_utils.kmeans_optimization_individual_pca_features(df_scaled, init, 'pca')
-
-# step 5.2 - optimize KMeans by adding flowline as a feature and applying PCA to each image
-result_df_pca_flowline = kmeans_utils.kmeans_optimization_individual_pca_features(df_scaled, init, 'flowline_pca')
-
-# step 5.3 - optimize KMeans by adding NDWI as a feature and applying PCA to each image
-result_df_pca_ndwi = kmeans_utils.kmeans_optimization_individual_pca_features(df_scaled, init, 'ndwi_pca')
-
-# step 5.4 - optimize KMeans by adding flowline and NDWI as features and applying PCA to each image
-result_df_pca_features = kmeans_utils.kmeans_optimization_individual_pca_features(df_scaled, init, 'features_pca')
-
-# step 6 - save the KMeans result
-result_df_combined = pd.merge(results_df_default, result_df_pca_i, on='id')
-result_df_combined = pd.merge(result_df_combined, result_df_pca_flowline, on='id')
-result_df_combined = pd.merge(result_df_combined, result_df_pca_ndwi, on='id')
-result_df_combined = pd.merge(result_df_combined, result_df_pca_features, on='id')
-result_df_combined = pd.merge(result_df_combined, result_df_ndwi, on='id')
-result_df_combined.to_csv('data/kmeans.csv', index=False)
-print('dataset storing KMeans result:\n')
-result_df_combined.info()
-
-# # step 7 - check the explained variance and elbow method for specified image if interested (currently focusing on ids with notable flooded area)
-print('explained variance and elbow method figures...\n')
-result_df_combined = pd.read_csv('data/kmeans.csv')
-
-# convert str to list
-result_df_combined['explained_variance_ndwi_pca_i'] = result_df_combined['explained_variance_ndwi_pca_i'].apply(global_utils.str_to_list)
-result_df_combined['inertia_result_ndwi_pca_i'] = result_df_combined['inertia_result_ndwi_pca_i'].apply(global_utils.str_to_list)
-result_df_combined['n_clusters_list_ndwi_pca_i'] = result_df_combined['n_clusters_list_ndwi_pca_i'].apply(global_utils.str_to_list)
-
-# filter the dataset using ids with notable flooded areas
-event_ids_selected = ['44909', '44929', '45067', '45237', '45321', '45358', '45427', '45501', 'MNTM3_114', 'TMVC3_39']
-result_df_combined['event_id'] = result_df_combined['id'].apply(lambda x: '_'.join(x.split('_')[:2]) if x[0].isalpha() else x.split('_')[0])
-result_df_combined_filter = result_df_combined[result_df_combined['event_id'].isin(event_ids_selected)]
-
-# plot the explained variance and elbow method
-for index, row in result_df_combined_filter.iterrows():
-    explained_variance = row['explained_variance_ndwi_pca_i']
-    cluster_list = row['n_clusters_list_ndwi_pca_i']
-    inertia_result = row['inertia_result_ndwi_pca_i']
-    file = row['id'].replace('_VIS.tif', '')
-    kmeans_utils.plot_evaluation_metrics(explained_variance, cluster_list, inertia_result, file)
-
-print('\nCOMPLETE - KMEANS CLUSTERING MODEL\n')
-
-# calculate the runtime
-end = time.time()
-print(f'\nRUNTIME: {round((end - start) / 60, 2)} minutes')
\ No newline at end of file
+from utils import kmeans_utils, global_utils, render_utils
+
+def main():
+    # track the runtime
+    start = time.time()
+    print('\nSTART - KMEANS CLUSTERING MODEL\n')
+
+    # set variable
+    default_n_clusters = 3
+
+    # elbow search: 'minibatch' fits MiniBatchKMeans on a stratified pixel subsample ('full' fits KMeans on all the pixels)
+    elbow_params = {
+        'elbow_mode': 'minibatch',
+        'sample_size': 50000,
+        'check_accuracy': False # compare with the full-data elbow search (slow)
+    }
+
+    # PCA: 'fit' fits the PCA once per scene (on a stratified pixel subsample) and saves the PCA of each event to data/pca,
+    # 'predict' projects the scenes with the saved PCA of their event
+    pca_params = {
+        'pca_mode': 'fit',
+        'pca_sample_size': 200000
+    }
+
+    # pixel reduction: 'unique' clusters the unique feature vectors weighted by their pixel counts (same objective),
+    # 'grid' clusters the means of a quantization grid (grid_step in standardized units), 'superpixel' clusters the mean
+    # features of superpixels ('grid' blocks of superpixel_size pixels or 'slic' with scikit-image) weighted by their sizes,
+    # 'pyramid' clusters coarse blocks read from the overviews (pyramid_factor 2 - 20 m, 4 - 40 m) and only reads the windows
+    # near the cluster boundaries at 10 m,
+    # None clusters all the pixels (the PCA conditions only use it with the 'full' elbow mode)
+    reduce_params = {
+        'reduce_mode': 'unique',
+        'grid_step': 0.01,
+        'superpixel_size': 20,
+        'superpixel_method': 'grid',
+        'pyramid_factor': 4
+    }
+
+    # the scenes are clustered in a process pool (KMEANS_WORKERS processes with KMEANS_THREADS BLAS/OpenMP threads each)
+    workers = None
+
+    # step 1 - load the dataframe storing the image metadata
+    df = pd.read_csv('data/s2_id_with_flood.csv')
+
+    # step 2 - add the image data to df
+    df_mod, result_df_ndwi  = kmeans_utils.add_image_data(df)
+
+    # step 3 - preprocess data
+    df_scaled = kmeans_utils.preprocess_data(df_mod)
+
+    # step 4 - run default KMeans
+    init = 'k-means++'
+    results_df_default = kmeans_utils.kmeans_clustering_default(df_scaled, init, default_n_clusters, 'default', workers, **reduce_params)
+
+    # step 5 - optimize KMeans using different combinations (all the conditions in a single pass over the scenes)
+    # pca - apply PCA to each image
+    # flowline_pca - add flowline as a feature and apply PCA to each image
+    # ndwi_pca - add NDWI as a feature and apply PCA to each image
+    # features_pca - add flowline and NDWI as features and apply PCA to each image
+    conditions = ['pca', 'flowline_pca', 'ndwi_pca', 'features_pca']
+    result_dfs = kmeans_utils.run_conditions(df_scaled, init, conditions, **elbow_params, **pca_params, **reduce_params, workers=workers)
+    result_df_pca_i = result_dfs['pca']
+    result_df_pca_flowline = result_dfs['flowline_pca']
+    result_df_pca_ndwi = result_dfs['ndwi_pca']
+    result_df_pca_features = result_dfs['features_pca']
+
+    # step 6 - save the KMeans result
+    result_df_combined = pd.merge(results_df_default, result_df_pca_i, on='id')
+    result_df_combined = pd.merge(result_df_combined, result_df_pca_flowline, on='id')
+    result_df_combined = pd.merge(result_df_combined, result_df_pca_ndwi, on='id')
+    result_df_combined = pd.merge(result_df_combined, result_df_pca_features, on='id')
+    result_df_combined = pd.merge(result_df_combined, result_df_ndwi, on='id')
+    result_df_combined.to_csv('data/kmeans.csv', index=False)
+    print('dataset storing KMeans result:\n')
+    result_df_combined.info()
+
+    # # step 7 - check the explained variance and elbow method for specified image if interested (currently focusing on ids with notable flooded area)
+    print('explained variance and elbow method figures...\n')
+    result_df_combined = pd.read_csv('data/kmeans.csv')
+
+    # convert str to list
+    result_df_combined['explained_variance_ndwi_pca_i'] = result_df_combined['explained_variance_ndwi_pca_i'].apply(global_utils.str_to_list)
+    result_df_combined['inertia_result_ndwi_pca_i'] = result_df_combined['inertia_result_ndwi_pca_i'].apply(global_utils.str_to_list)
+    result_df_combined['n_clusters_list_ndwi_pca_i'] = result_df_combined['n_clusters_list_ndwi_pca_i'].apply(global_utils.str_to_list)
+
+    # filter the dataset using ids with notable flooded areas
+    event_ids_selected = ['44909', '44929', '45067', '45237', '45321', '45358', '45427', '45501', 'MNTM3_114', 'TMVC3_39']
+    result_df_combined['event_id'] = result_df_combined['id'].apply(lambda x: '_'.join(x.split('_')[:2]) if x[0].isalpha() else x.split('_')[0])
+    result_df_combined_filter = result_df_combined[result_df_combined['event_id'].isin(event_ids_selected)]
+
+    # plot the explained variance and elbow method
+    for index, row in result_df_combined_filter.iterrows():
+        explained_variance = row['explained_variance_ndwi_pca_i']
+        cluster_list = row['n_clusters_list_ndwi_pca_i']
+        inertia_result = row['inertia_result_ndwi_pca_i']
+        file = row['id'].replace('_VIS.tif', '')
+        kmeans_utils.plot_evaluation_metrics(explained_variance, cluster_list, inertia_result, file)
+    render_utils.save_manifest()
+
+    print('\nCOMPLETE - KMEANS CLUSTERING MODEL\n')
+
+    # calculate the runtime
+    end = time.time()
+    print(f'\nRUNTIME: {round((end - start) / 60, 2)} minutes')
+
+# the process pools re-import this module in their workers (spawn/forkserver), so only run the pipeline as a script
+if __name__ == '__main__':
+    main()
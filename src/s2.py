@@ -5,12 +5,18 @@ This script includes the following steps:
     * step 1 - run the authentication flow;
     * step 2 - prepare the flood event observation dataset;
     * step 3 - collect Sentinel 2 images.
+
+Run mode (first command line argument):
+    * collect (default) - collect the images;
+    * plan - dry run, build the collection plan with request/scene/pixel/byte estimates and save it to `plan_path`;
+    * execute - collect the images listed in the plan saved at `plan_path`.
 """
 # import libraries
 import ee
+import sys
 import time
 import pandas as pd
-from utils import s2_utils, global_utils
+from utils import s2_utils, global_utils, period_utils
 
 # track the runtime
 start = time.time()
@@ -21,7 +27,11 @@ print('\nSTART - SENTINEL-2 IMAGERY COLLECTION\n')
 buffer_dis = 6000
 overlap_threshold = 20
 pixel_threshold = 1.0
+screen_params = {'preview_scale': 60, 'cloud_threshold': 50, 'coverage_tolerance': 0.05} # screen candidates at 60 m before the 10 m download (None to disable)
+fetch_mode = 'geotiff' # 'geotiff' (download GeoTIFF files) or 'npy' (retrieve pixels as NumPy arrays with JSON sidecars)
 flood_event_periods = global_utils.flood_event_periods
+plan_path = 'data/img_s2/plan.json'
+run_mode = sys.argv[1] if len(sys.argv) > 1 else 'collect'
 
 # step 1 - run the authentication flow
 ee.Authenticate()
@@ -32,21 +42,22 @@ gauge = pd.read_csv('data/df_gauge/df_gauge_mod.csv')
 
 # step 2 - prepare the flood event observation dataset
 global_utils.print_func_header('add the formed and dissipated dates for the events')
-stn[['formed', 'dissipated']] = stn['event'].apply(lambda x: s2_utils.map_dates(x, flood_event_periods))
-stn['start_day'] = pd.to_datetime(stn['formed']) - pd.Timedelta(days=15)
-stn['end_day'] = pd.to_datetime(stn['dissipated']) + pd.Timedelta(days=16)
-stn['event'] = pd.to_datetime(stn['formed']).dt.strftime('%Y-%m')
-stn['event_day'] = stn.apply(lambda row: f"{row['formed']} to {row['dissipated']}", axis=1)
-
-gauge['start_day'] = pd.to_datetime(gauge['event_day']) - pd.Timedelta(days=15)
-gauge['end_day'] = pd.to_datetime(gauge['event_day']) + pd.Timedelta(days=16)
+stn = period_utils.map_event_periods(stn, flood_event_periods)
+stn['event'] = stn['formed'].dt.strftime('%Y-%m')
+stn['event_day'] = stn['formed'].dt.strftime('%Y-%m-%d') + ' to ' + stn['dissipated'].dt.strftime('%Y-%m-%d')
 
-attr_list = ['id', 'event', 'state', 'county', 'latitude', 'longitude', 'note', 'event_day', 'start_day', 'end_day', 'source']
-df = pd.concat([stn[attr_list], gauge[attr_list]])
+# collect the images from 15 days before to 16 days after the flood event (stn: formed/dissipated dates, gauge: event day)
+attr_list = ['id', 'event', 'state', 'county', 'latitude', 'longitude', 'note', 'event_day', 'source']
+df = period_utils.add_collection_window(pd.concat([stn[attr_list], gauge[attr_list]]), 15, 16)
 df.to_csv('data/flood_event.csv', index=False)
 
 # step 3 - collect the corresponding sentinel imagery (STN and Gauge combined)
-s2_utils.collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshold, 10)
+if run_mode == 'plan':
+    s2_utils.plan_sentinel2_by_event(df, buffer_dis, overlap_threshold, 10, plan_path)
+elif run_mode == 'execute':
+    s2_utils.collect_sentinel2_from_plan(plan_path, pixel_threshold, fetch_mode, screen_params)
+else:
+    s2_utils.collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshold, 10, fetch_mode, screen_params)
 
 print('\nCOMPLETE - SENTINEL-2 IMAGERY COLLECTION\n')
 
@@ -0,0 +1,287 @@
+"""
+This script includes the functions used to maintain a persistent catalog (SQLite with an R-tree index) of the collected Sentinel 2 images.
+
+The catalog is filled at download time (`s2_utils.collect_region`) and queried by the EDA and KMeans stages instead of
+rescanning `data/img_s2/{event}` and re-reading the rasters.
+
+This file can be imported as a module and contains the following functions:
+    * parse_s2_filename - return the observation id and image date parsed from an image filename;
+    * connect_catalog - return a connection to the catalog (the tables and indexes are created if missing);
+    * read_scene_info - return the georeferencing and the cloud/water statistics of an image;
+    * scene_mtime - return the last modification time of an image and its NDWI and cloud masks;
+    * register_scene - add or update an image in the catalog;
+    * build_catalog - update the catalog with the images stored in the event folders (new, modified and deleted files);
+    * query_scenes - return a DataFrame of the images matching the specified filters.
+"""
+
+# import libraries
+import os
+import re
+import sqlite3
+import rasterio
+import numpy as np
+import pandas as pd
+from rasterio.warp import transform_bounds
+from utils import global_utils
+
+# default location of the catalog
+catalog_path = 'data/img_s2/catalog.sqlite'
+
+def parse_s2_filename(filename):
+    """
+    Parse the observation id and the image date from an image filename
+
+    Args:
+        filename (str): The image filename (e.g., '45358_20230711T153821_20230711T154201_T18TXP_VIS.tif')
+
+    Returns:
+        id (str): The flood event observation id (e.g., '45358' or 'MNTM3_114')
+        date (str): The image date (e.g., '20230711')
+    """
+    parts = filename.split('_')
+    if parts[0].isdigit():
+        id = parts[0]
+    else:
+        id = '_'.join(parts[:2])
+    match = re.findall(r'_(\d{8})T', filename)
+    date = match[0] if match else None
+    return id, date
+
+def connect_catalog(path=catalog_path):
+    """
+    Connect to the catalog and create the tables and indexes if missing
+
+    Args:
+        path (str): The path to the SQLite file
+
+    Returns:
+        sqlite3.Connection: The connection to the catalog
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS scenes (
+            scene_key INTEGER PRIMARY KEY,
+            filename TEXT UNIQUE NOT NULL,
+            filename_ndwi TEXT,
+            filename_cloud TEXT,
+            id TEXT,
+            date TEXT,
+            dir TEXT,
+            dir_ndwi TEXT,
+            dir_cloud TEXT,
+            event TEXT,
+            crs TEXT,
+            width INTEGER,
+            height INTEGER,
+            left REAL,
+            bottom REAL,
+            right REAL,
+            top REAL,
+            cloud_percentage REAL,
+            valid_percentage REAL,
+            water_percentage REAL,
+            mtime REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_scenes_id ON scenes (id);
+        CREATE INDEX IF NOT EXISTS idx_scenes_date ON scenes (date);
+        CREATE INDEX IF NOT EXISTS idx_scenes_event ON scenes (event);
+        CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree (scene_key, min_lon, max_lon, min_lat, max_lat);
+    ''')
+
+    # add the modification time to the catalogs created before it was tracked (their images are registered again once)
+    if 'mtime' not in [row[1] for row in conn.execute('PRAGMA table_info(scenes)')]:
+        conn.execute('ALTER TABLE scenes ADD COLUMN mtime REAL')
+    return conn
+
+def read_scene_info(vis_path, ndwi_path, cloud_path, ndwi_threshold=-0.1):
+    """
+    Read the georeferencing of an image and compute its cloud and water statistics
+
+    Args:
+        vis_path (str): The path to the image (True Color)
+        ndwi_path (str): The path to the NDWI file
+        cloud_path (str): The path to the cloud and shadow mask
+        ndwi_threshold (float): The NDWI threshold used to distinguish water from non-water areas
+
+    Returns:
+        dict: The CRS, shape, native bounds, cloud and valid pixel percentages and water percentage (of the cloud-free pixels) of the image
+    """
+    if vis_path.endswith('.npy'):
+        _, bounds, crs, _, profile = global_utils.read_npy(vis_path)
+        width, height = profile['width'], profile['height']
+    else:
+        with rasterio.open(vis_path) as src:
+            bounds, crs, width, height = src.bounds, src.crs, src.width, src.height
+
+    cloud_mask = global_utils.read_band(cloud_path)
+    ndwi = global_utils.read_band(ndwi_path)
+    valid_mask = cloud_mask == 0
+    n_valid = np.sum(valid_mask)
+    water_percentage = np.sum((ndwi > ndwi_threshold) & valid_mask) / n_valid * 100 if n_valid else 0.0
+    cloud_stats = global_utils.compute_cloud_stats(cloud_mask)
+
+    return {
+        'crs': crs.to_string(),
+        'width': int(width),
+        'height': int(height),
+        'left': bounds.left,
+        'bottom': bounds.bottom,
+        'right': bounds.right,
+        'top': bounds.top,
+        'cloud_percentage': cloud_stats['cloud_percentage'],
+        'valid_percentage': cloud_stats['valid_percentage'],
+        'water_percentage': float(water_percentage)
+    }
+
+def scene_mtime(filename, dir_vis, dir_ndwi, dir_cloud):
+    """
+    Return the last modification time of an image and its NDWI and cloud masks
+
+    Args:
+        filename (str): The image filename (True Color)
+        dir_vis (str): The directory of the image (True Color)
+        dir_ndwi (str): The directory of the NDWI file
+        dir_cloud (str): The directory of the cloud and shadow mask
+
+    Returns:
+        float: The latest modification time of the existing files (None if none exists)
+    """
+    paths = [os.path.join(dir_vis, filename), os.path.join(dir_ndwi, filename.replace('VIS', 'NDWI')),
+             os.path.join(dir_cloud, filename.replace('VIS', 'CLOUD'))]
+    mtimes = [os.path.getmtime(file_path) for file_path in paths if os.path.exists(file_path)]
+    return max(mtimes) if mtimes else None
+
+def register_scene(filename, dir_vis, dir_ndwi, dir_cloud, path=catalog_path):
+    """
+    Add an image (and its NDWI and cloud masks) to the catalog, or update it if already registered
+
+    Args:
+        filename (str): The image filename (True Color)
+        dir_vis (str): The directory of the image (True Color)
+        dir_ndwi (str): The directory of the NDWI file
+        dir_cloud (str): The directory of the cloud and shadow mask
+        path (str): The path to the SQLite file
+    """
+    id, date = parse_s2_filename(filename)
+    filename_ndwi = filename.replace('VIS', 'NDWI')
+    filename_cloud = filename.replace('VIS', 'CLOUD')
+    info = read_scene_info(os.path.join(dir_vis, filename), os.path.join(dir_ndwi, filename_ndwi), os.path.join(dir_cloud, filename_cloud))
+    record = {
+        'filename': filename,
+        'filename_ndwi': filename_ndwi,
+        'filename_cloud': filename_cloud,
+        'id': id,
+        'date': date,
+        'dir': dir_vis,
+        'dir_ndwi': dir_ndwi,
+        'dir_cloud': dir_cloud,
+        'event': dir_vis.rstrip('/').split('/')[-1],
+        **info,
+        'mtime': scene_mtime(filename, dir_vis, dir_ndwi, dir_cloud)
+    }
+
+    # footprint in longitude/latitude for the R-tree index
+    min_lon, min_lat, max_lon, max_lat = transform_bounds(info['crs'], 'EPSG:4326', info['left'], info['bottom'], info['right'], info['top'])
+
+    columns = list(record.keys())
+    conn = connect_catalog(path)
+    with conn:
+        conn.execute(
+            f"INSERT INTO scenes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(filename) DO UPDATE SET {', '.join(f'{col} = excluded.{col}' for col in columns[1:])}",
+            list(record.values()))
+        scene_key = conn.execute('SELECT scene_key FROM scenes WHERE filename = ?', (filename,)).fetchone()[0]
+        conn.execute('INSERT OR REPLACE INTO scenes_rtree VALUES (?, ?, ?, ?, ?)', (scene_key, min_lon, max_lon, min_lat, max_lat))
+    conn.close()
+
+def build_catalog(event_list, path=catalog_path):
+    """
+    Update the catalog with the images stored in the event folders
+
+    Args:
+        event_list (list of str): The event folders to scan (e.g., ['2023-07'])
+        path (str): The path to the SQLite file
+
+    Notes:
+        Only the new images and the images modified since they were registered (modification time of the image or its
+        masks) are read. The images of the scanned events whose files no longer exist are removed from the catalog
+    """
+    global_utils.print_func_header('update the image catalog from the event folders')
+    conn = connect_catalog(path)
+    registered = {filename: (scene_key, dir_vis, mtime) for scene_key, filename, dir_vis, mtime
+                  in conn.execute(f"SELECT scene_key, filename, dir, mtime FROM scenes WHERE event IN ({', '.join('?' * len(event_list))})", event_list)}
+
+    # remove the images whose files were deleted
+    deleted = [scene_key for filename, (scene_key, dir_vis, _) in registered.items() if not os.path.exists(os.path.join(dir_vis, filename))]
+    with conn:
+        conn.executemany('DELETE FROM scenes WHERE scene_key = ?', [(scene_key,) for scene_key in deleted])
+        conn.executemany('DELETE FROM scenes_rtree WHERE scene_key = ?', [(scene_key,) for scene_key in deleted])
+    conn.close()
+    if deleted:
+        print(f'removed {len(deleted)} deleted images from the catalog')
+
+    for event in event_list:
+        event_dir = f'data/img_s2/{event}/'
+        if not os.path.exists(event_dir):
+            continue
+        dir_ndwi, dir_cloud = f'data/img_s2/{event}_NDWI/', f'data/img_s2/{event}_CLOUD/'
+        n_updated = 0
+        for filename in os.listdir(event_dir):
+            if not filename.endswith(('_VIS.tif', '_VIS.npy')):
+                continue
+
+            # skip the images unchanged since they were registered
+            if filename in registered and registered[filename][2] == scene_mtime(filename, event_dir, dir_ndwi, dir_cloud):
+                continue
+            register_scene(filename, event_dir, dir_ndwi, dir_cloud, path)
+            n_updated += 1
+        print(f'complete - {event} ({n_updated} images added or updated)')
+
+def query_scenes(events=None, ids=None, start_date=None, end_date=None, bbox=None, max_cloud=None, path=catalog_path):
+    """
+    Query the images matching the specified filters
+
+    Args:
+        events (list of str): The events to be selected
+        ids (list of str): The flood event observation ids to be selected
+        start_date (str): The first image date to be selected (e.g., '20230701')
+        end_date (str): The last image date to be selected (e.g., '20230731')
+        bbox (tuple of float): The bounding box (min_lon, min_lat, max_lon, max_lat) the image footprints should intersect
+        max_cloud (float): The maximum cloud and shadow percentage
+        path (str): The path to the SQLite file
+
+    Returns:
+        pd.DataFrame: The images with their metadata (same columns as `eda_s2_utils.create_s2_df` plus georeferencing and statistics)
+    """
+    conditions = []
+    params = []
+    if events is not None:
+        conditions.append(f"s.event IN ({', '.join('?' * len(events))})")
+        params += list(events)
+    if ids is not None:
+        conditions.append(f"s.id IN ({', '.join('?' * len(ids))})")
+        params += [str(i) for i in ids]
+    if start_date is not None:
+        conditions.append('s.date >= ?')
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append('s.date <= ?')
+        params.append(end_date)
+    if max_cloud is not None:
+        conditions.append('s.cloud_percentage <= ?')
+        params.append(max_cloud)
+    if bbox is not None:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        conditions.append('s.scene_key IN (SELECT scene_key FROM scenes_rtree WHERE max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ?)')
+        params += [min_lon, max_lon, min_lat, max_lat]
+
+    query = 'SELECT s.* FROM scenes s'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY s.event, s.filename'
+
+    conn = connect_catalog(path)
+    df = pd.read_sql_query(query, conn, params=params)
+    conn.close()
+    return df.drop(columns=['scene_key', 'mtime'])
@@ -4,30 +4,24 @@ This script includes the functions used to organize and analyze the collected Se
 This file can be imported as a module and contains the following functions:
     * check_s2_folder - delete empty folders;
     * create_s2_df - return a DataFrame containing organized image information;
-    * assign_period_label - return a label indicating whether it was taken before, during, or after a flood event;
     * add_metadata_flood_event - return a DataFrame with additional flood-related information;
     * plot_s2 - plot the image grouped by ids for visual inspection;
     * check_cloud_cover - return the percentage of cloud and shadow coverage;
     * select_s2 - return the ideal dataset;
-    * test_ndwi_tif - plot the results of applying different NDWI threshold values to identify water areas;
-    * download_nhd_shape - download the flowline shapefiles for specified states;
+    * test_ndwi_tif - plot the results of applying different NDWI threshold values and save the water fractions and Otsu thresholds;
+    * download_file - stream a file to disk, resuming a partial download;
+    * download_nhd_shape - download the flowline shapefiles for specified states (skipped if unchanged);
     * add_nhd_layer_s2 - plot flowlines on top of Sentinel-2 images and plot other figures (Sentinel-2, cloud mask, NDWI mask) individually
 """
 
 # import libraries
 import os
-import re
+import json
 import requests
 import zipfile
-import rasterio
 import pandas as pd
 import numpy as np
-import geopandas as gpd
-from pyproj import Transformer
-from rasterio.plot import show
-import matplotlib.pyplot as plt
-from utils import global_utils, kmeans_utils
-from datetime import datetime, timedelta
+from utils import global_utils, catalog_utils, period_utils, render_utils, ndwi_utils, nhd_utils, proj_utils
 
 flood_event_periods = global_utils.flood_event_periods
 
@@ -64,112 +58,33 @@ def create_s2_df(df):
                            in the DataFrame represents an observation of a flood event.
  
     Returns:
-        pd.DataFrame: A DataFrame containing organized image information with columns 'filename_vis', 'filename_mask', 'filename_ndwi',
-                      'dir', 'date', 'period', 'obs_id', 'event', 'lat', 'lon', 'note', and 'category'.
+        pd.DataFrame: A DataFrame containing organized image information with columns 'filename', 'filename_ndwi', 'filename_cloud',
+                      'id', 'date', 'dir', 'dir_ndwi', 'dir_cloud', 'event', the georeferencing ('crs', 'width', 'height', 'left',
+                      'bottom', 'right', 'top') and the statistics ('cloud_percentage', 'water_percentage').
                       Each row is the DataFrame represents a Sentinel-2 image with its metadata. 
     
     Notes:
+        - The images are queried from the catalog (`catalog_utils`), which is filled at download time and updated from
+          the event folders first (new, modified and deleted files only, see `catalog_utils.build_catalog`);
         - The DataFrame is also saved as a CSV file at 'data/df_s2/df_s2.csv'.
     """
     print('--------------------------------------------------------------')
     print('Create a DataFrame to organize the collected images...\n')
 
     # find the event list to iterate over folders storing Sentinel-2 images
-    event_list = df['event'].unique()
+    event_list = df['event'].unique().tolist()
 
-    # store the image information
-    image_data = {}
-    for event in event_list:
+    # update the catalog with the images added, modified or deleted in the event folders since they were registered
+    catalog_utils.build_catalog(event_list)
 
-        # construct the path to the image directory
-        event_dir = f'data/img_s2/{event}/'
-        if os.path.exists(event_dir):
-            if os.listdir(event_dir):
-
-                # iterate over files in the directory
-                for filename in os.listdir(event_dir):
-
-                    # extract the image id and date
-                    parts = filename.split('_')
-                    if parts[0].isdigit():
-                        id = parts[0]
-                    else:
-                        id = '_'.join(parts[:2])
-                    check_pattern = r'_(\d{8})T'
-                    event_name = event_dir.split('/')[-2]
-                    match = re.findall(check_pattern, filename)
-                    if match:
-                        date = match[0]
-
-                    # retrieve the corresponding NDWI and cloud with shadow mask tif filenames and dirs
-                    filename_ndwi = filename.replace('VIS', 'NDWI')
-                    filename_cloud = filename.replace('VIS', 'CLOUD')
-                    dir_ndwi = f'data/img_s2/{event}_NDWI/'
-                    dir_cloud = f'data/img_s2/{event}_CLOUD/'
-
-                    # check if the id is already stored
-                    if filename not in image_data:
-                        image_data[filename] = {
-                            'filename': filename,
-                            'filename_ndwi': filename_ndwi,
-                            'filename_cloud': filename_cloud,
-                            'id': id,
-                            'date': date,
-                            'dir': event_dir,
-                            'dir_ndwi': dir_ndwi,
-                            'dir_cloud': dir_cloud,
-                            'event': event_name
-                        }
-                
-    # convert the data to a DataFrame
-    images_data = list(image_data.values())
-    df_s2 = pd.DataFrame(images_data)
+    # query the image information
+    df_s2 = catalog_utils.query_scenes(events=event_list)
 
     global_utils.describe_df(df_s2, 'image')
     # save to a CSV file
     df_s2.to_csv('data/df_s2/df_s2.csv', index=False)
     return df_s2 
 
-def assign_period_label(row, day_adjust_dict):
-    """
-    Assign labels to the image indicating whether it was taken before, during, or after a flood event
-
-    Args:
-        row (pd.Series): A row of data containing information about the image and the event
-        day_adjust_dict (dict):  A dictionary to assign period (before, during, or after flood)
-        
-    Returns:
-        str: A label indicating whether it was taken before, during, or after a flood event
-    """
-    date = datetime.strptime(row['date'], '%Y%m%d')
-    source = row['source']
-    start_adjust, end_adjust = day_adjust_dict[source]
-
-    # category 'gauge'
-    if source == 'gauge':
-        # adjust using +/- timedelta(days=i) after analyzing s2_selected ()
-        event_start = datetime.strptime(row['event_day'], '%Y-%m-%d') - timedelta(days=start_adjust)
-        event_end = datetime.strptime(row['event_day'], '%Y-%m-%d') + timedelta(days=end_adjust)
-        if date < event_start:
-            return 'before flood'
-        elif event_start <= date <= event_end:
-            return 'during flood'
-        else:
-            return 'after flood'
-    
-    # category 'stn'
-    elif source == 'stn':
-        # adjust using +/- timedelta(days=i) after analyzing s2_selected ()
-        event_start, event_end = row['event_day'].split(' to ')
-        start_day = datetime.strptime(event_start, '%Y-%m-%d') - timedelta(days=start_adjust)
-        end_day = datetime.strptime(event_end, '%Y-%m-%d') + timedelta(days=end_adjust)
-        if date < start_day:
-            return 'before flood'
-        elif start_day <= date <= end_day:
-            return 'during flood'
-        else:
-            return 'after flood'
-
 def add_metadata_flood_event(flood_event, s2, attr_list, day_adjust_dict):
     """
     Add additional information to the image dataframe
@@ -186,7 +101,7 @@ def add_metadata_flood_event(flood_event, s2, attr_list, day_adjust_dict):
     global_utils.print_func_header('merge additional information from the flood event dataframe')
     df_s2_mod = s2.copy()
     df_s2_mod = pd.merge(s2, flood_event[attr_list], on='id', how='left')
-    df_s2_mod['period'] = df_s2_mod.apply(assign_period_label, axis=1, day_adjust_dict=day_adjust_dict)
+    df_s2_mod['period'] = period_utils.label_periods(df_s2_mod, day_adjust_dict)
     global_utils.describe_df(df_s2_mod, 'image with metadata')
 
     df_s2_mod.to_csv('data/df_s2/df_s2_mod.csv', index=False)
@@ -224,11 +139,11 @@ def check_cloud_cover(path):
     
     Returns:
         float: The percentage of cloud and shadow mask
+
+    Notes:
+        The percentage is read from the image metadata (see `global_utils.get_cloud_stats`) instead of the pixels
     """
-    with rasterio.open(path) as src:
-        cloud_mask = src.read(1)
-        cloud_percentage = np.mean(cloud_mask == 1) * 100
-        return cloud_percentage
+    return global_utils.get_cloud_stats(path)['cloud_percentage']
 
 def select_s2(df, cloud_threshold, date_drop, flood_day_adjust_dict=None, explore=None):
     '''
@@ -239,7 +154,7 @@ def select_s2(df, cloud_threshold, date_drop, flood_day_adjust_dict=None, explor
         event_selection (list of str): A list of events used to filter the DataFrame
         cloud_threshold (int): A threshold to drop image with much cloud
         date_drop (list of str): A list of image date used to filter teh DataFrame
-        flood_day_adjust_dict (dict): A dictionary used to adjust period labels in `assign_period_label`
+        flood_day_adjust_dict (dict): A dictionary used to adjust period labels in `period_utils.label_periods`
         explore (str): If set to 'complete', additional cleaning steps are added. If None, only process event_selection and plot for examination
 
     Returns:
@@ -264,17 +179,16 @@ def select_s2(df, cloud_threshold, date_drop, flood_day_adjust_dict=None, explor
     global_utils.plot_helper(unique_ids, df_mod, 's2_event_selected')
 
     if explore == 'complete':
-        # df_mod['period'] = df_mod.apply(assign_period_label, axis=1, day_adjust_dict=flood_day_adjust_dict)
-        # df_mod['period'] = df_mod.apply(lambda row: assign_period_label(row, day_adjust_dict=flood_day_adjust_dict), axis=1)
+        # df_mod['period'] = period_utils.label_periods(df_mod, flood_day_adjust_dict)
         df_ready = df_mod[~df_mod['date'].isin(date_drop)].copy()
-        drop_list = []
-        for index, row in df_ready.iterrows():
-            cloud_mask_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
-            cloud_percentage = check_cloud_cover(cloud_mask_path)
-            if cloud_percentage > cloud_threshold:
-                drop_list.append(index)
-        
-        df_ready.drop(drop_list, inplace=True)
+
+        # use the cloud percentage stored in the catalog, read the cloud masks only for images missing it
+        if 'cloud_percentage' not in df_ready.columns:
+            df_ready['cloud_percentage'] = np.nan
+        missing = df_ready['cloud_percentage'].isna()
+        df_ready.loc[missing, 'cloud_percentage'] = [check_cloud_cover(os.path.join(row['dir_cloud'], row['filename_cloud'])) for _, row in df_ready[missing].iterrows()]
+
+        df_ready = df_ready[df_ready['cloud_percentage'] <= cloud_threshold]
         df_ready.reset_index(drop=True, inplace=True)
         unique_ids = df_ready['id'].unique()
         global_utils.describe_df(df_ready, 'ready-to-use image dataset')
@@ -291,38 +205,94 @@ def select_s2(df, cloud_threshold, date_drop, flood_day_adjust_dict=None, explor
     else:
         return df_mod
 
-def test_ndwi_tif(df, threshold_list):
+def test_ndwi_tif(df, threshold_list, sweep_list=None):
     """
     Test different NDWI threshold values to identify water areas
 
     Args:
         df (pd.DataFrame): A DataFrame used to test NDWI threshold
-        threshold_list (list of str): A list of NDWI threshold values
+        threshold_list (list of str): A list of NDWI threshold values (plotted)
+        sweep_list (list of float): A list of NDWI threshold values for the water fractions (defaults to threshold_list)
+
+    Notes:
+        The water fractions of each scene and all the scenes together are saved to 'data/df_s2/ndwi_threshold_sweep.csv'
+        and their Otsu thresholds to 'data/df_s2/ndwi_threshold_otsu.csv'
     """
     global_utils.print_func_header(f'test ndwi threshold list {threshold_list}')
-    for _, row in df.iterrows():
-        file_path = os.path.join(row['dir_ndwi'], row['filename_ndwi'])
-        cloud_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
-        base_name = os.path.basename(file_path)
-        global_utils.print_func_header(f'explore and define ndwi mask threshold for {base_name}')
-        filename = base_name.replace('_NDWI.tif', '')
-        with rasterio.open(file_path) as src:
-            ndwi_mask = src.read(1)
-
-        ndwi_mask = global_utils.apply_cloud_mask(ndwi_mask, cloud_path)
-
-        fig, axes = plt.subplots(1, len(threshold_list), figsize=(4 * len(threshold_list), 5))
-        fig.suptitle(f'NDWI threshold exploration for {filename}')
-        for ax, threshold in zip(axes, threshold_list):
-            binary_water_mask = ndwi_mask > threshold 
-            ax.imshow(binary_water_mask, cmap='gray')
-            ax.set_title(f'threshold: {threshold}')
-            ax.axis('off')
-
-        plt.tight_layout()
-        plt.savefig(f"figs/s2_ndwi_test/{row['id']}_{row['date']}_NDWI_test.png")
-        plt.close()
-        print(f"complete - {filename}")
+
+    # compute the water fractions from the NDWI histograms of the scenes
+    df_sweep, df_otsu = ndwi_utils.sweep_thresholds(df, threshold_list if sweep_list is None else sweep_list)
+    df_sweep.to_csv('data/df_s2/ndwi_threshold_sweep.csv', index=False)
+    df_otsu.to_csv('data/df_s2/ndwi_threshold_otsu.csv', index=False)
+    print(f"Otsu threshold (all scenes): {df_otsu['otsu_threshold'].iloc[-1]:.3f}")
+
+    def build_jobs():
+        for _, row in df.iterrows():
+            file_path = os.path.join(row['dir_ndwi'], row['filename_ndwi'])
+            cloud_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
+            filename = os.path.splitext(os.path.basename(file_path))[0].replace('_NDWI', '')
+
+            # skip the figure if the masks and thresholds are unchanged
+            output = f"figs/s2_ndwi_test/{row['id']}_{row['date']}_NDWI_test.png"
+            key = render_utils.figure_key(inputs=[file_path, cloud_path], params={'threshold_list': threshold_list}, sources=[__file__])
+            if render_utils.is_cached(output, key):
+                continue
+
+            # set cloud and shadow pixels to NaN (never above a threshold)
+            max_size = render_utils.target_size((4 * len(threshold_list), 5), len(threshold_list))
+            ndwi, _, _ = render_utils.load_image(file_path, max_size)
+            cloud_mask, _, _ = render_utils.load_image(cloud_path, max_size)
+            ndwi_mask = np.where(cloud_mask == 0, ndwi, np.nan)
+
+            yield {
+                'output': output,
+                'figsize': (4 * len(threshold_list), 5),
+                'suptitle': f'NDWI threshold exploration for {filename}',
+                'panels': [{'image': ndwi_mask, 'threshold': threshold, 'cmap': 'gray', 'title': f'threshold: {threshold}', 'axis_off': True} for threshold in threshold_list],
+                'cache_key': key
+            }
+
+    render_utils.render_jobs(build_jobs())
+
+def download_file(url, file_path, etag=None, chunk_size=1 << 20):
+    """
+    Stream a file to disk, resuming a partial download with an HTTP range request
+
+    Args:
+        url (str): The URL of the file
+        file_path (str): The path where the file is saved (the partial download is kept in '{file_path}.part')
+        etag (str): The ETag of the remote file, used to resume only if the file is unchanged
+        chunk_size (int): The number of bytes written at once
+
+    Returns:
+        str: The path of the downloaded file
+
+    Notes:
+        A partial download that is already complete (e.g., interrupted before it was renamed) is answered with 416 by the
+        server and kept as is
+    """
+    part_path = f'{file_path}.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {}
+    if offset and etag:
+        headers = {'Range': f'bytes={offset}-', 'If-Range': etag}
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as res:
+
+        # the requested range starts at the end of the file, the partial download is complete
+        if res.status_code == 416 and 'Range' in headers:
+            os.replace(part_path, file_path)
+            return file_path
+        res.raise_for_status()
+
+        # the server sends the whole file (200) if the range is not supported or the file changed
+        mode = 'ab' if res.status_code == 206 else 'wb'
+        with open(part_path, mode) as f:
+            for chunk in res.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+    os.replace(part_path, file_path)
+    return file_path
 
 def download_nhd_shape(content_list, area_list):
     """
@@ -331,33 +301,61 @@ def download_nhd_shape(content_list, area_list):
     Args:
         area_list (list of str): The specified states for which NHD data needs to be collected
         content_list: The specified components of the NHD data
+
+    Notes:
+        The ETag (or Last-Modified date) and the contents of each archive are stored in 'data/nhd/{state}/download.json', so an unchanged
+        archive whose selected components are already extracted (or absent from the archive) is not downloaded again
     """
     global_utils.print_func_header('download NHD')
     for i in area_list:
 
     # construct URL to download NHD (e.g., https://prd-tnm.s3.amazonaws.com/StagedProducts/Hydrography/NHD/State/Shape/NHD_H_Vermont_State_Shape.zip)
         url = f'https://prd-tnm.s3.amazonaws.com/StagedProducts/Hydrography/NHD/State/Shape/NHD_H_{i}_State_Shape.zip'
-
-        # download the ZIP file to the specified directory
         dir = f'data/nhd/{i}'
         os.makedirs(dir, exist_ok=True)
         name = os.path.basename(url)
         file_path = os.path.join(dir, name)
-        res = requests.get(url)
-        with open(file_path, 'wb') as f:
-            f.write(res.content)
+
+        # skip the archive if unchanged and the selected components are already extracted
+        meta_path = os.path.join(dir, 'download.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        headers = requests.head(url, timeout=60).headers
+        etag = headers.get('ETag') or headers.get('Last-Modified')
+        extracted = set(meta.get('extracted', []))
+        contents = meta.get('contents')
+        missing = [item for item in content_list if (contents is None or item in contents)
+                   and (item not in extracted or not os.path.exists(os.path.join(dir, item)))]
+        if etag is not None and etag == meta.get('etag') and not missing:
+            print(f'NHD for {i} is up to date - skip')
+            continue
+
+        # stream the ZIP file to the specified directory (resumed if a partial download of the same archive exists)
+        resume_etag = etag if etag == meta.get('etag') else None
+        meta = {'url': url, 'etag': etag, 'contents': None, 'extracted': []}
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=4)
+        download_file(url, file_path, resume_etag)
         print(f'download NHD for {i} - {name}')
 
         # extract the flowline-related files 
         with zipfile.ZipFile(file_path, 'r') as z:
             contents = z.namelist()
-            
+            meta['contents'] = contents
+
             for item in content_list:
                 if item in contents:
                     z.extract(item, dir)
+                    meta['extracted'].append(item)
                     print(f'\nextract {i} {item}')
+                else:
+                    print(f'\n{item} is not in the archive for {i} - skip')
 
-        # delete the ZIP file
+        # record the extracted components and delete the ZIP file
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=4)
         os.remove(file_path)
 
         # explore the contents within the ZIP file
@@ -374,82 +372,68 @@ def add_nhd_layer_s2(df, area, area_abbr_list):
         area_abbr_list (dict): A dictionary mapping full state names to their abbreviations
     '''
     global_utils.print_func_header('plot image and all masks (cloud, NDWI, flowline) individually')
-    for i in area:
 
-        # read the shapefile into a GeoDataFrame
-        shp_path = f'data/nhd/{i}/Shape/NHDFlowline.shp'
+    figure_types = ['s2', 's2_flowline', 'ndwi', 'cloud']
 
-        # flowline['ftype'] or ['fcode'] (might be helpful for extracting major river?) 
-        major_river = [558]
-        flowline = gpd.read_file(shp_path)
-        major_rivers = flowline[(flowline['ftype'].isin(major_river)) & (flowline['lengthkm'] >= 0.6)]
+    def figure_keys(row, gpkg_path):
+        # cache keys of the figures of an image (the flowlines are keyed on the major river layer)
+        image_path = os.path.join(row['dir'], row['filename'])
+        ndwi_path = os.path.join(row['dir_ndwi'], row['filename_ndwi'])
+        cloud_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
+        name = f"{row['id']}_{row['date']}"
+        params = {'id': row['id'], 'date': row['date'], 'latitude': row['latitude'], 'longitude': row['longitude']}
+        return {figure: (f'figs/s2/{name}_{figure}.png', render_utils.figure_key(
+                    inputs=[image_path, ndwi_path, cloud_path] + ([gpkg_path] if figure == 's2_flowline' else []),
+                    params={**params, 'figure': figure}, sources=[__file__]))
+                for figure in figure_types}
 
-        # filter the DataFrame for the current state's data during the flood event
-        i_abbr = area_abbr_list[i]
-        df_i = df[df['state'] == i_abbr]
+    def build_jobs(i, df_i):
+        # transform the flood event observation locations to the CRS of their images (one call per CRS)
+        xs, ys = proj_utils.project_points(df_i)
 
         # plot all the mask (original Sentinel-2, NDWI mask, flowline) for each image
-        for _, row in df_i.iterrows():
+        for (_, row), point in zip(df_i.iterrows(), zip(xs, ys)):
+            keys = figure_keys(row, nhd_utils.major_rivers_path(i))
+            redraw = {figure: (output, key) for figure, (output, key) in keys.items() if not render_utils.is_cached(output, key)}
+            if not redraw:
+                continue
+
             image_path = os.path.join(row['dir'], row['filename'])
             ndwi_path = os.path.join(row['dir_ndwi'], row['filename_ndwi'])
             cloud_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
-            _, sat_bounds, tiff_crs, _, _  = kmeans_utils.read_tif(image_path) 
-
-            ndwi_mask = global_utils.read_ndwi_tif(ndwi_path)
-            ndwi_mask = global_utils.apply_cloud_mask(ndwi_mask, cloud_path)
-
-            # extract the flowline mask
-            if major_rivers.crs != tiff_crs:
-                major_rivers = major_rivers.to_crs(tiff_crs)
-
-            # plot satellite image
-            lat = row['latitude']
-            lon = row['longitude']
-            transformer = Transformer.from_crs("EPSG:4326", tiff_crs, always_xy=True)
-            raster_x, raster_y = transformer.transform(lon, lat)
-
-            fig, ax = plt.subplots(figsize=(10, 10))
-            with rasterio.open(image_path) as src:
-                show(src, ax=ax, title=f"S2 - ID: {row['id']}, Date: {row['date']}")
-                ax.plot(raster_x, raster_y, 'ro', markersize=6, zorder=3)
-            plt.tight_layout()
-            output_filename = f"{row['id']}_{row['date']}_s2.png"
-            plt.savefig(f'figs/s2/{output_filename}')
-            plt.close(fig)
-
-            fig, ax = plt.subplots(figsize=(10, 10))
-            with rasterio.open(image_path) as src:
-                show(src, ax=ax, title=f"S2 with flowline - ID: {row['id']}, Date: {row['date']}")
-            major_rivers.plot(ax=ax, color='cyan', linewidth=0.5)
-            ax.set_xlim(sat_bounds.left, sat_bounds.right)
-            ax.set_ylim(sat_bounds.bottom, sat_bounds.top)
-            plt.tight_layout()
-            output_filename = f"{row['id']}_{row['date']}_s2_flowline.png"
-            plt.savefig(f'figs/s2/{output_filename}')
-            plt.close(fig)
-
-            fig, ax = plt.subplots(figsize=(10, 10))
-            cmap = plt.cm.gray
-            cmap.set_bad(color='black')
-            ax.imshow(ndwi_mask, cmap=cmap)
-            ax.set_title(f"NDWI - ID: {row['id']}, Date: {row['date']}")
-            ax.axis('off')
-            plt.tight_layout()
-            output_filename = f"{row['id']}_{row['date']}_ndwi.png"
-            plt.savefig(f'figs/s2/{output_filename}')
-            plt.close(fig)
-
-            fig, ax = plt.subplots(figsize=(10, 10))
-            with rasterio.open(cloud_path) as src:
-                cloud_mask = src.read(1) 
-            ax.imshow(cloud_mask, cmap='gray')
-            ax.set_title(f"Cloud - ID: {row['id']}, Date: {row['date']}")
-            ax.axis('off')
-            plt.tight_layout()
-            output_filename = f"{row['id']}_{row['date']}_cloud.png"
-            plt.savefig(f'figs/s2/{output_filename}')
-            plt.close(fig)
-
-            print(f"complete - plot image and all masks individually {row['filename']}")
-        
-        print(f"complete - {i}")
\ No newline at end of file
+
+            # load the image and masks decimated to the figure resolution once for all the figures
+            max_size = render_utils.target_size((10, 10))
+            sat_image, extent, tiff_crs = render_utils.load_image(image_path, max_size)
+            ndwi, _, _ = render_utils.load_image(ndwi_path, max_size)
+            cloud_mask, _, _ = render_utils.load_image(cloud_path, max_size)
+
+            # water mask with cloud and shadow pixels set to NaN (same as read_ndwi_tif + apply_cloud_mask)
+            ndwi_mask = np.where(cloud_mask == 0, np.where(ndwi > -0.1, 1.0, 0.0), np.nan)
+
+            # load the major rivers intersecting the image
+            lines = []
+            if 's2_flowline' in redraw:
+                left, right, bottom, top = extent
+                major_rivers = nhd_utils.load_major_rivers(i, (left, bottom, right, top), tiff_crs)
+                lines = render_utils.clip_lines(major_rivers, extent)
+
+            jobs = {
+                's2': {'figsize': (10, 10), 'panels': [{'image': sat_image, 'extent': extent, 'points': [point], 'title': f"S2 - ID: {row['id']}, Date: {row['date']}"}]},
+                's2_flowline': {'figsize': (10, 10), 'panels': [{'image': sat_image, 'extent': extent, 'lines': lines, 'limits': extent, 'title': f"S2 with flowline - ID: {row['id']}, Date: {row['date']}"}]},
+                'ndwi': {'figsize': (10, 10), 'panels': [{'image': ndwi_mask, 'cmap': 'gray', 'bad_color': 'black', 'axis_off': True, 'title': f"NDWI - ID: {row['id']}, Date: {row['date']}"}]},
+                'cloud': {'figsize': (10, 10), 'panels': [{'image': cloud_mask, 'cmap': 'gray', 'axis_off': True, 'title': f"Cloud - ID: {row['id']}, Date: {row['date']}"}]}
+            }
+            for figure, (output, key) in redraw.items():
+                yield {'output': output, 'cache_key': key, **jobs[figure]}
+
+    # build the major river layers if missing (ftype 558 and length >= 0.6 km)
+    nhd_utils.build_major_rivers(area)
+    for i in area:
+
+        # filter the DataFrame for the current state's data during the flood event
+        i_abbr = area_abbr_list[i]
+        df_i = df[df['state'] == i_abbr]
+
+        render_utils.render_jobs(build_jobs(i, df_i))
+        print(f"complete - {i}")
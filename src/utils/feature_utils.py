@@ -0,0 +1,90 @@
+"""
+This script includes the functions used to compute the per-pixel features added to the image data for KMeans clustering.
+
+The distance to the nearest major river is computed with a Euclidean distance transform on the rasterized flowline
+mask (`nhd_utils.read_flowline_mask`) in map units, in one vectorized pass per scene, and cached per scene.
+
+This file can be imported as a module and contains the following functions:
+    * flowline_distance - return the distance (m) from each pixel to the nearest major river (cached per scene);
+    * transform_distance - return the distance converted into a feature (capped or inverse distance).
+"""
+
+# import libraries
+import os
+import numpy as np
+from affine import Affine
+from scipy.ndimage import distance_transform_edt
+from utils import nhd_utils, proj_utils
+
+# directory of the cached distances
+cache_dir = 'data/features'
+
+def flowline_distance(area, crs, transform, shape, scene=None, max_distance=1000):
+    """
+    Compute the distance from each pixel of an image to the nearest major river
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+        crs (rasterio.crs.CRS): The coordinate reference system of the image
+        transform (affine.Affine): The affine transformation of the image
+        shape (tuple): The shape (height, width) of the image
+        scene (str): The name used to cache the distances (e.g., the image filename), None to skip the cache
+        max_distance (float): The distance (m) searched beyond the image bounds, larger distances are capped
+
+    Returns:
+        np.ndarray: The distances in meters (float32, capped at max_distance)
+
+    Notes:
+        The flowline mask is read with a margin of max_distance, so the rivers just outside the image are also found.
+        The cache is rebuilt if the rasterized major rivers are newer
+    """
+    height, width = shape
+    cache_path = None
+    if scene is not None:
+        crs_name = proj_utils.crs_key(crs).replace(':', '')
+        cache_path = os.path.join(cache_dir, f'{os.path.splitext(scene)[0]}_{crs_name}_{int(max_distance)}_distance.npy')
+        raster_path = nhd_utils.build_flowline_raster(area, crs)
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(raster_path):
+            distance = np.load(cache_path)
+            if distance.shape == (height, width):
+                return distance
+
+    # read the flowline mask with a margin around the image
+    res_x, res_y = abs(transform.a), abs(transform.e)
+    pad_x, pad_y = int(np.ceil(max_distance / res_x)), int(np.ceil(max_distance / res_y))
+    padded_transform = transform * Affine.translation(-pad_x, -pad_y)
+    flowline_mask = nhd_utils.read_flowline_mask(area, crs, padded_transform, (height + 2 * pad_y, width + 2 * pad_x))
+
+    # Euclidean distance (m) to the nearest flowline pixel
+    if flowline_mask.any():
+        distance = distance_transform_edt(flowline_mask == 0, sampling=(res_y, res_x))
+    else:
+        distance = np.full(flowline_mask.shape, max_distance)
+    distance = np.minimum(distance[pad_y:pad_y + height, pad_x:pad_x + width], max_distance).astype(np.float32)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_path, distance)
+    return distance
+
+def transform_distance(distance, mode='inverse', max_distance=100, min_distance=10):
+    """
+    Convert the distances to the nearest major river into a feature
+
+    Args:
+        distance (np.ndarray): The distances in meters (see `flowline_distance`)
+        mode (str): 'capped' - distance capped at max_distance; 'inverse' - inverse distance within max_distance, 0 beyond;
+                    'distance' - distance unchanged
+        max_distance (float): The distance (m) where the feature is capped (or set to 0 for the inverse distance)
+        min_distance (float): The minimum distance (m) used for the inverse distance (e.g., the pixel size), avoids division by 0
+
+    Returns:
+        np.ndarray: The feature (float32)
+    """
+    if mode == 'capped':
+        return np.minimum(distance, max_distance).astype(np.float32)
+    if mode == 'inverse':
+        return np.where(distance <= max_distance, 1 / np.maximum(distance, min_distance), 0).astype(np.float32)
+    if mode == 'distance':
+        return distance.astype(np.float32)
+    raise ValueError(f'unknown distance mode: {mode}')
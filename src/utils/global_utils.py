@@ -5,18 +5,29 @@ This file can be imported as a module and includes the following functions:
     * print_func_header - print a summary of the running function;
     * describe_df - print an overview of the dataframe;
     * plot_helper - plot images grouped by id;
+    * read_npy - return the image data and metadata from a NumPy array with a JSON georeferencing sidecar;
+    * read_band - return the first band of a GeoTIFF or NumPy image;
+    * build_overviews - build the internal overviews of a GeoTIFF used by the decimated reads for the figures;
+    * compute_cloud_stats - return the cloud and valid pixel percentages computed from the cloud mask;
+    * write_cloud_stats - compute the cloud and valid pixel percentages once and store them in the image metadata;
+    * get_cloud_stats - return the cloud and valid pixel percentages from the image metadata;
     * apply_cloud_mask - return a image with apply cloud mask by assigning NaN to cloud ans shadow pixels;
     * read_ndwi_tif - return the NDWI mask;
     * str_to_list - return a list of float numbers converted from a string representation.
 """
 # import libaries
 import os
+import shapely
+import json
 import rasterio
 import numpy as np
 import geopandas as gpd
-from rasterio.plot import show
-from pyproj import Transformer
-import matplotlib.pyplot as plt
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.coords import BoundingBox
+from rasterio.transform import array_bounds
+from utils import render_utils, proj_utils
 
 # flood event periods for STN high-water marks
 flood_event_periods = {'2021 Henri': ['2021-08-15', '2021-08-23'],
@@ -67,72 +78,229 @@ def plot_helper(ids, df, dir, flowline=None):
 
     Args:
         ids : a list of ids
-        df: The DataFrame selected
+        df: The DataFrame selected (with the 'crs' column from the image catalog)
         dir: The directory to save plots
         flowline: The GeoDataFrame of flowlines, if available
+
+    Notes:
+        The figures are rendered in parallel by `render_utils.render_jobs`, the unchanged figures are skipped
     """
-    for current_id in ids:
-
-        # filter the data for the current id
-        id_group = df[df['id'] == current_id]
-        num_images = len(id_group)
-        event_day = id_group['event_day'].iloc[0]
-        
-        # create a figure for the current id
-        fig, axes = plt.subplots(1, num_images, figsize=(4 * num_images, 5))
-        fig.suptitle(f"ID: {current_id}\nEvent Day: {event_day}")
-
-        # check if only one image exists
-        if num_images == 1:
-            axes = [axes]
-
-        for j, (_, row) in enumerate(id_group.iterrows()):
-            image_path = os.path.join(row['dir'], row['filename'])
-            lat = row['latitude']
-            lon = row['longitude']
-
-            # open the GeoTIFF
-            with rasterio.open(image_path) as src:
-                tiff_crs = src.crs
-                bounds = src.bounds
-
-                show(src, ax=axes[j])
-                
-                # convert the crs if using flowline
+    flowline_wkb = b''.join(shapely.to_wkb(flowline.geometry.values)) if flowline is not None else b''
+
+    # transform the flood event observation locations to the CRS of their images (one call per CRS)
+    xs, ys = proj_utils.project_points(df)
+    points = dict(zip(df.index, zip(xs, ys)))
+
+    def build_jobs():
+        for current_id in ids:
+
+            # filter the data for the current id
+            id_group = df[df['id'] == current_id]
+            num_images = len(id_group)
+            event_day = id_group['event_day'].iloc[0]
+
+            # skip the figure if the images, titles and locations are unchanged
+            output = f"figs/{dir}/{id_group['id'].iloc[-1]}_{id_group['date'].iloc[-1]}_{dir}.png"
+            key = render_utils.figure_key(
+                inputs=[os.path.join(row['dir'], row['filename']) for _, row in id_group.iterrows()],
+                params={'id': current_id, 'event_day': event_day,
+                        'rows': id_group[['date', 'period', 'latitude', 'longitude']].astype(str).values.tolist()},
+                arrays=[flowline_wkb], sources=[__file__])
+            if render_utils.is_cached(output, key):
+                continue
+
+            panels = []
+            max_size = render_utils.target_size((4 * num_images, 5), num_images)
+            for index, row in id_group.iterrows():
+                image_path = os.path.join(row['dir'], row['filename'])
+
+                # load the image decimated to the panel resolution (GeoTIFF or NumPy array)
+                image, extent, tiff_crs = render_utils.load_image(image_path, max_size)
+                panel = {
+                    'image': image,
+                    'extent': extent,
+                    'title': f"Date: {row['date']}\nPeriod: {row['period']}",
+                    'limits': extent
+                }
+
+                # convert the crs if using flowline (reprojected once per CRS)
                 if flowline is not None:
-                    if flowline.crs != tiff_crs:
-                        flowline = flowline.to_crs(tiff_crs)
-                    
-                    flowline.plot(ax=axes[j], color='cyan', linewidth=0.4)
+                    panel['lines'] = render_utils.clip_lines(proj_utils.to_crs(flowline, tiff_crs), extent)
+                    panel['linewidth'] = 0.4
 
                 # add the flood event observation location as a red dot
-                transformer = Transformer.from_crs("EPSG:4326", tiff_crs, always_xy=True)
-                raster_x, raster_y = transformer.transform(lon, lat)
-                axes[j].plot(raster_x, raster_y, 'ro', markersize=6, zorder=3)
+                panel['points'] = [points[index]]
+                panels.append(panel)
+
+            yield {
+                'output': output,
+                'figsize': (4 * num_images, 5),
+                'suptitle': f"ID: {current_id}\nEvent Day: {event_day}",
+                'panels': panels,
+                'cache_key': key
+            }
+
+    render_utils.render_jobs(build_jobs())
+
+def read_npy(file_path):
+    """
+    Read a NumPy image (saved by `s2_utils.export_image_npy`) and its JSON georeferencing sidecar
+
+    Args:
+        file_path (str): The path to the .npy file to be read
+
+    Returns:
+        data (numpy.ndarray): The memory-mapped image data with shape (bands, height, width)
+        bounds (rasterio.coords.BoundingBox): The spatial boundary of the image
+        crs (rasterio.crs.CRS): The coordinate reference system
+        transform (affine.Affine): The transformation matrix for transforming of coordinates from image pixel (row, col) to 
+                                   and from geographic/projected (x, y) coordinates
+        profile (dict): Metadata and profile information of the image (same keys as a rasterio profile)
+    """
+    data = np.load(file_path, mmap_mode='r')
+    with open(file_path.replace('.npy', '.json')) as f:
+        meta = json.load(f)
+
+    crs = CRS.from_user_input(meta['crs'])
+    transform = Affine(*meta['transform'])
+    bounds = BoundingBox(*array_bounds(meta['height'], meta['width'], transform))
+    profile = {
+        'driver': 'NPY',
+        'dtype': meta['dtype'],
+        'width': meta['width'],
+        'height': meta['height'],
+        'count': meta['count'],
+        'crs': crs,
+        'transform': transform,
+        'nodata': None
+    }
+    return data, bounds, crs, transform, profile
+
+def read_band(file_path):
+    """
+    Read the first band of an image stored as GeoTIFF or NumPy array
+
+    Args:
+        file_path (str): The path to the .tif or .npy file
+
+    Returns:
+        np.ndarray: A 2D array representing the first band
+    """
+    if file_path.endswith('.npy'):
+        return np.asarray(read_npy(file_path)[0][0])
+    with rasterio.open(file_path) as src:
+        return src.read(1)
+
+def build_overviews(file_path, resampling='average', min_size=256):
+    """
+    Build the internal overviews of a GeoTIFF, so the figures can be drawn from decimated reads
+
+    Args:
+        file_path (str): The path to the GeoTIFF file
+        resampling (str): The resampling method (e.g., 'average' for images, 'nearest' for masks)
+        min_size (int): The overviews are built until the longest axis is smaller than this number of pixels
+
+    Notes:
+        NumPy images are skipped (they are decimated from the memory map)
+    """
+    if file_path.endswith('.npy'):
+        return
+    with rasterio.open(file_path, 'r+') as src:
+        factors = []
+        factor = 2
+        while max(src.height, src.width) / factor >= min_size:
+            factors.append(factor)
+            factor *= 2
+        if factors:
+            src.build_overviews(factors, Resampling[resampling])
+            src.update_tags(ns='rio_overview', resampling=resampling)
+
+def compute_cloud_stats(cloud_mask):
+    """
+    Compute the cloud and valid (cloud-free) pixel percentages of a cloud mask
+
+    Args:
+        cloud_mask (np.ndarray): The cloud and shadow mask (1 - cloud or shadow, 0 - valid)
+
+    Returns:
+        dict: The cloud and valid pixel percentages ('cloud_percentage', 'valid_percentage')
+    """
+    return {
+        'cloud_percentage': float(np.mean(cloud_mask == 1) * 100),
+        'valid_percentage': float(np.mean(cloud_mask == 0) * 100)
+    }
+
+def write_cloud_stats(cloud_mask_path):
+    """
+    Compute the cloud and valid (cloud-free) pixel percentages once and store them in the metadata of the cloud mask
+
+    Args:
+        cloud_mask_path (str): The file path to the cloud mask file (GeoTIFF tags or JSON sidecar for NumPy images)
+
+    Returns:
+        dict: The cloud and valid pixel percentages ('cloud_percentage', 'valid_percentage')
+
+    Notes:
+        Called at download time (`s2_utils.collect_region`), the readers only compute the percentages in memory if missing
+    """
+    cloud_mask = read_band(cloud_mask_path)
+    stats = compute_cloud_stats(cloud_mask)
+
+    if cloud_mask_path.endswith('.npy'):
+        meta_path = cloud_mask_path.replace('.npy', '.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta.update(stats)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=4)
+    else:
+        with rasterio.open(cloud_mask_path, 'r+') as dst:
+            dst.update_tags(CLOUD_PERCENTAGE=stats['cloud_percentage'], VALID_PERCENTAGE=stats['valid_percentage'])
+            dst.update_tags(1, STATISTICS_MEAN=float(np.mean(cloud_mask)), STATISTICS_MINIMUM=int(cloud_mask.min()), STATISTICS_MAXIMUM=int(cloud_mask.max()))
+
+    return stats
+
+def get_cloud_stats(cloud_mask_path):
+    """
+    Get the cloud and valid (cloud-free) pixel percentages of an image without reading the pixels
 
-                axes[j].set_title(f"Date: {row['date']}\nPeriod: {row['period']}")
-                axes[j].set_xlim(bounds.left, bounds.right)
-                axes[j].set_ylim(bounds.bottom, bounds.top)
+    Args:
+        cloud_mask_path (str): The file path to the cloud mask file
 
-        plt.tight_layout()
-        plt.savefig(f"figs/{dir}/{row['id']}_{row['date']}_{dir}.png")
-        plt.close(fig)
-        print(f"complete - {current_id}")
+    Returns:
+        dict: The cloud and valid pixel percentages ('cloud_percentage', 'valid_percentage')
 
-def apply_cloud_mask(image, cloud_mask_path):
+    Notes:
+        The percentages are read from the GeoTIFF tags (or the JSON sidecar) written by `write_cloud_stats`. For images
+        collected before the statistics were stored, they are computed from the mask in memory (the file is not modified).
+    """
+    if cloud_mask_path.endswith('.npy'):
+        with open(cloud_mask_path.replace('.npy', '.json')) as f:
+            meta = json.load(f)
+        if 'cloud_percentage' in meta:
+            return {'cloud_percentage': meta['cloud_percentage'], 'valid_percentage': meta['valid_percentage']}
+    else:
+        with rasterio.open(cloud_mask_path) as src:
+            tags = src.tags()
+        if 'CLOUD_PERCENTAGE' in tags:
+            return {'cloud_percentage': float(tags['CLOUD_PERCENTAGE']), 'valid_percentage': float(tags['VALID_PERCENTAGE'])}
+
+    return compute_cloud_stats(read_band(cloud_mask_path))
+
+def apply_cloud_mask(image, cloud_mask):
     """
     Apply cloud mask to a image by assigning cloud and shadow areas with NaN
 
     Args:
         image (np.ndarray): The input image
-        cloud_mask_path (str): The file path to the cloud mask file
+        cloud_mask (str or np.ndarray): The file path to the cloud mask file, or the cloud mask already read (e.g., `scene_utils.read_scene`)
     
     Returns:
         np.ndarray: The array with cloud and shadow pixels set to NaN
     """
     # open the cloud mask
-    with rasterio.open(cloud_mask_path) as src:
-        cloud_mask = src.read(1)
+    if isinstance(cloud_mask, str):
+        cloud_mask = read_band(cloud_mask)
 
     # set cloud and shadow pixels to NaN
     valid_mask = cloud_mask == 0
@@ -145,7 +313,7 @@ def read_ndwi_tif(file_path, threshold=-0.1):
     Create a water mask using NDWI GeoTIFF
 
     Args:
-        file_path (str): The file path to the NDWI file
+        file_path (str or np.ndarray): The file path to the NDWI file, or the NDWI band already read (e.g., `scene_utils.read_scene`)
         threshold (float): The NDWI threshold used to distinguish water from non-water areas
     
     Returns:
@@ -155,8 +323,7 @@ def read_ndwi_tif(file_path, threshold=-0.1):
         The selection of threshold is included in eda_s2.py. -0.1 is selected after testing different values on images
     """
     # open the NDWI file
-    with rasterio.open(file_path) as src:
-        ndwi_mask = src.read(1) 
+    ndwi_mask = read_band(file_path) if isinstance(file_path, str) else file_path
 
     # create a water mask based on the threshold
     water_mask = np.where(ndwi_mask > threshold, 1, 0)
@@ -2,14 +2,46 @@
 This script includes the functions used for KMeans clustering algorithm.
 
 This script can be imported as a module and includes the following functions:
-    * read_tif - return the image data and metadata from the TIFF file;
-    * generate_flowline_mask - return a mask that identifies the pixels covered by flowlines in the image data;
-    * add_image_data - return a DataFrame with the image and mask data added;
-    * preprocess_data - return a DataFrame with the standardized image data and valid pixels;
+    * read_tif - return the image data and metadata from the TIFF (or NumPy) file;
+    * load_image_data - return the image and mask data of a scene;
+    * load_scene_masks - return the cloud and NDWI masks of a scene without its bands and features;
+    * count_ndwi_pixels - return the number of cloud-free NDWI water pixels of a scene from its NDWI and cloud bands;
+    * standardize - return the mean and scale of the columns of a feature matrix standardized in place;
+    * bank_columns - return the names of the columns of the feature bank;
+    * preprocess_image - return the feature bank (standardized bands, masks and inverse distance) of the valid pixels of a scene;
+    * condition_index - return the indices of the feature bank columns of a condition;
+    * condition_names - return the names of the feature bank columns of a condition;
+    * condition_features - return the feature matrix of a condition as a view of the feature bank;
+    * get_scene_data - return the image, mask and preprocessed data of a scene from the scene cache (loaded on demand);
+    * add_image_data - return a DataFrame with the number of NDWI water pixels added (the arrays are loaded on demand);
+    * preprocess_data - check the preprocessed data (standardized image data and valid pixels) of the first scene;
     * kmeans_clustering_i - return the clustered image and inertia for specified image;
+    * group_pixels - return the group of each pixel with the same feature vector (or quantization grid cell) and the group counts;
+    * reduce_features - return the mean feature vector, pixel count and within-group scatter of each group;
+    * kmeans_clustering_reduced - return the clustered image and inertia from a weighted KMeans fit on the group means;
+    * grid_blocks - return the block of each pixel of a grid of square blocks covering an image;
+    * pyramid_blocks - return the number of valid pixels and the size of the coarse blocks (e.g., 40 m) of a scene;
+    * boundary_blocks - return the mask of the coarse blocks on the boundaries between clusters;
+    * upsample_blocks - return the value of the coarse block of each pixel;
+    * nearest_center - return the label of the nearest cluster center of each pixel;
+    * load_pyramid_level - return the image and mask data of the coarse level of a scene read from its overviews;
+    * refine_pyramid - return the labels of the valid pixels from the coarse labels, relabeling the boundary blocks from windowed reads;
+    * superpixel_segments - return the superpixel (grid blocks or SLIC regions) of each valid pixel and the superpixel sizes;
+    * reduce_pixels - return the group means of the pixels (unique feature vectors, quantization grid cells or superpixels) for KMeans clustering;
+    * stratified_sample - return the indices of a pixel subsample stratified by the NDWI/flowline masks;
+    * kmeans_clustering_sample - return the clustered image and estimated inertia from a MiniBatchKMeans fit on a pixel subsample;
     * find_sharpest_slope_point - return the optimal number of clusters defined by the sharpest slope point;
+    * elbow_search - return the inertia of each number of clusters, the optimal number of clusters and its clustered image;
+    * check_elbow_accuracy - return the agreement between the subsampled and full-data elbow search;
     * identify_flood_cluster - return the lable of cluster that has the greatest overlap with the NDWI mask
+    * cluster_scene_default - return the inertia of default KMeans clustering of a scene with its labels filled (worker process);
+    * cluster_scene_pyramid - return the inertia of default KMeans clustering of the coarse level of a scene with its labels filled (worker process);
     * kmeans_clustering_default - return the result of default KMeans clustering optimization;
+    * cluster_condition - return the clustered image and clustering information of the features of one condition (PCA and elbow method);
+    * cluster_scene_conditions - return the clustering information of each condition of a scene with its labels filled (worker process);
+    * cluster_scene_conditions_pyramid - return the clustering information of each condition of the coarse level of a scene with its labels filled (worker process);
+    * summarize_condition - return the result of KMeans clustering optimization of a scene for one condition (pixel counts, flood cluster and plot);
+    * run_conditions - return the results of KMeans clustering optimization for several conditions in a single pass over the scenes (in parallel);
     * kmeans_optimization_individual_pca_features - return the result of KMeans clustering optimization by introducing NDWI/flowline mask and applying PCA;
     * plot_clustered_result - plot the clustered image and individual clusters separately;
     * plot_evaluation_metrics - plot and save evaluation metrics (cumulative explained variance and elbow method) for KMeans clustering;
@@ -19,26 +51,35 @@ import os
 import rasterio
 import numpy as np
 import pandas as pd
-import geopandas as gpd
-from utils import global_utils
+from utils import global_utils, render_utils, nhd_utils, feature_utils, scene_utils, parallel_utils, pca_utils
 from kneed import KneeLocator
 import matplotlib.pyplot as plt
-from shapely.geometry import box
-from sklearn.cluster import KMeans
-from sklearn.decomposition import PCA
-from rasterio.features import geometry_mask
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import adjusted_rand_score, pairwise_distances_argmin
+from rasterio.windows import Window
 from matplotlib.colors import Normalize, ListedColormap
-from pyproj import Transformer
-from shapely.geometry import Point
-from sklearn.neighbors import NearestNeighbors
+
+# scikit-image is only needed for the SLIC superpixels (see `superpixel_segments`)
+try:
+    from skimage.segmentation import slic
+except ImportError:
+    slic = None
+
+# base features of each condition ('bands' - the standardized image bands), see `condition_features`
+condition_columns = {
+    'pca': ['bands'],
+    'flowline_pca': ['flowline', 'bands'],
+    'ndwi_pca': ['bands', 'ndwi'],
+    'features_pca': ['flowline', 'bands', 'ndwi']
+}
 
 def read_tif(file_path):
     """
     Read a TIFF file and return its image data and metadata
 
     Args:
-        file_path (str) : The path to the TIFF file to be read
+        file_path (str) : The path to the TIFF file to be read (.npy files with a JSON sidecar are also accepted)
 
     Returns:
         data (numpy.ndarray): The image data read from the TIFF file
@@ -48,47 +89,262 @@ def read_tif(file_path):
                                    and from geographic/projected (x, y) coordinates
         profile (dict): Metadata and profile information of the TIFF file
     """
+    if file_path.endswith('.npy'):
+        return global_utils.read_npy(file_path)
     with rasterio.open(file_path) as src:
         return src.read(), src.bounds, src.crs, src.transform, src.profile
 
-def generate_flowline_mask(flowline_gdf, image_shape, transform):
+def load_image_data(row, factor=1, window=None):
     """
-    Create a mask for identifying the pixels covered by flowlines
+    Load the image and mask data (np.ndarray) of a scene
 
     Args:
-        flowline_gdf (pd.GeoDataFrame): A GeoDataFrame representing the flowline geometries to be masked
-        image_shape (tuple): A tuple representing the shape of the image
-        transform (Affine): The affine transformation mapping the image's pixel coordinates to geographic coordinates
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        factor (int): The number of pixels along each axis of a coarse pixel (see `scene_utils.read_scene_level`), 1 for full resolution
+        window (rasterio.windows.Window): The window read at full resolution, None to read the whole scene
 
     Returns:
-        np.ndarray: A array representing the flowline mask (flowline - 1; other areas - 0)
+        dict: The 'sat_image' (native dtype), 'valid_mask' (cloud-free pixels), 'ndwi_mask' (uint8), 'flowline_mask' (uint8)
+              and 'ndwi_pixels' (cloud-free water pixels) of the scene (or of its level or window)
 
     Notes:
-        https://rasterio.readthedocs.io/en/latest/api/rasterio.features.html
+        The arrays keep their native dtypes, the cloud and shadow pixels are only excluded by the boolean 'valid_mask'
+    """
+    state_full = [name for name, abbr in global_utils.area_abbr_list.items() if abbr == row['state']][0]
+
+    # load image and mask (each file is opened once, the cloud mask is shared)
+    scene = scene_utils.read_scene_level(row, factor, window)
+    sat_image, tiff_crs, transform = scene.vis, scene.crs, scene.transform # example shape (3, 1201, 1195) <- (channels, height, width)
+    if factor == 1 and window is None:
+        print(f"Loaded image shape for {row['filename']}: {sat_image.shape}")  # (channels, height, width)
+    ndwi_mask = global_utils.read_ndwi_tif(scene.ndwi).astype(np.uint8)
+    valid_mask = scene.cloud_mask == 0
+
+    ndwi_pixels = np.sum((ndwi_mask == 1) & valid_mask)
+
+    # crop the flowline mask from the rasterized major rivers of the state
+    flowline_mask = nhd_utils.read_flowline_mask(state_full, tiff_crs, transform, sat_image.shape[1:]).astype(np.uint8)
+
+    return {
+        'sat_image': sat_image,
+        'valid_mask': valid_mask,
+        'ndwi_mask': ndwi_mask,
+        'flowline_mask': flowline_mask,
+        'ndwi_pixels': ndwi_pixels,
+        'crs': tiff_crs,
+        'transform': transform,
+        'state_full': state_full,
+        'distance_key': row['filename'] if factor == 1 and window is None else None
+    }
+
+def load_scene_masks(row):
+    """
+    Load the cloud and NDWI masks of a scene without its bands and features
+
+    Args:
+        row (pd.Series): The image metadata with the 'dir', 'filename', 'dir_ndwi', 'filename_ndwi', 'dir_cloud' and 'filename_cloud' columns
+
+    Returns:
+        dict: The 'valid_mask' (cloud-free pixels, (height, width)), its flat 'valid_pixels', the 'ndwi_mask_flat' of the
+              valid pixels, the 'ndwi_pixels' (cloud-free water pixels) and the 'shape' (bands, height, width) of the image
+    """
+    ndwi_mask = global_utils.read_ndwi_tif(os.path.join(row['dir_ndwi'], row['filename_ndwi'])).astype(np.uint8)
+    valid_mask = global_utils.read_band(os.path.join(row['dir_cloud'], row['filename_cloud'])) == 0
+    image_path = os.path.join(row['dir'], row['filename'])
+    if image_path.endswith('.npy'):
+        n_bands = global_utils.read_npy(image_path)[4]['count']
+    else:
+        with rasterio.open(image_path) as src:
+            n_bands = src.count
+    valid_pixels = valid_mask.ravel()
+    ndwi_mask_flat = ndwi_mask.ravel()[valid_pixels]
+    return {
+        'valid_mask': valid_mask,
+        'valid_pixels': valid_pixels,
+        'ndwi_mask_flat': ndwi_mask_flat,
+        'ndwi_pixels': int(ndwi_mask_flat.sum()),
+        'shape': (n_bands,) + valid_mask.shape
+    }
+
+def count_ndwi_pixels(row):
+    """
+    Count the cloud-free NDWI water pixels of a scene from its NDWI and cloud bands only
+
+    Args:
+        row (pd.Series): The image metadata (see `load_scene_masks`)
+
+    Returns:
+        int: The number of cloud-free water pixels (same definition as the 'ndwi_pixels' of `load_image_data`)
+    """
+    return load_scene_masks(row)['ndwi_pixels']
+
+def standardize(data, standardization=None):
+    """
+    Standardize the columns of a feature matrix in place
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features) in float32
+        standardization (tuple): The 'mean' and 'scale' of each column (e.g., of the coarse level of a scene), None to
+                                 fit them on the data
+
+    Returns:
+        tuple: The mean and scale of each column
+    """
+    if standardization is None:
+        scaler = StandardScaler(copy=False)
+        scaler.fit_transform(data)
+        return scaler.mean_.astype(np.float32), scaler.scale_.astype(np.float32)
+    mean, scale = standardization
+    data -= mean
+    data /= scale
+    return standardization
+
+def bank_columns(n_bands):
+    """
+    Return the names of the columns of the feature bank
+
+    Args:
+        n_bands (int): The number of image bands
+
+    Returns:
+        list of str: The names of the columns ordered [flowline, bands, ndwi, distance]
+    """
+    return ['flowline'] + [f'b{i + 1}' for i in range(n_bands)] + ['ndwi', 'distance']
+
+def preprocess_image(row, image_data, standardization=None):
+    """
+    Build the feature bank of the valid pixels of a scene (standardized bands, NDWI/flowline masks and inverse distance)
+
+    Args:
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        image_data (dict): The image and mask data of the scene, of its level or of a window (see `load_image_data`)
+        standardization (tuple): The mean and scale of each column (e.g., of the coarse level of the scene), None to fit them
+
+    Returns:
+        dict: The 'feature_bank' (num_valid_pixels, features), its 'feature_columns', the 'scaled_image' (view of the
+              standardized bands), the 'valid_pixels' and the 'standardization' of the scene
+
+    Notes:
+        The columns are ordered [flowline, bands, ndwi, distance], so the features of each condition in `condition_columns`
+        are contiguous columns and read as views. Each column is standardized once, in float32
+    """
+    image = image_data['sat_image']
+    valid_pixels = image_data['valid_mask'].ravel()
+    n_bands = image.shape[0]
+
+    # compute the inverse distance to the nearest major river (within 100 m) from the rasterized flowlines (cached for whole scenes)
+    distance = feature_utils.flowline_distance(image_data['state_full'], image_data['crs'], image_data['transform'], image.shape[1:],
+                                               scene=image_data.get('distance_key'))
+    distances = feature_utils.transform_distance(distance, 'inverse', max_distance=100)
+
+    # gather the valid (cloud-free) pixels of each base feature into a single float32 matrix
+    feature_bank = np.empty((int(valid_pixels.sum()), n_bands + 3), dtype=np.float32)
+    feature_bank[:, 0] = scene_utils.gather_valid(image_data['flowline_mask'], valid_pixels)
+    feature_bank[:, 1:n_bands + 1] = scene_utils.gather_valid(image, valid_pixels)
+    feature_bank[:, n_bands + 1] = scene_utils.gather_valid(image_data['ndwi_mask'], valid_pixels)
+    feature_bank[:, n_bands + 2] = scene_utils.gather_valid(distances, valid_pixels)
+
+    # standardize the features (in place)
+    standardization = standardize(feature_bank, standardization)
+
+    return {
+        'feature_bank': feature_bank,
+        'feature_columns': bank_columns(n_bands),
+        'scaled_image': feature_bank[:, 1:n_bands + 1],
+        'valid_pixels': valid_pixels,
+        'standardization': standardization
+    }
+
+def condition_index(feature_columns, columns):
     """
-    mask = geometry_mask([geometry for geometry in flowline_gdf.geometry],
-                         out_shape=image_shape,
-                         transform=transform,
-                         invert=True)  
-    return mask.astype(np.int32)
+    Return the indices of the feature bank columns of a condition
+
+    Args:
+        feature_columns (list of str): The names of the columns of the feature bank
+        columns (str or list of str): The condition (see `condition_columns`) or the base features ('bands' for all the bands)
+
+    Returns:
+        list of int: The indices of the columns
+    """
+    if isinstance(columns, str):
+        columns = condition_columns[columns]
+    index = []
+    for name in columns:
+        if name == 'bands':
+            index += [i for i, column in enumerate(feature_columns) if column.startswith('b') and column[1:].isdigit()]
+        else:
+            index.append(feature_columns.index(name))
+    return index
+
+def condition_names(feature_columns, columns):
+    """
+    Return the names of the feature bank columns of a condition
+
+    Args:
+        feature_columns (list of str): The names of the columns of the feature bank
+        columns (str or list of str): The condition (see `condition_columns`) or the base features
+
+    Returns:
+        list of str: The names of the columns
+    """
+    return [feature_columns[i] for i in condition_index(feature_columns, columns)]
+
+def condition_features(scene, columns):
+    """
+    Select the feature matrix of a condition from the feature bank of a scene
+
+    Args:
+        scene (dict): The arrays of the scene (see `get_scene_data`)
+        columns (str or list of str): The condition (see `condition_columns`) or the base features ('bands' for all the bands)
+
+    Returns:
+        np.ndarray: The feature matrix (num_valid_pixels, features), a view of the feature bank if the columns are contiguous
+
+    Notes:
+        New feature combinations only need a new entry in `condition_columns`
+    """
+    index = condition_index(scene['feature_columns'], columns)
+
+    # contiguous columns are sliced without a copy
+    if index == list(range(index[0], index[-1] + 1)):
+        return scene['feature_bank'][:, index[0]:index[-1] + 1]
+    return scene['feature_bank'][:, index]
+
+def get_scene_data(row):
+    """
+    Return the image, mask and preprocessed data of a scene, loaded on demand and kept in the scene cache
+
+    Args:
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+
+    Returns:
+        dict: The arrays of the scene (see `load_image_data` and `preprocess_image`)
+
+    Notes:
+        The cache budget is set with the SCENE_CACHE_MB environment variable (see `scene_utils`)
+    """
+    def loader():
+        image_data = load_image_data(row)
+        return {**image_data, **preprocess_image(row, image_data)}
+    return scene_utils.get_scene(row['filename'], loader)
 
 def add_image_data(df):
     '''
-    Add the image and mask data (np.ndarray) to the image DataFrame
+    Prepare the image DataFrame for the lazy loading of the image and mask data and count the NDWI water pixels
 
     Args:
         df (pd.DataFrame): The existing DataFrame storing the image and its metadata
 
     Returns:
-        pd.DataFrame: The modified DataFrame with the image and mask data (np.ndarray) added
+        pd.DataFrame: The modified DataFrame with the number of NDWI water pixels ('ndwi_pixels') added
+        pd.DataFrame: A DataFrame with the number of NDWI water pixels of each image
+
+    Notes:
+        The arrays are not stored in the DataFrame, they are loaded on demand with `get_scene_data`. The water pixels
+        are counted from the NDWI and cloud bands only, so each scene is built once per run (by the clustering pass)
     '''
     global_utils.print_func_header('add the image data')
     df_mod = df.copy()
-    # create lists to store the data
-    ndwi_mask_dict = {}
-    sat_image_dict = {}
-    masked_image_dict = {}
-    flowline_mask_dict = {}
     ndwi_pixels_dict = {}
     # load the dictionary mapping full state names to their abbreviations
     area_abbr_list = global_utils.area_abbr_list
@@ -97,49 +353,15 @@ def add_image_data(df):
     for i in area_exist:
 
         # filter the dataset for the specific state
-        df_i = df_mod[df_mod['state'] == i].copy()
+        df_i = df_mod[df_mod['state'] == i]
         state_full = [name for name, abbr in area_abbr_list.items() if abbr == i][0]
 
-        # load the flowline shapefile and extract major rivers
-        major_river = [558]
-        shp_path = f'data/nhd/{state_full}/Shape/NHDFlowline.shp'
-        flowline = gpd.read_file(shp_path)
-        major_rivers = flowline[(flowline['ftype'].isin(major_river)) & (flowline['lengthkm'] >= 0.6)]
+        # build the major river layer if missing (ftype 558 and length >= 0.6 km)
+        nhd_utils.build_major_rivers([state_full])
         for index, row in df_i.iterrows():
-
-            # load image and mask
-            image_path = os.path.join(row['dir'], row['filename'])
-            ndwi_path = os.path.join(row['dir_ndwi'], row['filename_ndwi'])
-            cloud_path = os.path.join(row['dir_cloud'], row['filename_cloud'])
-            sat_image, bounds, tiff_crs, transform, _  = read_tif(image_path) # example shape (3, 1201, 1195) <- (channels, height, width)
-            print(f"Loaded image shape for {row['filename']}: {sat_image.shape}")  # (channels, height, width)
-            ndwi_mask, _, _, _, _ = read_tif(ndwi_path)
-            ndwi_mask = global_utils.read_ndwi_tif(ndwi_path)
-            ndwi_mask = global_utils.apply_cloud_mask(ndwi_mask, cloud_path)
-            masked_image = global_utils.apply_cloud_mask(sat_image, cloud_path)
-
-            ndwi_pixels = np.sum(ndwi_mask == 1)
-
-            # extract the flowline mask
-            if major_rivers.crs != tiff_crs:
-                major_rivers = major_rivers.to_crs(tiff_crs)
-
-            bbox = box(bounds.left, bounds.bottom, bounds.right, bounds.top)
-            filtered_flowline = major_rivers[major_rivers.geometry.intersects(bbox)]
-            flowline_mask = generate_flowline_mask(filtered_flowline, sat_image.shape[1:], transform)
-
-            # add the np.ndarray data to the list
-            ndwi_mask_dict[index] = ndwi_mask
-            sat_image_dict[index] = sat_image
-            masked_image_dict[index] = masked_image
-            flowline_mask_dict[index] = flowline_mask
-            ndwi_pixels_dict[index] = ndwi_pixels
+            ndwi_pixels_dict[index] = count_ndwi_pixels(row)
         print(f"complete - add the image data for observations in {i}")
 
-    df_mod['ndwi_mask'] = df_mod.index.map(ndwi_mask_dict)
-    df_mod['sat_image'] = df_mod.index.map(sat_image_dict)
-    df_mod['masked_image'] = df_mod.index.map(masked_image_dict)
-    df_mod['flowline_mask'] = df_mod.index.map(flowline_mask_dict)
     df_mod['ndwi_pixels'] = df_mod.index.map(ndwi_pixels_dict)
 
     global_utils.describe_df(df_mod, 'df with standardized image data')
@@ -155,117 +377,388 @@ def add_image_data(df):
     return df_mod, result_df
 
 def preprocess_data(df):
-    df_mod = df.copy()
-    global_utils.print_func_header('preprocess the image data')
-    scaled_image_list = []
-    valid_pixels_list = []
-    inverse_distance_list = []
-
-    for _, row in df_mod.iterrows():
-        # load the valid image data
-        image = row['masked_image']
+    """
+    Check the preprocessed data (standardized valid pixels and inverse distances) of the first scene
 
-        # (channels, height, width) -> (num_pixels = height * width, channels)
-        reshaped_image = image.transpose(1, 2, 0).reshape(-1, image.shape[0]) # convert the image data into a format where each row is a pixel and each column is a channel value (feature) -> flatten into a 2D array for clustering
-        valid_pixels = ~np.isnan(reshaped_image).any(axis=1) # store rows (pixels) with no NaN values (check if any channel value in a pixel is NaN)
-        valid_data = reshaped_image[valid_pixels]
+    Args:
+        df (pd.DataFrame): The image DataFrame (see `add_image_data`)
 
-        # standardize the valid data
-        scaler = StandardScaler()
-        scaled_data = scaler.fit_transform(valid_data)
+    Returns:
+        pd.DataFrame: The image DataFrame (the preprocessed data are computed on demand with `get_scene_data`)
+    """
+    df_mod = df.copy()
+    global_utils.print_func_header('preprocess the image data')
 
-        distances = np.full(reshaped_image.shape[0], np.nan)
-        shp_path = f'data/nhd/Maine/Shape/NHDFlowline.shp'
-        
-        # flowline['ftype'] or ['y
-        # fcode'] (might be helpful for extracting major river?) 
-        major_river = [558]
-        flowline = gpd.read_file(shp_path)
-        major_rivers = flowline[(flowline['ftype'].isin(major_river)) & (flowline['lengthkm'] >= 0.6)]
-
-        image_path = os.path.join(row['dir'], row['filename'])
-        _, sat_bounds, tiff_crs, _, _  = read_tif(image_path)
-
-        if major_rivers.crs != tiff_crs:
-            major_rivers = major_rivers.to_crs(tiff_crs)
-
-        # plot satellite image
-        lat = row['latitude']
-        lon = row['longitude']
-        transformer = Transformer.from_crs("EPSG:4326", tiff_crs, always_xy=True)
-        raster_x, raster_y = transformer.transform(lon, lat)
-
-        image_center = Point(raster_x, raster_y)
-        # print(image_center)
-
-        flowline_coords = []
-        for geom in major_rivers.geometry:
-            if geom.geom_type == 'LineString':
-                flowline_coords.extend(list(geom.coords))
-            elif geom.geom_type == 'MultiLineString':
-                for line in geom:
-                    flowline_coords.extend(list(line.coords))
-
-        pixel_points = [Point(x, y) for x, y in reshaped_image[valid_pixels][:, :2]]
-
-        flowline_array = np.array(flowline_coords)
-        pixel_array = np.array([[pt.x, pt.y] for pt in pixel_points])
-
-        if flowline_array.shape[1] == 3:
-            pixel_array = np.hstack([pixel_array, np.zeros((pixel_array.shape[0], 1))])
-
-        neigh = NearestNeighbors(n_neighbors=1).fit(flowline_array)
-        distances_to_flowline, _ = neigh.kneighbors(pixel_array)
-
-        close_pixels_mask = distances_to_flowline.flatten() <= 100
-
-        distances[valid_pixels] = 0
-        distances[valid_pixels][close_pixels_mask] = 1 / np.maximum(distances_to_flowline.flatten()[close_pixels_mask], 1e-6)
-        # distances[valid_pixels] = 1/np.maximum(distances.flatten(), 1e-6)
-
-        # pixel_points = [Point(x, y) for x, y in reshaped_image[valid_pixels][:, :2]]
-        # nearest_points = tree.query(pixel_points, k=1)
-            
-        # for idx, nearest in enumerate(nearest_points):
-        #     min_distance = pixel_points[idx].distance(nearest)
-        #     distances[valid_pixels][idx] = 1/max(min_distance, 1e-6)
-        #     # min_distance = min(image_center.distance(Point(coord)) for coord in flowline_coords)
-        #     # distances[idx] = 1 / max(min_distance, 1e-6)  # Prevent division by zero
-
-        # close_pixel_indices = np.argsort(distances[valid_pixels])[:500]
-        # scaled_data[close_pixel_indices] *= 2
-
-        # store the scaled data and valid pixel
-        scaled_image_list.append(scaled_data)
-        valid_pixels_list.append(valid_pixels)
-        inverse_distance_list.append(distances[valid_pixels].reshape(-1, 1))
-
-    # assign the list of scaled images to the DataFrame column
-    df_mod['scaled_image'] = scaled_image_list
-    df_mod['valid_pixels'] = valid_pixels_list
-    df_mod['inverse_distances'] = inverse_distance_list
-
-    # print the first row for inspection
-    print('\nprint out the first row for inspection\n', df_mod.iloc[0])
-    print(df_mod)
+    # print the first scene for inspection
+    scene = get_scene_data(df_mod.iloc[0])
+    print('\nprint out the first scene for inspection\n', {key: getattr(value, 'shape', value) for key, value in scene.items()})
+    print('scene cache:', scene_utils.cache_info())
 
     return df_mod
 
-def kmeans_clustering_i(image, init, n_clusters):
+def kmeans_clustering_i(image, init, n_clusters, sample_weight=None, return_centers=False):
     """
     Perform KMeans clustering on the specified image data.
 
     Args:
         image (numpy.ndarray): The input image data
         n_clusters (int): The number of clusters for KMeans
+        sample_weight (np.ndarray): The weight of each row (e.g., the pixel counts of unique feature vectors), None for equal weights
+        return_centers (bool): Whether the fitted cluster centers are also returned
 
     Returns:
         numpy.ndarray: The clustered image
         float: The inertia of the clustering result
+        numpy.ndarray: The cluster centers (n_clusters, features), only with return_centers
     """
-    kmeans = KMeans(n_clusters=n_clusters, init=init, n_init='auto', max_iter=300, random_state=42).fit(image)
+    kmeans = KMeans(n_clusters=n_clusters, init=init, n_init='auto', max_iter=300, random_state=42).fit(image, sample_weight=sample_weight)
     inertia = kmeans.inertia_
     labels = kmeans.labels_
+    if return_centers:
+        return labels, inertia, kmeans.cluster_centers_
+    return labels, inertia
+
+def group_pixels(data, grid_step=None):
+    """
+    Group the pixels with the same feature vector (or in the same cell of a quantization grid)
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features)
+        grid_step (float): The size of the grid cells in feature units, None to group the identical feature vectors only
+
+    Returns:
+        inverse (np.ndarray): The group of each pixel
+        counts (np.ndarray): The number of pixels of each group
+    """
+    if grid_step is None:
+        keys = np.ascontiguousarray(data)
+    else:
+        keys = np.ascontiguousarray(np.floor(data / grid_step).astype(np.int64))
+
+    # compare each row as a single (void) value
+    rows = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+    _, inverse, counts = np.unique(rows, return_inverse=True, return_counts=True)
+    return inverse.ravel(), counts
+
+def reduce_features(data, inverse, counts):
+    """
+    Reduce the pixels to the mean feature vector of each group
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features)
+        inverse (np.ndarray): The group of each pixel (see `group_pixels`)
+        counts (np.ndarray): The number of pixels of each group
+
+    Returns:
+        dict: The 'means' (groups, features), 'counts', 'inverse' and the scatter of the pixels around their group means ('within_ss')
+
+    Notes:
+        The KMeans objective of the pixels is the weighted objective of the group means plus 'within_ss' (0 for identical vectors)
+    """
+    n_features = data.shape[1]
+    means = np.empty((len(counts), n_features), dtype=np.float32)
+    within_ss = 0.0
+    for j in range(n_features):
+        column = np.asarray(data[:, j], dtype=np.float64)
+        means[:, j] = np.bincount(inverse, weights=column, minlength=len(counts)) / counts
+        within_ss += float(np.sum(column ** 2) - np.sum(counts * means[:, j].astype(np.float64) ** 2))
+    return {'means': means, 'counts': counts, 'inverse': inverse, 'within_ss': max(within_ss, 0.0)}
+
+def kmeans_clustering_reduced(reduced, data, init, n_clusters, return_centers=False):
+    """
+    Perform weighted KMeans clustering on the group means and map the labels back to the pixels
+
+    Args:
+        reduced (dict): The group means, counts and inverse index of the pixels (see `reduce_features`)
+        data (np.ndarray): The features of the pixels (num_pixels, features), clustered instead when there are fewer groups than clusters
+        init (str): The specified initialization method for KMeans
+        n_clusters (int): The number of clusters for KMeans
+        return_centers (bool): Whether the fitted cluster centers are also returned
+
+    Returns:
+        numpy.ndarray: The clustered image (all the pixels)
+        float: The inertia of the pixels (weighted inertia of the group means plus their within-group scatter)
+        numpy.ndarray: The cluster centers (n_clusters, features), only with return_centers
+    """
+    if len(reduced['counts']) < n_clusters:
+        return kmeans_clustering_i(data, init, n_clusters, return_centers=return_centers)
+    labels, inertia, centers = kmeans_clustering_i(reduced['means'], init, n_clusters, sample_weight=reduced['counts'], return_centers=True)
+    if return_centers:
+        return labels[reduced['inverse']], inertia + reduced['within_ss'], centers
+    return labels[reduced['inverse']], inertia + reduced['within_ss']
+
+def grid_blocks(shape, size):
+    """
+    Number the square blocks of a grid covering an image
+
+    Args:
+        shape (tuple): The shape (height, width) of the image
+        size (int): The size of a block in pixels along each axis
+
+    Returns:
+        blocks (np.ndarray): The block of each pixel (height, width), numbered row by row
+        block_shape (tuple): The number of blocks along each axis
+    """
+    height, width = shape
+    n_rows, n_cols = -(-height // size), -(-width // size)
+    blocks = (np.arange(height) // size)[:, None] * n_cols + (np.arange(width) // size)[None, :]
+    return blocks, (n_rows, n_cols)
+
+def pyramid_blocks(valid_mask, factor=4):
+    """
+    Count the valid pixels of the blocks of a coarser resolution (e.g., 40 m blocks of 4 x 4 pixels at 10 m)
+
+    Args:
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        factor (int): The number of pixels along each axis of a block (2 - 20 m; 4 - 40 m)
+
+    Returns:
+        valid_counts (np.ndarray): The number of valid pixels of each block (n_rows, n_cols)
+        sizes (np.ndarray): The number of pixels of each block (smaller on the last row and column)
+    """
+    height, width = valid_mask.shape
+    n_rows, n_cols = -(-height // factor), -(-width // factor)
+    padded = np.zeros((n_rows * factor, n_cols * factor), dtype=bool)
+    padded[:height, :width] = valid_mask
+    valid_counts = padded.reshape(n_rows, factor, n_cols, factor).sum(axis=(1, 3))
+    sizes = np.outer(np.minimum(factor, height - np.arange(n_rows) * factor), np.minimum(factor, width - np.arange(n_cols) * factor))
+    return valid_counts, sizes
+
+def boundary_blocks(label_grid):
+    """
+    Find the blocks on the boundaries between clusters (a neighboring block has another label)
+
+    Args:
+        label_grid (np.ndarray): The cluster label of each block (n_rows, n_cols), -1 for the blocks not clustered
+
+    Returns:
+        np.ndarray: The boolean mask of the boundary blocks (n_rows, n_cols)
+
+    Notes:
+        The 8 neighbors are compared, the blocks not clustered (e.g., clouds) are not boundaries
+    """
+    n_rows, n_cols = label_grid.shape
+    padded = np.pad(label_grid, 1, constant_values=-1)
+    boundary = np.zeros(label_grid.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            neighbor = padded[1 + dy:1 + dy + n_rows, 1 + dx:1 + dx + n_cols]
+            boundary |= (neighbor >= 0) & (neighbor != label_grid)
+    return boundary & (label_grid >= 0)
+
+def upsample_blocks(grid, factor, shape):
+    """
+    Repeat the value of each block over its pixels
+
+    Args:
+        grid (np.ndarray): The value of each block (n_rows, n_cols)
+        factor (int): The number of pixels along each axis of a block
+        shape (tuple): The shape (height, width) of the pixels
+
+    Returns:
+        np.ndarray: The value of the block of each pixel (height, width)
+    """
+    return np.repeat(np.repeat(grid, factor, axis=0), factor, axis=1)[:shape[0], :shape[1]]
+
+def nearest_center(data, centers, chunk_size=1 << 16):
+    """
+    Label each pixel with its nearest cluster center
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features)
+        centers (np.ndarray): The cluster centers (n_clusters, features)
+        chunk_size (int): The number of pixels labeled at once
+
+    Returns:
+        np.ndarray: The label of each pixel
+    """
+    labels = np.empty(len(data), dtype=np.int32)
+    centers = centers.astype(np.float32)
+    for start in range(0, len(data), chunk_size):
+        labels[start:start + chunk_size] = pairwise_distances_argmin(np.asarray(data[start:start + chunk_size], dtype=np.float32), centers)
+    return labels
+
+def load_pyramid_level(row, valid_mask, factor=4):
+    """
+    Load the image and mask data of the coarse level of a scene from the overviews of its files
+
+    Args:
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        valid_mask (np.ndarray): The boolean mask of the valid pixels at full resolution (height, width)
+        factor (int): The number of pixels along each axis of a block (2 - 20 m; 4 - 40 m)
+
+    Returns:
+        coarse (dict): The image and mask data of the level (see `load_image_data`), its 'valid_mask' keeps the blocks
+                       whose pixels are all valid
+        partial (np.ndarray): The boolean mask of the blocks with both valid and cloudy pixels (n_rows, n_cols)
+
+    Notes:
+        The blocks are counted on the full-resolution cloud mask, the cloud mask of the overview is not used
+    """
+    valid_counts, sizes = pyramid_blocks(valid_mask, factor)
+    coarse = load_image_data(row, factor=factor)
+    coarse['valid_mask'] = valid_counts == sizes
+    return coarse, (valid_counts > 0) & (valid_counts < sizes)
+
+def refine_pyramid(row, valid_mask, label_grid, refine, factor, predict, tile_size=256):
+    """
+    Label the valid pixels of a scene from the labels of its coarse blocks, relabeling the pixels of the blocks to be
+    refined at full resolution from windowed reads
+
+    Args:
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        label_grid (np.ndarray): The cluster label of each block (n_rows, n_cols), or of each block for several clusterings
+                                 (n_labels, n_rows, n_cols), -1 for the blocks not clustered
+        refine (np.ndarray): The boolean mask of the blocks relabeled at full resolution (n_rows, n_cols)
+        factor (int): The number of pixels along each axis of a block
+        predict (callable): The function returning the labels ((num_pixels,) or (n_labels, num_pixels)) of the pixels of a
+                            window from their image and mask data (see `load_image_data`, with the 'valid_mask' restricted
+                            to the pixels to be relabeled)
+        tile_size (int): The size of the windows in pixels along each axis (rounded to a multiple of factor)
+
+    Returns:
+        np.ndarray: The cluster labels of the valid pixels ((num_valid_pixels,) or (n_labels, num_valid_pixels)) in int32
+
+    Notes:
+        Only the windows containing blocks to be refined are read, so the reads follow the boundary length rather than the area
+    """
+    grids = label_grid.reshape((-1,) + label_grid.shape[-2:])
+    labels = np.stack([upsample_blocks(grid.astype(np.int16), factor, valid_mask.shape) for grid in grids])
+    tile_blocks = max(1, tile_size // factor)
+    n_rows, n_cols = label_grid.shape[-2:]
+    for block_row in range(0, n_rows, tile_blocks):
+        for block_col in range(0, n_cols, tile_blocks):
+            tile_refine = refine[block_row:block_row + tile_blocks, block_col:block_col + tile_blocks]
+            if not tile_refine.any():
+                continue
+
+            # pixels of the window to be relabeled
+            row_off, col_off = block_row * factor, block_col * factor
+            tile_valid = valid_mask[row_off:row_off + tile_blocks * factor, col_off:col_off + tile_blocks * factor]
+            tile_pixels = upsample_blocks(tile_refine, factor, tile_valid.shape) & tile_valid
+            if not tile_pixels.any():
+                continue
+            height, width = tile_valid.shape
+            tile_data = load_image_data(row, window=Window(col_off, row_off, width, height))
+            tile_data['valid_mask'] = tile_pixels
+            tile_labels = labels[:, row_off:row_off + height, col_off:col_off + width]
+            tile_labels[:, tile_pixels] = np.reshape(predict(tile_data), (len(grids), -1))
+    labels = labels.reshape(len(grids), -1)[:, valid_mask.ravel()].astype(np.int32)
+    return labels.reshape(label_grid.shape[:-2] + (-1,))
+
+def superpixel_segments(valid_mask, size=20, method='grid', image=None, compactness=0.1):
+    """
+    Segment the valid pixels of a scene into superpixels (regions of neighboring pixels)
+
+    Args:
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        size (int): The approximate size of a superpixel in pixels along each axis (e.g., 20 - about 40,000 m² at 10 m)
+        method (str): 'grid' - square blocks of size x size pixels; 'slic' - SLIC superpixels on the image (requires scikit-image)
+        image (np.ndarray): The features of the valid pixels (num_valid_pixels, bands) used by SLIC (e.g., the standardized bands)
+        compactness (float): The balance between feature similarity and spatial proximity of SLIC (larger - more square regions)
+
+    Returns:
+        inverse (np.ndarray): The superpixel of each valid pixel
+        counts (np.ndarray): The number of valid pixels of each superpixel
+    """
+    height, width = valid_mask.shape
+    valid_pixels = valid_mask.ravel()
+    if method == 'grid':
+        segments, _ = grid_blocks(valid_mask.shape, size)
+    elif method == 'slic':
+        if slic is None:
+            raise ImportError('the SLIC superpixels require scikit-image (use the grid superpixels otherwise)')
+        image_2d = np.zeros((height * width, image.shape[1]), dtype=np.float32)
+        image_2d[valid_pixels] = image
+        n_segments = max(1, int(valid_pixels.sum()) // size ** 2)
+        segments = slic(image_2d.reshape(height, width, -1), n_segments=n_segments, compactness=compactness,
+                        channel_axis=-1, mask=valid_mask, start_label=1)
+    else:
+        raise ValueError(f'unknown superpixel method: {method}')
+
+    # number the superpixels containing valid pixels
+    _, inverse, counts = np.unique(segments.ravel()[valid_pixels], return_inverse=True, return_counts=True)
+    return inverse.ravel(), counts
+
+def reduce_pixels(data, reduce_mode=None, grid_step=0.01, group_data=None, segments=None):
+    """
+    Reduce the pixels to weighted group means for KMeans clustering
+
+    Args:
+        data (np.ndarray): The features clustered (num_pixels, features)
+        reduce_mode (str): None - no reduction; 'unique' - group the identical feature vectors; 'grid' - group the feature
+                           vectors in the same cell of a quantization grid; 'superpixel' - group the pixels of each superpixel
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        group_data (np.ndarray): The features used to group the pixels (defaults to data), e.g., the features before PCA
+        segments (tuple): The superpixel of each pixel and the pixel counts ('superpixel' mode, see `superpixel_segments`)
+
+    Returns:
+        dict: The group means, counts and inverse index of the pixels (see `reduce_features`), None without reduction
+    """
+    if reduce_mode is None:
+        return None
+    if reduce_mode == 'superpixel':
+        inverse, counts = segments
+    elif reduce_mode in ('unique', 'grid'):
+        inverse, counts = group_pixels(data if group_data is None else group_data, grid_step if reduce_mode == 'grid' else None)
+    else:
+        raise ValueError(f'unknown reduce mode: {reduce_mode}')
+    return reduce_features(data, inverse, counts)
+
+def stratified_sample(strata, sample_size, random_state=42):
+    """
+    Draw a pixel subsample with the same proportion of each stratum (e.g., NDWI water and flowline pixels) as the image
+
+    Args:
+        strata (np.ndarray): The stratum of each pixel (e.g., ndwi_mask_flat * 2 + flowline_mask_flat)
+        sample_size (int): The number of pixels in the subsample
+        random_state (int): The seed of the random generator
+
+    Returns:
+        np.ndarray: The sorted indices of the sampled pixels (None if the image has no more pixels than sample_size)
+
+    Notes:
+        Each stratum keeps at least one pixel, so the rare classes (e.g., flowlines) are always represented
+    """
+    n_pixels = len(strata)
+    if sample_size is None or n_pixels <= sample_size:
+        return None
+
+    rng = np.random.default_rng(random_state)
+    labels, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    n_samples = np.maximum(np.round(counts * sample_size / n_pixels).astype(np.int64), 1)
+
+    # group the pixel indices by stratum and sample each group without replacement
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sample_index = [rng.choice(order[start:start + count], size=min(n, count), replace=False)
+                    for start, count, n in zip(starts, counts, n_samples)]
+    return np.sort(np.concatenate(sample_index))
+
+def kmeans_clustering_sample(data, init, n_clusters, sample_index, batch_size=4096, return_centers=False):
+    """
+    Perform MiniBatchKMeans clustering on a pixel subsample and label all the pixels with the fitted centroids
+
+    Args:
+        data (numpy.ndarray): The input image data (num_valid_pixels, features)
+        init (str): The specified initialization method for KMeans
+        n_clusters (int): The number of clusters for KMeans
+        sample_index (np.ndarray): The indices of the sampled pixels (see `stratified_sample`)
+        batch_size (int): The number of pixels in each mini-batch
+        return_centers (bool): Whether the fitted cluster centers are also returned
+
+    Returns:
+        numpy.ndarray: The clustered image (all the pixels)
+        float: The inertia estimated from the subsample (scaled to the number of pixels)
+        numpy.ndarray: The cluster centers (n_clusters, features), only with return_centers
+    """
+    sample = data[sample_index]
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init='auto', batch_size=batch_size, max_iter=300, random_state=42).fit(sample)
+    inertia = kmeans.inertia_ * len(data) / len(sample)
+    labels = kmeans.predict(data)
+    if return_centers:
+        return labels, inertia, kmeans.cluster_centers_
     return labels, inertia
 
 def find_sharpest_slope_point(cluster_list, inertia_result):
@@ -283,6 +776,81 @@ def find_sharpest_slope_point(cluster_list, inertia_result):
     sharpest_slope_index = np.argmax(np.abs(slopes)) # identify the index
     return cluster_list[sharpest_slope_index + 1] # return the optimal number of clusters
 
+def elbow_search(data, init, cluster_list, sample_index=None, reduced=None, return_centers=False):
+    """
+    Determine the optimal number of clusters with the elbow method and cluster the image with it
+
+    Args:
+        data (numpy.ndarray): The input image data (num_valid_pixels, features)
+        init (str): The specified initialization method for KMeans
+        cluster_list (list): A list of the number of clusters tested
+        sample_index (np.ndarray): The indices of the sampled pixels (see `stratified_sample`), None to fit KMeans on all the pixels
+        reduced (dict): The group means of the pixels (see `reduce_features`) used to fit weighted KMeans instead of all the
+                        pixels (ignored with a subsample)
+        return_centers (bool): Whether the cluster centers of the optimal number of clusters are also returned
+
+    Returns:
+        inertia_result (list): The inertia of each number of clusters
+        optimal_clusters (int): The optimal number of clusters
+        clustered_image (np.ndarray): The clustered image with the optimal number of clusters
+        centers (np.ndarray): The cluster centers with the optimal number of clusters, only with return_centers
+
+    Notes:
+        With a subsample, each fit is a MiniBatchKMeans on the subsample and the final model labels all the pixels
+        with a single predict
+    """
+    def fit(n_clusters, return_centers=False):
+        if sample_index is not None:
+            return kmeans_clustering_sample(data, init, n_clusters, sample_index, return_centers=return_centers)
+        if reduced is not None:
+            return kmeans_clustering_reduced(reduced, data, init, n_clusters, return_centers=return_centers)
+        return kmeans_clustering_i(data, init, n_clusters, return_centers=return_centers)
+
+    inertia_result = []
+    for i in cluster_list:
+        _, inertia = fit(i)
+        inertia_result.append(inertia)
+    kl = KneeLocator(cluster_list, inertia_result, curve='convex', direction='decreasing')
+    optimal_clusters = kl.elbow
+    if optimal_clusters is not None and not np.isnan(float(optimal_clusters)):
+        optimal_clusters = int(optimal_clusters)
+    else:
+        optimal_clusters = int(find_sharpest_slope_point(cluster_list, inertia_result))
+
+    # run KMeans with the optimal n_clusters
+    if return_centers:
+        clustered_image, _, centers = fit(optimal_clusters, return_centers=True)
+        return inertia_result, optimal_clusters, clustered_image, centers
+    clustered_image, _ = fit(optimal_clusters)
+    return inertia_result, optimal_clusters, clustered_image
+
+def check_elbow_accuracy(data, init, cluster_list, inertia_result, optimal_clusters, clustered_image):
+    """
+    Compare the subsampled elbow search with the elbow search on all the pixels
+
+    Args:
+        data (numpy.ndarray): The input image data (num_valid_pixels, features)
+        init (str): The specified initialization method for KMeans
+        cluster_list (list): A list of the number of clusters tested
+        inertia_result (list): The inertia of each number of clusters estimated from the subsample
+        optimal_clusters (int): The optimal number of clusters selected from the subsample
+        clustered_image (np.ndarray): The clustered image from the subsample
+
+    Returns:
+        dict: The optimal number of clusters on all the pixels ('n_clusters_full'), the largest relative error of the
+              estimated inertia ('inertia_error') and the adjusted Rand index between the clustered images ('label_agreement')
+    """
+    inertia_full, optimal_full, _ = elbow_search(data, init, cluster_list)
+    inertia_error = np.max(np.abs(np.array(inertia_result) - inertia_full) / np.array(inertia_full))
+
+    # compare the labels with the same number of clusters (the label ids are not compared, only the partitions)
+    clustered_full, _ = kmeans_clustering_i(data, init, optimal_clusters)
+    return {
+        'n_clusters_full': optimal_full,
+        'inertia_error': round(float(inertia_error), 4),
+        'label_agreement': round(float(adjusted_rand_score(clustered_full, clustered_image)), 4)
+    }
+
 def identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat):
     """
     Identify the cluster with the greatest possibility of representing flooded area
@@ -305,7 +873,83 @@ def identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat):
             flood_cluster = cluster
     return flood_cluster
 
-def kmeans_clustering_default(df, init, n_clusters, condition):
+def cluster_scene_default(scaled_image, valid_mask, labels, init, n_clusters, reduce_mode=None, grid_step=0.01, superpixel_size=20,
+                          superpixel_method='grid'):
+    """
+    Perform default KMeans clustering on the valid pixels of a scene (run in a worker process, see `parallel_utils.map_scenes`)
+
+    Args:
+        scaled_image (np.ndarray): The standardized valid pixels (num_valid_pixels, bands)
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        labels (np.ndarray): The array filled with the cluster labels (num_valid_pixels,)
+        init (str): The specified initialization method for KMeans
+        n_clusters (int): The number of clusters for KMeans
+        reduce_mode (str): The reduction of the pixels before clustering (see `reduce_pixels`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        superpixel_size (int): The approximate size of a superpixel in pixels along each axis ('superpixel' mode)
+        superpixel_method (str): The superpixel method ('superpixel' mode, see `superpixel_segments`)
+
+    Returns:
+        float: The inertia of the clustering result
+    """
+    segments = None
+    if reduce_mode == 'superpixel':
+        segments = superpixel_segments(valid_mask, superpixel_size, superpixel_method, scaled_image)
+    reduced = reduce_pixels(scaled_image, reduce_mode, grid_step, segments=segments)
+    if reduced is None:
+        labels[:], inertia = kmeans_clustering_i(scaled_image, init, n_clusters)
+    else:
+        labels[:], inertia = kmeans_clustering_reduced(reduced, scaled_image, init, n_clusters)
+    return inertia
+
+def cluster_scene_pyramid(valid_mask, labels, row, init, n_clusters, pyramid_factor=4, tile_size=256):
+    """
+    Perform default KMeans clustering on the coarse level of a scene and refine the boundary blocks at full resolution
+    (run in a worker process, see `parallel_utils.map_scenes`)
+
+    Args:
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        labels (np.ndarray): The array filled with the cluster labels (num_valid_pixels,)
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        init (str): The specified initialization method for KMeans
+        n_clusters (int): The number of clusters for KMeans
+        pyramid_factor (int): The number of pixels along each axis of the coarse blocks (2 - 20 m; 4 - 40 m)
+        tile_size (int): The size of the windows read at full resolution (see `refine_pyramid`)
+
+    Returns:
+        float: The inertia of the clustering of the coarse blocks
+
+    Notes:
+        KMeans is fitted on the blocks without clouds, read from the overviews (see `load_pyramid_level`), and standardized
+        with their own mean and scale. The pixels of the blocks on the cluster boundaries or partly cloudy are relabeled
+        with the nearest fitted center. A scene with fewer clear blocks than clusters is clustered at full resolution
+    """
+    coarse, partial = load_pyramid_level(row, valid_mask, pyramid_factor)
+    coarse_valid = coarse['valid_mask']
+    if coarse_valid.sum() < n_clusters:
+        image_data = {**load_image_data(row), 'valid_mask': valid_mask}
+        labels[:], inertia = kmeans_clustering_i(preprocess_image(row, image_data)['scaled_image'], init, n_clusters)
+        return inertia
+
+    # fit KMeans on the clear blocks
+    bands = scene_utils.gather_valid(coarse['sat_image'], coarse_valid)
+    standardization = standardize(bands)
+    block_labels, inertia, centers = kmeans_clustering_i(bands, init, n_clusters, return_centers=True)
+    label_grid = np.full(coarse_valid.shape, -1, dtype=np.int16)
+    label_grid[coarse_valid] = block_labels
+
+    # relabel the pixels of the boundary and partly cloudy blocks at full resolution
+    def predict(tile_data):
+        data = scene_utils.gather_valid(tile_data['sat_image'], tile_data['valid_mask'])
+        standardize(data, standardization)
+        return nearest_center(data, centers)
+
+    refine = boundary_blocks(label_grid) | partial
+    labels[:] = refine_pyramid(row, valid_mask, label_grid, refine, pyramid_factor, predict, tile_size)
+    return inertia
+
+def kmeans_clustering_default(df, init, n_clusters, condition, workers=None, reduce_mode=None, grid_step=0.01, superpixel_size=20,
+                              superpixel_method='grid', pyramid_factor=4):
     """
     Perform default KMeans clustering on the image datasets
 
@@ -314,8 +958,20 @@ def kmeans_clustering_default(df, init, n_clusters, condition):
         init (str): The specified initialization method for KMeans
         n_clusters (int): The number of clusters for KMeans clustering
         condition (str): The string used to label the executed KMeans clustering setting
+        workers (int): The number of worker processes (defaults to `parallel_utils.n_workers`), 1 runs in the main process
+        reduce_mode (str): None - cluster all the pixels; 'unique' - cluster the unique feature vectors weighted by their
+                           pixel counts; 'grid' - cluster the means of a quantization grid; 'superpixel' - cluster the mean
+                           features of superpixels weighted by their sizes; 'pyramid' - cluster the coarse blocks read from
+                           the overviews and refine the pixels near the cluster boundaries (see `cluster_scene_pyramid`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        superpixel_size (int): The approximate size of a superpixel in pixels along each axis ('superpixel' mode)
+        superpixel_method (str): 'grid' - square blocks; 'slic' - SLIC superpixels (requires scikit-image)
+        pyramid_factor (int): The number of pixels along each axis of the coarse blocks ('pyramid' mode, 2 - 20 m; 4 - 40 m)
     Returns:
         pd.DataFrame: A dataframe storing the results
+
+    Notes:
+        In 'pyramid' mode the scenes are not loaded at full resolution, the parent only reads their cloud and NDWI masks
     """
     global_utils.print_func_header(f'run default KMeans clustering')
 
@@ -323,25 +979,56 @@ def kmeans_clustering_default(df, init, n_clusters, condition):
     cluster_pixel_count_list = []
     flood_cluster_list = []
 
-    for _, row in df_mod.iterrows():
-        scaled_image = row['scaled_image']
-        sat_image = row['sat_image']
-        valid_pixels = row['valid_pixels']
-        ndwi_mask = row['ndwi_mask']
-
-        ndwi_mask_flat = ndwi_mask.flatten()[valid_pixels]
-        clustered_image, _ = kmeans_clustering_i(scaled_image, init, n_clusters)
-        unique_labels, counts = np.unique(clustered_image, return_counts=True)
-        cluster_pixel_count = {f'cluster_{label}': int(count) for label, count in zip(unique_labels, counts)}
-        cluster_pixel_count_list.append(cluster_pixel_count)
-
-        # automatically identify the flood cluster
-        flood_cluster = identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat)
-        flood_cluster_list.append(flood_cluster)
-
-        filename = f"{row['id']}_{row['date']}_default"
-        plot_clustered_result(clustered_image, valid_pixels, sat_image.shape, n_clusters, filename, condition)
-        print(f"complete - KMeans clustering on {row['filename']}")
+    def tasks():
+        for _, row in df_mod.iterrows():
+
+            # the pyramid workers read the coarse level and the boundary windows of the scene themselves
+            if reduce_mode == 'pyramid':
+                masks = load_scene_masks(row)
+                yield {
+                    'arrays': {'valid_mask': masks['valid_mask']},
+                    'outputs': {'labels': np.empty(len(masks['ndwi_mask_flat']), dtype=np.int32)},
+                    'kwargs': {'row': row, 'init': init, 'n_clusters': n_clusters, 'pyramid_factor': pyramid_factor},
+                    'row': row,
+                    'valid_pixels': masks['valid_pixels'],
+                    'ndwi_mask_flat': masks['ndwi_mask_flat'],
+                    'shape': masks['shape']
+                }
+                continue
+
+            scene = get_scene_data(row)
+            yield {
+                'arrays': {'scaled_image': scene['scaled_image'], 'valid_mask': scene['valid_mask']},
+                'outputs': {'labels': np.empty(len(scene['scaled_image']), dtype=np.int32)},
+                'kwargs': {'init': init, 'n_clusters': n_clusters, 'reduce_mode': reduce_mode, 'grid_step': grid_step,
+                           'superpixel_size': superpixel_size, 'superpixel_method': superpixel_method},
+                'row': row,
+                'valid_pixels': scene['valid_pixels'],
+                'ndwi_mask_flat': scene['ndwi_mask'].ravel()[scene['valid_pixels']],
+                'shape': scene['sat_image'].shape
+            }
+
+    # cluster the scenes in parallel, the results are in the order of the rows
+    func = cluster_scene_pyramid if reduce_mode == 'pyramid' else cluster_scene_default
+    try:
+        for task, _ in parallel_utils.map_scenes(func, tasks(), workers):
+            row, valid_pixels, ndwi_mask_flat = task['row'], task['valid_pixels'], task['ndwi_mask_flat']
+            clustered_image = task['outputs']['labels']
+
+            unique_labels, counts = np.unique(clustered_image, return_counts=True)
+            cluster_pixel_count = {f'cluster_{label}': int(count) for label, count in zip(unique_labels, counts)}
+            cluster_pixel_count_list.append(cluster_pixel_count)
+
+            # automatically identify the flood cluster
+            flood_cluster = identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat)
+            flood_cluster_list.append(flood_cluster)
+
+            filename = f"{row['id']}_{row['date']}_default"
+            plot_clustered_result(clustered_image, valid_pixels, task['shape'], n_clusters, filename, condition)
+            print(f"complete - KMeans clustering on {row['filename']}")
+    finally:
+        # save the figure cache once for all the scenes
+        render_utils.save_manifest()
 
     # print the first row
     print('\nprint out the first row for inspection\n', df_mod.iloc[0])
@@ -357,121 +1044,377 @@ def kmeans_clustering_default(df, init, n_clusters, condition):
 
     return result_df
 
-def kmeans_optimization_individual_pca_features(df, init, condition):
+def cluster_condition(data, strata, init, elbow_mode='full', sample_size=50000, check_accuracy=False, pca=None, pca_sample_size=200000,
+                      reduce_mode=None, grid_step=0.01, segments=None, return_model=False):
     """
-    Optimize KMeans clustering by introducing NDWI/flowline mask and applying PCA
+    Cluster the features of one condition (PCA and elbow method)
 
     Args:
-        df (pd.DataFrame): The dataframe with image data used to do optimization
+        data (np.ndarray): The features of the condition (num_valid_pixels, features), see `condition_features`
+        strata (np.ndarray): The stratum of each pixel used to draw the subsample (e.g., ndwi_mask_flat * 2 + flowline_mask_flat)
         init (str): The specified initialization method for KMeans
-        condition (str): The string used to determine what type of optimization is applied
-    
+        elbow_mode (str): The elbow search mode (see `kmeans_optimization_individual_pca_features`)
+        sample_size (int): The number of pixels in the subsample ('minibatch' mode)
+        check_accuracy (bool): Whether to compare the subsampled elbow search with the full-data one ('minibatch' mode)
+        pca (dict): The fitted PCA used to project the features (see `pca_utils.fit_pca`), None to fit it on the scene
+        pca_sample_size (int): The number of pixels (stratified subsample) used to fit the PCA, None for all the pixels
+        reduce_mode (str): The reduction of the pixels before clustering ('full' mode, see `reduce_pixels`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        segments (tuple): The superpixel of each pixel and the pixel counts ('superpixel' mode, see `superpixel_segments`)
+        return_model (bool): Whether the fitted 'pca' and cluster 'centers' (in the projected space) are added to the information,
+                             e.g., to label other pixels (see `cluster_scene_conditions_pyramid`)
+
     Returns:
-        pd.DataFrame: A dataframe storing the results 
+        clustered_image (np.ndarray): The cluster labels of the valid pixels
+        info (dict): The 'explained_variance', 'n_components', 'cluster_list', 'inertia_result', 'optimal_clusters', 'accuracy'
+                     and the feature 'moments' of the PCA fit (None if the PCA was provided)
     """
-    global_utils.print_func_header(f'optimize image individually with {condition}')
-    df_mod = df.copy()
+    # fit PCA once (covariance of the features) and determine the optimal n_components
+    moments = None
+    if pca is None:
+        moments = pca_utils.feature_moments(data, stratified_sample(strata, pca_sample_size))
+        pca = pca_utils.fit_pca(moments)
+    explained_variance = np.cumsum(pca['explained_variance_ratio'])
+    n_components = pca_utils.select_components(pca['explained_variance_ratio'], 0.90)
+
+    # project on the optimal n_components with the fitted components
+    scaled_data_pca = pca_utils.project(data, pca, n_components)
+
+    # determine the optimal n_clusters using elbow method (on a subsample stratified by water and flowline pixels)
+    cluster_list = [2, 3, 4, 5, 6]
+    sample_index = None
+    reduced = None
+    if elbow_mode == 'minibatch':
+        sample_index = stratified_sample(strata, sample_size)
+    else:
+        # group the pixels on the features before PCA (the identical vectors have identical projections)
+        reduced = reduce_pixels(scaled_data_pca, reduce_mode, grid_step, group_data=data, segments=segments)
+    search = elbow_search(scaled_data_pca, init, cluster_list, sample_index, reduced, return_model)
+    inertia_result, optimal_clusters, clustered_image = search[:3]
+
+    # compare with the full-data elbow search
+    accuracy = None
+    if check_accuracy and sample_index is not None:
+        accuracy = check_elbow_accuracy(scaled_data_pca, init, cluster_list, inertia_result, optimal_clusters, clustered_image)
+
+    info = {
+        'explained_variance': explained_variance.tolist(),
+        'n_components': n_components,
+        'cluster_list': cluster_list,
+        'inertia_result': [float(inertia) for inertia in inertia_result],
+        'optimal_clusters': optimal_clusters,
+        'accuracy': accuracy,
+        'moments': moments
+    }
+    if return_model:
+        info['pca'], info['centers'] = pca, search[3]
+    return clustered_image, info
+
+def cluster_scene_conditions(feature_bank, strata, valid_mask, labels, feature_columns, conditions, init, elbow_mode='full', sample_size=50000,
+                             check_accuracy=False, pca_list=None, pca_sample_size=200000, reduce_mode=None, grid_step=0.01,
+                             superpixel_size=20, superpixel_method='grid'):
+    """
+    Cluster the features of each condition of a scene (run in a worker process, see `parallel_utils.map_scenes`)
 
-    # create list to store information
-    pca_n_components_list = []
-    n_clusters_list = []
-    cluster_pixel_count_list = []
-    flood_cluster_list = []
-    explained_variance_list = []
-    inertia_result_list = []
-
-    for _, row in df_mod.iterrows():
-
-        # load the image data and features to be used
-        scaled_image = row['scaled_image']
-        ndwi_mask = row['ndwi_mask']
-        flowline_mask = row['flowline_mask']
-        valid_pixels = row['valid_pixels']
-        sat_image = row['sat_image']
-
-        # flatten the data
-        ndwi_mask_flat = ndwi_mask.flatten()[valid_pixels]
-        flowline_mask_flat = flowline_mask.flatten()[valid_pixels]
-
-        # check which optimization to be selected
-        if condition == 'flowline_pca':
-            non_image_features = flowline_mask_flat.reshape(-1, 1)
-        elif condition == 'ndwi_pca':
-            non_image_features = ndwi_mask_flat.reshape(-1, 1)
-        elif condition == 'features_pca':
-            non_image_features = np.column_stack([ndwi_mask_flat, flowline_mask_flat])
-        else:
-            non_image_features = None
+    Args:
+        feature_bank (np.ndarray): The feature bank of the scene (see `preprocess_image`)
+        strata (np.ndarray): The stratum of each pixel used to draw the subsample
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        labels (np.ndarray): The array filled with the cluster labels of each condition (n_conditions, num_valid_pixels)
+        feature_columns (list of str): The names of the columns of the feature bank
+        conditions (list of str): The conditions determining the features (see `condition_columns`)
+        init (str): The specified initialization method for KMeans
+        elbow_mode (str): The elbow search mode (see `kmeans_optimization_individual_pca_features`)
+        sample_size (int): The number of pixels in the subsample ('minibatch' mode)
+        check_accuracy (bool): Whether to compare the subsampled elbow search with the full-data one ('minibatch' mode)
+        pca_list (list of dict): The fitted PCA of each condition (None items are fitted on the scene), None to fit all of them
+        pca_sample_size (int): The number of pixels used to fit the PCA, None for all the pixels
+        reduce_mode (str): The reduction of the pixels before clustering ('full' mode, see `reduce_pixels`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        superpixel_size (int): The approximate size of a superpixel in pixels along each axis ('superpixel' mode)
+        superpixel_method (str): The superpixel method ('superpixel' mode, see `superpixel_segments`)
 
-        # define the data used to PCA and KMeans clustering
-        if non_image_features is not None:
-            scaler = StandardScaler()
-            non_image_features_scaled = scaler.fit_transform(non_image_features)
-            combined_data = np.column_stack([scaled_image, non_image_features_scaled])
-        else:
-            combined_data = scaled_image
-
-        # test PCA and determine the optimal n_components
-        pca_test = PCA()
-        pca_test.fit(combined_data)
-        explained_variance = np.cumsum(pca_test.explained_variance_ratio_)
-        explained_variance_list.append(str(explained_variance.tolist()))
-
-        n_components = np.argmax(explained_variance >= 0.90) + 1
-        pca_n_components_list.append(n_components)
-
-        # apply PCA with the optimal n_components
-        pca = PCA(n_components=n_components)
-        scaled_data_pca = pca.fit_transform(combined_data)
-
-        # determine the optimal n_clusters using elbow method
-        cluster_list = [2, 3, 4, 5, 6]
-        inertia_result = []
-        for i in cluster_list:
-            _, inertia = kmeans_clustering_i(scaled_data_pca, init, i)
-            inertia_result.append(inertia)
-        kl = KneeLocator(cluster_list, inertia_result, curve='convex', direction='decreasing')
-        optimal_clusters = kl.elbow
-        if optimal_clusters is not None and not np.isnan(float(optimal_clusters)):
-            optimal_clusters = int(optimal_clusters)
-        else:
-            optimal_clusters = int(find_sharpest_slope_point(cluster_list, inertia_result))
-        n_clusters_list.append(optimal_clusters)
-        inertia_result_list.append(str(inertia_result))
+    Returns:
+        list of dict: The clustering information of each condition (see `cluster_condition`)
+    """
+    bank = {'feature_bank': feature_bank, 'feature_columns': feature_columns}
+    pca_list = pca_list or [None] * len(conditions)
+
+    # segment the scene once (on the standardized bands) for all the conditions
+    segments = None
+    if reduce_mode == 'superpixel' and elbow_mode == 'full':
+        segments = superpixel_segments(valid_mask, superpixel_size, superpixel_method, condition_features(bank, ['bands']))
+
+    info_list = []
+    for i, condition in enumerate(conditions):
+        labels[i], info = cluster_condition(condition_features(bank, condition), strata, init, elbow_mode, sample_size, check_accuracy,
+                                            pca_list[i], pca_sample_size, reduce_mode, grid_step, segments)
+        info_list.append(info)
+    return info_list
+
+def cluster_scene_conditions_pyramid(valid_mask, labels, row, conditions, init, elbow_mode='full', sample_size=50000, check_accuracy=False,
+                                     pca_list=None, pca_sample_size=200000, pyramid_factor=4, tile_size=256):
+    """
+    Cluster the features of each condition of the coarse level of a scene and refine the boundary blocks at full resolution
+    (run in a worker process, see `parallel_utils.map_scenes`)
+
+    Args:
+        valid_mask (np.ndarray): The boolean mask of the valid pixels (height, width)
+        labels (np.ndarray): The array filled with the cluster labels of each condition (n_conditions, num_valid_pixels)
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        conditions (list of str): The conditions determining the features (see `condition_columns`)
+        init (str): The specified initialization method for KMeans
+        elbow_mode (str): The elbow search mode (see `kmeans_optimization_individual_pca_features`)
+        sample_size (int): The number of pixels in the subsample ('minibatch' mode)
+        check_accuracy (bool): Whether to compare the subsampled elbow search with the full-data one ('minibatch' mode)
+        pca_list (list of dict): The fitted PCA of each condition (None items are fitted on the scene), None to fit all of them
+        pca_sample_size (int): The number of pixels used to fit the PCA, None for all the pixels
+        pyramid_factor (int): The number of pixels along each axis of the coarse blocks (2 - 20 m; 4 - 40 m)
+        tile_size (int): The size of the windows read at full resolution (see `refine_pyramid`)
+
+    Returns:
+        list of dict: The clustering information of each condition (see `cluster_condition`), with the PCA moments and
+                      inertia of the coarse blocks
 
-        # run KMeans
-        clustered_image, _ = kmeans_clustering_i(scaled_data_pca, init, optimal_clusters)
-        unique_labels, counts = np.unique(clustered_image, return_counts=True)
-        cluster_pixel_count = {f'cluster_{label}': int(count) for label, count in zip(unique_labels, counts)}
-        cluster_pixel_count_list.append(cluster_pixel_count)
+    Notes:
+        The feature bank of the clear blocks is built from the overviews (see `load_pyramid_level`), the windows are
+        standardized with its mean and scale. The pixels of the blocks on the boundaries of any condition or partly cloudy
+        are relabeled with the nearest fitted center of each condition. A scene with fewer clear blocks than the largest
+        number of clusters tested is clustered at full resolution
+    """
+    pca_list = pca_list or [None] * len(conditions)
+    coarse, partial = load_pyramid_level(row, valid_mask, pyramid_factor)
+    coarse_valid = coarse['valid_mask']
+    if coarse_valid.sum() < 6:
+        image_data = {**load_image_data(row), 'valid_mask': valid_mask}
+        scene = preprocess_image(row, image_data)
+        strata = image_data['ndwi_mask'].ravel()[scene['valid_pixels']] * 2 + image_data['flowline_mask'].ravel()[scene['valid_pixels']]
+        return cluster_scene_conditions(scene['feature_bank'], strata, valid_mask, labels, scene['feature_columns'], conditions, init,
+                                        elbow_mode, sample_size, check_accuracy, pca_list, pca_sample_size)
+
+    # cluster the feature bank of the clear blocks for each condition
+    bank = preprocess_image(row, coarse)
+    coarse_pixels = bank['valid_pixels']
+    strata = coarse['ndwi_mask'].ravel()[coarse_pixels] * 2 + coarse['flowline_mask'].ravel()[coarse_pixels]
+    label_grid = np.full((len(conditions),) + coarse_valid.shape, -1, dtype=np.int16)
+    info_list, models = [], []
+    for i, condition in enumerate(conditions):
+        block_labels, info = cluster_condition(condition_features(bank, condition), strata, init, elbow_mode, sample_size, check_accuracy,
+                                               pca_list[i], pca_sample_size, return_model=True)
+        label_grid[i][coarse_valid] = block_labels
+        models.append((info.pop('pca'), info['n_components'], info.pop('centers')))
+        info_list.append(info)
+
+    # relabel the pixels of the boundary and partly cloudy blocks at full resolution
+    def predict(tile_data):
+        tile_bank = preprocess_image(row, tile_data, bank['standardization'])
+        return np.stack([nearest_center(pca_utils.project(condition_features(tile_bank, condition), pca, n_components), centers)
+                         for condition, (pca, n_components, centers) in zip(conditions, models)])
+
+    refine = partial.copy()
+    for grid in label_grid:
+        refine |= boundary_blocks(grid)
+    labels[:] = refine_pyramid(row, valid_mask, label_grid, refine, pyramid_factor, predict, tile_size)
+    return info_list
+
+def summarize_condition(row, valid_pixels, ndwi_mask_flat, shape, condition, clustered_image, info, check_accuracy=False):
+    """
+    Summarize the clustering result of a scene for one condition (cluster pixel counts, flood cluster and plot)
 
-        # automatically identify the flood cluster by checking the overlap between cluster and NDWI
-        flood_cluster = identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat)
-        flood_cluster_list.append(flood_cluster)
+    Args:
+        row (pd.Series): The image metadata (e.g., a row of the image DataFrame)
+        valid_pixels (np.ndarray): The flat indices of the valid pixels of the scene
+        ndwi_mask_flat (np.ndarray): The NDWI mask of the valid pixels
+        shape (tuple): The shape of the satellite image (bands, height, width)
+        condition (str): The condition determining the features (see `condition_columns`)
+        clustered_image (np.ndarray): The cluster labels of the valid pixels
+        info (dict): The clustering information (see `cluster_condition`)
+        check_accuracy (bool): Whether the accuracy of the subsampled elbow search is reported
 
-        # add necessary plot
-        filename = f"{row['id']}_{row['date']}_{condition}_i"
-        plot_clustered_result(clustered_image, valid_pixels, sat_image.shape, optimal_clusters, filename, condition)
+    Returns:
+        dict: The results of the scene (one value per column of the condition's result DataFrame)
+    """
+    if info['accuracy'] is not None:
+        print(f"elbow search accuracy for {row['filename']} ({condition}): {info['accuracy']}")
+
+    # cluster pixel counts
+    unique_labels, counts = np.unique(clustered_image, return_counts=True)
+    cluster_pixel_count = {f'cluster_{label}': int(count) for label, count in zip(unique_labels, counts)}
+
+    # automatically identify the flood cluster by checking the overlap between cluster and NDWI
+    flood_cluster = identify_flood_cluster(unique_labels, clustered_image, ndwi_mask_flat)
+
+    # add necessary plot
+    filename = f"{row['id']}_{row['date']}_{condition}_i"
+    plot_clustered_result(clustered_image, valid_pixels, shape, info['optimal_clusters'], filename, condition)
+
+    result = {
+        f'cluster_pixel_count_{condition}_i': cluster_pixel_count,
+        f'n_clusters_{condition}_i': info['optimal_clusters'],
+        f'n_components_{condition}_i': info['n_components'],
+        f'flooded_cluster_{condition}_i': flood_cluster,
+        f'explained_variance_{condition}_i': str(info['explained_variance']),
+        f'inertia_result_{condition}_i': str(info['inertia_result']),
+        f'n_clusters_list_{condition}_i': str(info['cluster_list'])
+    }
+    if check_accuracy:
+        result[f'elbow_accuracy_{condition}_i'] = info['accuracy']
+    return result
+
+def run_conditions(df, init, conditions, elbow_mode='full', sample_size=50000, check_accuracy=False, workers=None,
+                   pca_mode='fit', pca_sample_size=200000, reduce_mode=None, grid_step=0.01, superpixel_size=20, superpixel_method='grid',
+                   pyramid_factor=4):
+    """
+    Optimize KMeans clustering for several conditions in a single pass over the scenes, with the scenes clustered in parallel
 
-        print(f"complete - optimize image individually with {condition} {row['filename']}")
+    Args:
+        df (pd.DataFrame): The dataframe with image data used to do optimization
+        init (str): The specified initialization method for KMeans
+        conditions (list of str): The conditions determining the features (see `condition_columns`)
+        elbow_mode (str): The elbow search mode (see `kmeans_optimization_individual_pca_features`)
+        sample_size (int): The number of pixels in the subsample ('minibatch' mode)
+        check_accuracy (bool): Whether to compare the subsampled elbow search with the full-data one ('minibatch' mode, slow)
+        workers (int): The number of worker processes (defaults to `parallel_utils.n_workers`), 1 runs in the main process
+        pca_mode (str): 'fit' - fit the PCA on each scene; 'predict' - project the scenes with the saved PCA of their event
+                        (fitted on the scene if missing)
+        pca_sample_size (int): The number of pixels (stratified subsample) used to fit the PCA of a scene, None for all the pixels
+        reduce_mode (str): The reduction of the pixels before clustering ('full' mode, see `kmeans_clustering_default`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        superpixel_size (int): The approximate size of a superpixel in pixels along each axis ('superpixel' mode)
+        superpixel_method (str): 'grid' - square blocks; 'slic' - SLIC superpixels (requires scikit-image)
+        pyramid_factor (int): The number of pixels along each axis of the coarse blocks ('pyramid' mode, 2 - 20 m; 4 - 40 m)
 
-    print('selected n_components among all the images:\n', set(pca_n_components_list))
-    print('selected n_clusters among all the images:\n', set(n_clusters_list))
+    Returns:
+        dict: The DataFrame storing the results of each condition (also saved to data/df_kmeans/df_kmeans_{condition}_i.csv)
 
-    # create a DataFrame to store results
-    result_df = pd.DataFrame({
-            'id': df_mod['filename'],
-            f'cluster_pixel_count_{condition}_i': cluster_pixel_count_list,
-            f'n_clusters_{condition}_i': n_clusters_list,
-            f'n_components_{condition}_i': pca_n_components_list,
-            f'flooded_cluster_{condition}_i': flood_cluster_list,
-            f'explained_variance_{condition}_i': explained_variance_list,
-            f'inertia_result_{condition}_i': inertia_result_list,
-            f'n_clusters_list_{condition}_i': [str(cluster_list)] * len(df_mod)
-        })
-
-    result_df.to_csv(f'data/df_kmeans/df_kmeans_{condition}_i.csv', index=False)
-    return result_df
+    Notes:
+        Each scene is loaded (or read from the scene cache) once and all its conditions share its feature bank, which is
+        passed to the workers through shared memory. The results are in the order of the rows.
+        In 'pyramid' mode (with the 'full' elbow mode) the parent only reads the cloud and NDWI masks of the scenes, the
+        workers cluster the coarse level and read the boundary windows (see `cluster_scene_conditions_pyramid`).
+        The moments of the fitted scenes are pooled per event and condition, and the PCA of each event is saved to
+        data/pca/{event}_{condition}.npz for the predict mode
+    """
+    if elbow_mode not in ('full', 'minibatch'):
+        raise ValueError(f'unknown elbow mode: {elbow_mode}')
+    if pca_mode not in ('fit', 'predict'):
+        raise ValueError(f'unknown PCA mode: {pca_mode}')
+    global_utils.print_func_header(f"optimize image individually with {', '.join(conditions)}")
+    df_mod = df.copy()
+    check_accuracy = check_accuracy and elbow_mode == 'minibatch'
+    pyramid = reduce_mode == 'pyramid' and elbow_mode == 'full'
+
+    def load_pca_list(row, feature_columns):
+        if pca_mode != 'predict':
+            return None
+        return [pca_utils.load_pca(row['id'], condition, condition_names(feature_columns, condition)) for condition in conditions]
+
+    def tasks():
+        for _, row in df_mod.iterrows():
+
+            # the pyramid workers read the coarse level and the boundary windows of the scene themselves
+            if pyramid:
+                masks = load_scene_masks(row)
+                feature_columns = bank_columns(masks['shape'][0])
+                yield {
+                    'arrays': {'valid_mask': masks['valid_mask']},
+                    'outputs': {'labels': np.empty((len(conditions), len(masks['ndwi_mask_flat'])), dtype=np.int32)},
+                    'kwargs': {'row': row, 'conditions': conditions, 'init': init, 'elbow_mode': elbow_mode, 'sample_size': sample_size,
+                               'check_accuracy': check_accuracy, 'pca_list': load_pca_list(row, feature_columns),
+                               'pca_sample_size': pca_sample_size, 'pyramid_factor': pyramid_factor},
+                    'row': row,
+                    'valid_pixels': masks['valid_pixels'],
+                    'ndwi_mask_flat': masks['ndwi_mask_flat'],
+                    'shape': masks['shape'],
+                    'feature_columns': feature_columns
+                }
+                continue
+
+            # load the image data and feature bank once for all the conditions
+            scene = get_scene_data(row)
+            valid_pixels = scene['valid_pixels']
+            strata = scene['ndwi_mask'].ravel()[valid_pixels] * 2 + scene['flowline_mask'].ravel()[valid_pixels]
+
+            # load the saved PCA of the event (predict mode)
+            pca_list = load_pca_list(row, scene['feature_columns'])
+            yield {
+                'arrays': {'feature_bank': scene['feature_bank'], 'strata': strata, 'valid_mask': scene['valid_mask']},
+                'outputs': {'labels': np.empty((len(conditions), len(strata)), dtype=np.int32)},
+                'kwargs': {'feature_columns': scene['feature_columns'], 'conditions': conditions, 'init': init,
+                           'elbow_mode': elbow_mode, 'sample_size': sample_size, 'check_accuracy': check_accuracy,
+                           'pca_list': pca_list, 'pca_sample_size': pca_sample_size, 'reduce_mode': reduce_mode, 'grid_step': grid_step,
+                           'superpixel_size': superpixel_size, 'superpixel_method': superpixel_method},
+                'row': row,
+                'valid_pixels': valid_pixels,
+                'ndwi_mask_flat': scene['ndwi_mask'].ravel()[valid_pixels],
+                'shape': scene['sat_image'].shape,
+                'feature_columns': scene['feature_columns']
+            }
+
+    results = {condition: [] for condition in conditions}
+    event_moments = {}
+    try:
+        func = cluster_scene_conditions_pyramid if pyramid else cluster_scene_conditions
+        for task, info_list in parallel_utils.map_scenes(func, tasks(), workers):
+            row = task['row']
+            for i, condition in enumerate(conditions):
+                results[condition].append(summarize_condition(row, task['valid_pixels'], task['ndwi_mask_flat'], task['shape'], condition,
+                                                              task['outputs']['labels'][i], info_list[i], check_accuracy))
+                if info_list[i]['moments'] is not None:
+                    key = (row['id'], condition, tuple(condition_names(task['feature_columns'], condition)))
+                    event_moments.setdefault(key, []).append(info_list[i]['moments'])
+            print(f"complete - optimize image individually with {', '.join(conditions)} {row['filename']}")
+    finally:
+        # save the figure cache once for all the scenes
+        render_utils.save_manifest()
+
+    # save the PCA of each event fitted on the pooled moments of its scenes
+    for (event, condition, names), moments_list in event_moments.items():
+        pca_utils.save_pca(event, condition, pca_utils.pool_moments(moments_list), list(names))
+
+    # create a DataFrame to store the results of each condition
+    result_dfs = {}
+    for condition in conditions:
+        result_df = pd.DataFrame(results[condition])
+        result_df.insert(0, 'id', df_mod['filename'].values)
+        print(f'selected n_components among all the images ({condition}):\n', set(result_df[f'n_components_{condition}_i']))
+        print(f'selected n_clusters among all the images ({condition}):\n', set(result_df[f'n_clusters_{condition}_i']))
+
+        result_df.to_csv(f'data/df_kmeans/df_kmeans_{condition}_i.csv', index=False)
+        result_dfs[condition] = result_df
+    return result_dfs
+
+def kmeans_optimization_individual_pca_features(df, init, condition, elbow_mode='full', sample_size=50000, check_accuracy=False, workers=None,
+                                                pca_mode='fit', pca_sample_size=200000, reduce_mode=None, grid_step=0.01, superpixel_size=20,
+                                                superpixel_method='grid', pyramid_factor=4):
+    """
+    Optimize KMeans clustering by introducing NDWI/flowline mask and applying PCA
+
+    Args:
+        df (pd.DataFrame): The dataframe with image data used to do optimization
+        init (str): The specified initialization method for KMeans
+        condition (str): The string used to determine what type of optimization is applied
+        elbow_mode (str): 'full' - KMeans fits on all the pixels; 'minibatch' - MiniBatchKMeans fits on a pixel subsample
+                          stratified by the NDWI/flowline masks, all the pixels are labelled with the final model
+        sample_size (int): The number of pixels in the subsample ('minibatch' mode)
+        check_accuracy (bool): Whether to compare the subsampled elbow search with the full-data one ('minibatch' mode, slow)
+        workers (int): The number of worker processes (defaults to `parallel_utils.n_workers`), 1 runs in the main process
+        pca_mode (str): 'fit' - fit the PCA on each scene; 'predict' - project the scenes with the saved PCA of their event
+        pca_sample_size (int): The number of pixels (stratified subsample) used to fit the PCA of a scene, None for all the pixels
+        reduce_mode (str): The reduction of the pixels before clustering ('full' mode, see `kmeans_clustering_default`)
+        grid_step (float): The size of the grid cells in feature units ('grid' mode)
+        superpixel_size (int): The approximate size of a superpixel in pixels along each axis ('superpixel' mode)
+        superpixel_method (str): 'grid' - square blocks; 'slic' - SLIC superpixels (requires scikit-image)
+        pyramid_factor (int): The number of pixels along each axis of the coarse blocks ('pyramid' mode, 2 - 20 m; 4 - 40 m)
+    
+    Returns:
+        pd.DataFrame: A dataframe storing the results 
+
+    Notes:
+        Use `run_conditions` to optimize several conditions in a single pass over the scenes
+    """
+    return run_conditions(df, init, [condition], elbow_mode, sample_size, check_accuracy, workers, pca_mode, pca_sample_size,
+                          reduce_mode, grid_step, superpixel_size, superpixel_method, pyramid_factor)[condition]
 
 def plot_clustered_result(cluster_image, valid_pixels, original_shape, n_clusters, file, dir_ending):
     """
@@ -484,7 +1427,17 @@ def plot_clustered_result(cluster_image, valid_pixels, original_shape, n_cluster
         n_clusters (int): The number of clusters
         file (str): The filename of the file to be saved
         dir_ending (str): A string used as part of directory name
+
+    Notes:
+        The figure is recorded in the figure cache, which the caller saves once with `render_utils.save_manifest`
     """
+    # skip the figure if the clustering result is unchanged
+    output = f'figs/kmeans_{dir_ending}/{file}.png'
+    key = render_utils.figure_key(params={'original_shape': original_shape, 'n_clusters': n_clusters},
+                                  arrays=[cluster_image, valid_pixels], sources=[__file__])
+    if render_utils.is_cached(output, key):
+        return
+
     name = file.split('/')[-1]
     _, height, width = original_shape
     full_image = np.full(height * width, -1)
@@ -516,8 +1469,9 @@ def plot_clustered_result(cluster_image, valid_pixels, original_shape, n_cluster
         axes[j + 1].axis('off')
     
     plt.tight_layout()
-    plt.savefig(f'figs/kmeans_{dir_ending}/{file}.png')
+    plt.savefig(output)
     plt.close()
+    render_utils.record_figure(output, key)
 
 def plot_evaluation_metrics(explained_variance, cluster_list, inertia_result, file):
     """
@@ -528,7 +1482,14 @@ def plot_evaluation_metrics(explained_variance, cluster_list, inertia_result, fi
         cluster_list (list of int): A list of integer representing the number of clusters used in KMeans clustering
         inertia_result (list of float): A list of inertia values corresponding to the number clusters
         file (str): The basename used to save the plot
+
+    Notes:
+        The figures are recorded in the figure cache, which the caller saves once with `render_utils.save_manifest`
     """
+    key = render_utils.figure_key(params={'explained_variance': explained_variance, 'cluster_list': cluster_list, 'inertia_result': inertia_result},
+                                  sources=[__file__])
+    if render_utils.is_cached(f'figs/kmeans_optimizing/{file}_n_components.png', key) and render_utils.is_cached(f'figs/kmeans_optimizing/{file}_elbow.png', key):
+        return
 
     # plot the cumulative explained variance by the number of PCA components
     plt.figure(figsize=(10, 10))
@@ -548,4 +1509,7 @@ def plot_evaluation_metrics(explained_variance, cluster_list, inertia_result, fi
     plt.ylabel('inertia')
     plt.grid()
     plt.savefig(f'figs/kmeans_optimizing/{file}_elbow.png')
-    plt.close()
\ No newline at end of file
+    plt.close()
+
+    render_utils.record_figure(f'figs/kmeans_optimizing/{file}_n_components.png', key)
+    render_utils.record_figure(f'figs/kmeans_optimizing/{file}_elbow.png', key)
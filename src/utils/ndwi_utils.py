@@ -0,0 +1,121 @@
+"""
+This script includes the functions used to analyze the NDWI threshold separating water from non-water areas.
+
+Each scene is reduced once to a histogram of its cloud-free NDWI values, so the water fraction for any number of
+thresholds is read from the cumulative histogram (O(bins) per scene) instead of re-thresholding the full array.
+The histograms of all the scenes can be summed to analyze the flood events together and to select a threshold (Otsu).
+
+This file can be imported as a module and contains the following functions:
+    * ndwi_histogram - return the histogram of the cloud-free NDWI values of a scene;
+    * water_fraction - return the water pixel counts and fractions for the specified thresholds;
+    * otsu_threshold - return the threshold maximizing the between-class variance of a histogram;
+    * sweep_thresholds - return the water fractions of each scene (and all scenes together) and their Otsu thresholds.
+"""
+
+# import libraries
+import os
+import numpy as np
+import pandas as pd
+from utils import global_utils
+
+# histogram bins covering the NDWI range (resolution of the thresholds: 0.001)
+n_bins = 2000
+bin_edges = np.linspace(-1, 1, n_bins + 1)
+
+def ndwi_histogram(ndwi_path, cloud_path):
+    """
+    Compute the histogram of the cloud-free NDWI values of a scene
+
+    Args:
+        ndwi_path (str): The path to the NDWI file
+        cloud_path (str): The path to the cloud and shadow mask
+
+    Returns:
+        np.ndarray: The pixel counts of each bin of `bin_edges`
+    """
+    ndwi = global_utils.read_band(ndwi_path)
+    cloud_mask = global_utils.read_band(cloud_path)
+    values = ndwi[(cloud_mask == 0) & np.isfinite(ndwi)]
+
+    # bin index of each value (the values of 1 fall in the last bin)
+    index = np.clip(((values + 1) * (n_bins / 2)).astype(np.int64), 0, n_bins - 1)
+    return np.bincount(index, minlength=n_bins)
+
+def water_fraction(counts, thresholds):
+    """
+    Compute the water pixel counts and fractions (NDWI above the threshold) from a histogram
+
+    Args:
+        counts (np.ndarray): The histogram of the NDWI values (see `ndwi_histogram`)
+        thresholds (list of float): The NDWI thresholds
+
+    Returns:
+        pd.DataFrame: The 'threshold', 'water_pixels', 'valid_pixels' and 'water_fraction' of each threshold
+
+    Notes:
+        The thresholds are rounded to the closest bin edge
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    # number of pixels in the bins above each edge
+    above = np.concatenate([np.cumsum(counts[::-1])[::-1], [0]])
+    edge_index = np.clip(np.rint((thresholds + 1) * (n_bins / 2)).astype(np.int64), 0, n_bins)
+    water_pixels = above[edge_index]
+    valid_pixels = int(counts.sum())
+
+    return pd.DataFrame({
+        'threshold': thresholds,
+        'water_pixels': water_pixels,
+        'valid_pixels': valid_pixels,
+        'water_fraction': water_pixels / valid_pixels if valid_pixels else np.nan
+    })
+
+def otsu_threshold(counts):
+    """
+    Select the NDWI threshold with Otsu's method (maximum between-class variance) from a histogram
+
+    Args:
+        counts (np.ndarray): The histogram of the NDWI values (see `ndwi_histogram`)
+
+    Returns:
+        float: The selected threshold (NaN for an empty histogram)
+    """
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    weight = np.cumsum(counts) / total
+    mean = np.cumsum(counts * centers) / total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between_var = (mean[-1] * weight - mean) ** 2 / (weight * (1 - weight))
+    return float(bin_edges[np.nanargmax(between_var) + 1])
+
+def sweep_thresholds(df, thresholds):
+    """
+    Compute the water fractions for the specified thresholds for each scene and all the scenes together
+
+    Args:
+        df (pd.DataFrame): The DataFrame with the 'id', 'date', 'dir_ndwi', 'filename_ndwi', 'dir_cloud' and 'filename_cloud' columns
+        thresholds (list of float): The NDWI thresholds
+
+    Returns:
+        df_sweep (pd.DataFrame): The water pixel counts and fractions of each scene and threshold ('all' for the aggregated scenes)
+        df_otsu (pd.DataFrame): The Otsu threshold of each scene ('all' for the aggregated scenes)
+    """
+    sweep_list = []
+    otsu_list = []
+    total_counts = np.zeros(n_bins, dtype=np.int64)
+
+    for _, row in df.iterrows():
+        counts = ndwi_histogram(os.path.join(row['dir_ndwi'], row['filename_ndwi']), os.path.join(row['dir_cloud'], row['filename_cloud']))
+        total_counts += counts
+        sweep_list.append(water_fraction(counts, thresholds).assign(id=row['id'], date=row['date'], filename=row['filename_ndwi']))
+        otsu_list.append({'id': row['id'], 'date': row['date'], 'filename': row['filename_ndwi'], 'valid_pixels': int(counts.sum()), 'otsu_threshold': otsu_threshold(counts)})
+
+    # aggregate all the scenes
+    sweep_list.append(water_fraction(total_counts, thresholds).assign(id='all', date='all', filename='all'))
+    otsu_list.append({'id': 'all', 'date': 'all', 'filename': 'all', 'valid_pixels': int(total_counts.sum()), 'otsu_threshold': otsu_threshold(total_counts)})
+
+    df_sweep = pd.concat(sweep_list, ignore_index=True)[['id', 'date', 'filename', 'threshold', 'water_pixels', 'valid_pixels', 'water_fraction']]
+    df_otsu = pd.DataFrame(otsu_list)
+    return df_sweep, df_otsu
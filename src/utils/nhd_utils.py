@@ -0,0 +1,228 @@
+"""
+This script includes the functions used to build and query the hydrography layers (NHD flowlines).
+
+The major rivers of each state are filtered once from the NHD flowline shapefile and written to a GeoPackage
+(with its R-tree spatial index), so each image only loads the flowlines intersecting its bounds. They are also
+rasterized once per state and CRS (UTM zone), so the flowline mask of an image is a single window read.
+
+This file can be imported as a module and contains the following functions:
+    * major_rivers_path - return the path to the major river layer of a state;
+    * build_major_rivers - write the major rivers of each state to a GeoPackage (skipped if up to date);
+    * read_layer_crs - return the coordinate reference system of a layer;
+    * read_bbox - return the features of a layer intersecting the specified bounds;
+    * load_major_rivers - return the major rivers of a state intersecting the specified bounds;
+    * flowline_raster_path - return the path to the rasterized major rivers of a state in a CRS;
+    * build_flowline_raster - rasterize the major rivers of a state at 10 m in a CRS (bit-packed, compressed tiles);
+    * read_flowline_mask - return the flowline mask of an image cropped (or resampled) from the rasterized major rivers.
+"""
+
+# import libraries
+import os
+import math
+import rasterio
+import numpy as np
+import geopandas as gpd
+from functools import lru_cache
+from rasterio.vrt import WarpedVRT
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+from shapely.geometry import box
+from utils import global_utils, proj_utils
+
+def major_rivers_path(area):
+    """
+    Return the path to the major river layer of a state
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+
+    Returns:
+        str: The path to the GeoPackage
+    """
+    return f'data/nhd/{area}/major_rivers.gpkg'
+
+def build_major_rivers(area_list, major_river=(558,), min_length=0.6):
+    """
+    Filter the major rivers from the NHD flowline shapefile of each state and write them to a GeoPackage
+
+    Args:
+        area_list (list of str): The states (e.g., ['Maine', 'Vermont'])
+        major_river (tuple of int): The flowline types ('ftype') kept as major rivers (558 - artificial path)
+        min_length (float): The minimum flowline length in km
+
+    Notes:
+        The GeoPackage is rebuilt only if the shapefile is newer
+    """
+    global_utils.print_func_header('build the major river layers')
+    for i in area_list:
+        shp_path = f'data/nhd/{i}/Shape/NHDFlowline.shp'
+        gpkg_path = major_rivers_path(i)
+        if os.path.exists(gpkg_path) and os.path.getmtime(gpkg_path) >= os.path.getmtime(shp_path):
+            print(f'complete - {i} (up to date)')
+            continue
+
+        # flowline['ftype'] or ['fcode'] (might be helpful for extracting major river?)
+        flowline = gpd.read_file(shp_path)
+        major_rivers = flowline[(flowline['ftype'].isin(major_river)) & (flowline['lengthkm'] >= min_length)]
+
+        # the GeoPackage driver creates the spatial index
+        if os.path.exists(gpkg_path):
+            os.remove(gpkg_path)
+        major_rivers.to_file(gpkg_path, layer='major_rivers', driver='GPKG')
+        read_layer_crs.cache_clear()
+        print(f'complete - {i} ({len(major_rivers)} of {len(flowline)} flowlines)')
+
+@lru_cache(maxsize=None)
+def read_layer_crs(path):
+    """
+    Read the coordinate reference system of a layer (cached)
+
+    Args:
+        path (str): The path to the layer
+
+    Returns:
+        pyproj.CRS: The coordinate reference system of the layer
+    """
+    return gpd.read_file(path, rows=1).crs
+
+def read_bbox(path, bounds, crs):
+    """
+    Read the features of a layer intersecting the specified bounds (with the spatial index if available)
+
+    Args:
+        path (str): The path to the layer (e.g., GeoPackage or shapefile)
+        bounds (tuple of float): The bounds (left, bottom, right, top) in the specified CRS
+        crs (rasterio.crs.CRS or str): The CRS of the bounds, also used for the returned features
+
+    Returns:
+        gpd.GeoDataFrame: The features intersecting the bounds in the specified CRS
+    """
+    layer_crs = read_layer_crs(path)
+
+    # reproject the bounds (densified) to the CRS of the layer
+    bbox = tuple(bounds)
+    if layer_crs is not None and layer_crs != crs:
+        bbox = transform_bounds(crs, layer_crs, *bounds)
+
+    gdf = gpd.read_file(path, bbox=bbox)
+    if layer_crs is not None and layer_crs != crs:
+        gdf = gdf.to_crs(crs)
+    return gdf
+
+def load_major_rivers(area, bounds, crs):
+    """
+    Load the major rivers of a state intersecting the specified bounds (e.g., the bounds of an image)
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+        bounds (tuple of float): The bounds (left, bottom, right, top) in the specified CRS
+        crs (rasterio.crs.CRS or str): The CRS of the bounds, also used for the returned flowlines
+
+    Returns:
+        gpd.GeoDataFrame: The major rivers intersecting the bounds in the specified CRS
+    """
+    return read_bbox(major_rivers_path(area), bounds, crs)
+
+def flowline_raster_path(area, crs):
+    """
+    Return the path to the rasterized major rivers of a state in a CRS
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+        crs (rasterio.crs.CRS or str): The coordinate reference system (e.g., 'EPSG:32619')
+
+    Returns:
+        str: The path to the GeoTIFF
+    """
+    crs_name = proj_utils.crs_key(crs).replace(':', '')
+    return f'data/nhd/{area}/major_rivers_{crs_name}.tif'
+
+def build_flowline_raster(area, crs, resolution=10, tile_size=4096):
+    """
+    Rasterize the major rivers of a state in a CRS (1 - flowline; 0 - other areas)
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+        crs (rasterio.crs.CRS or str): The coordinate reference system (e.g., the UTM zone of the images)
+        resolution (float): The pixel size in meters (10 m, same as the Sentinel-2 images)
+        tile_size (int): The number of pixels along each axis rasterized at once (bounds the memory use)
+
+    Returns:
+        str: The path to the GeoTIFF (bit-packed, DEFLATE-compressed 512 x 512 tiles)
+
+    Notes:
+        The grid is aligned on multiples of the resolution, so the images on the same grid are read without resampling.
+        The raster is rebuilt only if the major river layer is newer
+    """
+    gpkg_path = major_rivers_path(area)
+    raster_path = flowline_raster_path(area, crs)
+    if os.path.exists(raster_path) and os.path.getmtime(raster_path) >= os.path.getmtime(gpkg_path):
+        return raster_path
+
+    major_rivers = gpd.read_file(gpkg_path).to_crs(crs)
+    left, bottom, right, top = major_rivers.total_bounds if not major_rivers.empty else (0, 0, resolution, resolution)
+    left = math.floor(left / resolution) * resolution
+    top = math.ceil(top / resolution) * resolution
+    width = math.ceil((right - left) / resolution)
+    height = math.ceil((top - bottom) / resolution)
+    transform = from_origin(left, top, resolution, resolution)
+
+    profile = {
+        'driver': 'GTiff',
+        'dtype': 'uint8',
+        'count': 1,
+        'width': width,
+        'height': height,
+        'crs': crs,
+        'transform': transform,
+        'nbits': 1,
+        'tiled': True,
+        'blockxsize': 512,
+        'blockysize': 512,
+        'compress': 'deflate'
+    }
+    with rasterio.open(raster_path, 'w', **profile) as dst:
+        for row_off in range(0, height, tile_size):
+            for col_off in range(0, width, tile_size):
+                window = Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+                window_transform = rasterio.windows.transform(window, transform)
+
+                # rasterize the flowlines intersecting the tile (default rasterio rule, all_touched off)
+                tile_bounds = rasterio.windows.bounds(window, transform)
+                geometries = major_rivers.geometry.values[major_rivers.sindex.query(box(*tile_bounds))]
+                if len(geometries) == 0:
+                    continue
+                tile = rasterize(geometries, out_shape=(int(window.height), int(window.width)), transform=window_transform, dtype='uint8')
+                dst.write(tile, 1, window=window)
+    print(f'complete - rasterize the major rivers of {area} ({proj_utils.crs_key(crs)}, {width} x {height})')
+    return raster_path
+
+def read_flowline_mask(area, crs, transform, shape):
+    """
+    Read the flowline mask of an image from the rasterized major rivers of its state
+
+    Args:
+        area (str): The state (e.g., 'Maine')
+        crs (rasterio.crs.CRS): The coordinate reference system of the image
+        transform (affine.Affine): The affine transformation of the image
+        shape (tuple): The shape (height, width) of the image
+
+    Returns:
+        np.ndarray: A array representing the flowline mask (flowline - 1; other areas - 0)
+
+    Notes:
+        The raster is built on the first request for a state and CRS. The mask is read through a WarpedVRT aligned to the
+        image grid, which is a window crop when the grids match and a resample otherwise
+    """
+    raster_path = build_flowline_raster(area, crs)
+    height, width = shape
+    with rasterio.open(raster_path) as src:
+
+        # coarser images keep the pixels containing any flowline (nearest would drop the thin lines)
+        resampling = Resampling.max if abs(transform.a) > src.res[0] else Resampling.nearest
+        with WarpedVRT(src, crs=crs, transform=transform, width=width, height=height, resampling=resampling) as vrt:
+            mask = vrt.read(1)
+    return mask.astype(np.int32)
@@ -0,0 +1,157 @@
+"""
+This script includes the functions used to run the per-scene KMeans clustering in a process pool.
+
+The feature matrices of a scene are copied once into shared memory blocks (`multiprocessing.shared_memory`), so the
+workers attach to them by name instead of receiving pickled arrays, and write their labels into shared output blocks.
+Each worker limits its BLAS/OpenMP threads (threadpoolctl), so the workers times the threads match the number of cores.
+The results are returned in the order of the tasks, whatever the order in which the workers complete them.
+
+A task is a dictionary with the following keys:
+    * arrays (dict) - the input arrays shared with the worker (read-only);
+    * outputs (dict, optional) - the arrays filled by the worker (copied back once the task is complete);
+    * kwargs (dict, optional) - the other (small) arguments of the function;
+    * any other key (e.g., the row and the small masks used to summarize the result) is kept in the parent process and
+      returned with the result, so it should not hold the large arrays of the scene.
+
+This file can be imported as a module and contains the following functions:
+    * threads_per_worker - return the number of BLAS/OpenMP threads of each worker;
+    * share_arrays - return the arrays copied into shared memory blocks and their specifications;
+    * attach_arrays - return the arrays attached from their shared memory specifications;
+    * init_worker - limit the BLAS/OpenMP threads of a worker process;
+    * map_scenes - run a function on each task in a process pool and return the results in the order of the tasks.
+"""
+
+# import libraries
+import os
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+
+# number of worker processes (can be set with the KMEANS_WORKERS environment variable)
+n_workers = int(os.environ.get('KMEANS_WORKERS', os.cpu_count() or 1))
+
+def threads_per_worker(workers):
+    """
+    Return the number of BLAS/OpenMP threads of each worker (can be set with the KMEANS_THREADS environment variable)
+
+    Args:
+        workers (int): The number of worker processes
+
+    Returns:
+        int: The number of threads, the cores divided among the workers by default
+    """
+    if 'KMEANS_THREADS' in os.environ:
+        return int(os.environ['KMEANS_THREADS'])
+    return max(1, (os.cpu_count() or 1) // workers)
+
+def share_arrays(arrays):
+    """
+    Copy the arrays into shared memory blocks
+
+    Args:
+        arrays (dict): The arrays to be shared
+
+    Returns:
+        blocks (dict): The shared memory block of each array (to be closed and unlinked by the caller)
+        specs (dict): The name, shape and dtype of the block of each array (picklable)
+    """
+    blocks = {}
+    specs = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        blocks[name] = block
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def attach_arrays(specs):
+    """
+    Attach the arrays shared by `share_arrays`
+
+    Args:
+        specs (dict): The name, shape and dtype of the block of each array
+
+    Returns:
+        blocks (list of SharedMemory): The attached blocks (to be closed by the caller once the arrays are released)
+        arrays (dict): The arrays backed by the shared memory blocks
+    """
+    blocks = []
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+def init_worker(threads):
+    """
+    Limit the BLAS/OpenMP threads of a worker process
+
+    Args:
+        threads (int): The number of threads
+    """
+    threadpool_limits(limits=threads)
+
+def _run_task(func, specs, kwargs):
+    # attach the shared arrays, run the function and release the arrays before closing the blocks
+    blocks, arrays = attach_arrays(specs)
+    try:
+        return func(**arrays, **kwargs)
+    finally:
+        del arrays
+        for block in blocks:
+            block.close()
+
+def map_scenes(func, tasks, workers=None):
+    """
+    Run a function on each task in a process pool, with the arrays passed through shared memory
+
+    Args:
+        func (callable): The function (defined at the top level of a module) called with the arrays, outputs and kwargs of a task
+        tasks (iterable of dict): The tasks (a generator keeps only a few scenes in memory)
+        workers (int): The number of worker processes (defaults to `n_workers`), 1 runs the tasks in the main process
+
+    Yields:
+        tuple: The task (with its outputs filled) and the result of the function, in the order of the tasks
+    """
+    workers = workers or n_workers
+    threads = threads_per_worker(workers)
+    if workers <= 1:
+        with threadpool_limits(limits=threads):
+            for task in tasks:
+                yield task, func(**task['arrays'], **task.get('outputs', {}), **task.get('kwargs', {}))
+        return
+
+    def complete(future, task, blocks, specs):
+        try:
+            result = future.result()
+
+            # copy the outputs back from their blocks
+            for name, output in task.get('outputs', {}).items():
+                _, shape, dtype = specs[name]
+                output[...] = np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+        return task, result
+
+    # submit the tasks with one scene queued per worker at most, so only about workers + 1 scenes are held in memory
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads,)) as executor:
+        try:
+            for task in tasks:
+                blocks, specs = share_arrays({**task['arrays'], **task.get('outputs', {})})
+                pending.append((executor.submit(_run_task, func, specs, task.get('kwargs', {})), task, blocks, specs))
+                if len(pending) > workers:
+                    yield complete(*pending.pop(0))
+            while pending:
+                yield complete(*pending.pop(0))
+        finally:
+            # release the blocks of the unfinished tasks (e.g., on error)
+            for future, _, blocks, _ in pending:
+                future.cancel()
+                for block in blocks.values():
+                    block.close()
+                    block.unlink()
@@ -0,0 +1,191 @@
+"""
+This script includes the functions used to fit and apply the PCA of the KMeans features.
+
+The PCA is fitted once from the moments (pixel count, sum and sum of outer products) of the features, accumulated in
+float64 over float32 chunks of the pixels (or of a pixel subsample for large scenes), with an eigendecomposition of the
+covariance matrix. The number of components is selected from the explained variance of the same fit, and the pixels are
+projected with the fitted components, so no second fit is needed.
+
+The moments of the scenes of an event can be pooled and the resulting components saved, so later runs on new scenes of
+the same event can project them without fitting (predict mode).
+
+This file can be imported as a module and contains the following functions:
+    * feature_moments - return the pixel count, sum and sum of outer products of the features;
+    * pool_moments - return the moments of several sets of pixels pooled together;
+    * fit_pca - return the components and explained variance from the moments of the features;
+    * select_components - return the number of components explaining a fraction of the variance;
+    * project - return the features projected on the first components;
+    * pca_path - return the path to the saved PCA of an event and condition;
+    * save_pca - save the PCA (and its moments) of an event and condition;
+    * load_pca - return the saved PCA of an event and condition (None if missing).
+"""
+
+# import libraries
+import os
+import numpy as np
+
+# directory of the saved PCA
+pca_dir = 'data/pca'
+
+def feature_moments(data, sample_index=None, chunk_size=1 << 18):
+    """
+    Accumulate the moments of the features (in float64, over float32 chunks)
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features)
+        sample_index (np.ndarray): The indices of the pixels used (e.g., a subsample), None for all the pixels
+        chunk_size (int): The number of pixels converted at once
+
+    Returns:
+        dict: The pixel count ('n'), the sum ('sum', (features,)) and the sum of outer products ('outer', (features, features))
+    """
+    n_features = data.shape[1]
+    n_pixels = len(data) if sample_index is None else len(sample_index)
+    total = np.zeros(n_features)
+    outer = np.zeros((n_features, n_features))
+    for start in range(0, n_pixels, chunk_size):
+        stop = min(start + chunk_size, n_pixels)
+        chunk = data[start:stop] if sample_index is None else data[sample_index[start:stop]]
+        chunk = np.asarray(chunk, dtype=np.float32)
+        total += chunk.sum(axis=0, dtype=np.float64)
+        outer += np.dot(chunk.T.astype(np.float64), chunk)
+    return {'n': n_pixels, 'sum': total, 'outer': outer}
+
+def pool_moments(moments_list):
+    """
+    Pool the moments of several sets of pixels (e.g., the scenes of an event)
+
+    Args:
+        moments_list (list of dict): The moments of each set (see `feature_moments`)
+
+    Returns:
+        dict: The pooled moments
+    """
+    return {
+        'n': sum(moments['n'] for moments in moments_list),
+        'sum': np.sum([moments['sum'] for moments in moments_list], axis=0),
+        'outer': np.sum([moments['outer'] for moments in moments_list], axis=0)
+    }
+
+def fit_pca(moments):
+    """
+    Fit the PCA with an eigendecomposition of the covariance matrix of the features
+
+    Args:
+        moments (dict): The moments of the features (see `feature_moments`)
+
+    Returns:
+        dict: The 'mean' (features,), the 'components' (features, features) sorted by decreasing variance, the
+              'explained_variance' and the 'explained_variance_ratio' of each component
+
+    Notes:
+        The sign of each component is fixed (largest absolute loading positive), so the projections are deterministic
+    """
+    n = moments['n']
+    mean = moments['sum'] / n
+    covariance = (moments['outer'] - n * np.outer(mean, mean)) / max(n - 1, 1)
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+
+    # sort the components by decreasing variance
+    order = np.argsort(eigenvalues)[::-1]
+    explained_variance = np.clip(eigenvalues[order], 0, None)
+    components = eigenvectors[:, order].T
+    signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+    components *= np.where(signs == 0, 1, signs)[:, None]
+
+    total_variance = explained_variance.sum()
+    return {
+        'mean': mean,
+        'components': components,
+        'explained_variance': explained_variance,
+        'explained_variance_ratio': explained_variance / total_variance if total_variance > 0 else np.zeros_like(explained_variance)
+    }
+
+def select_components(explained_variance_ratio, threshold=0.90):
+    """
+    Select the number of components explaining a fraction of the variance
+
+    Args:
+        explained_variance_ratio (np.ndarray): The explained variance ratio of each component (decreasing)
+        threshold (float): The fraction of the variance to be explained
+
+    Returns:
+        int: The number of components
+    """
+    explained_variance = np.cumsum(explained_variance_ratio)
+    if not (explained_variance >= threshold).any():
+        return len(explained_variance)
+    return int(np.argmax(explained_variance >= threshold) + 1)
+
+def project(data, pca, n_components, chunk_size=1 << 18):
+    """
+    Project the features on the first components of a fitted PCA
+
+    Args:
+        data (np.ndarray): The features (num_pixels, features)
+        pca (dict): The fitted PCA (see `fit_pca`)
+        n_components (int): The number of components
+        chunk_size (int): The number of pixels projected at once
+
+    Returns:
+        np.ndarray: The projected features (num_pixels, n_components) in float32
+    """
+    mean = pca['mean'].astype(np.float32)
+    components = pca['components'][:n_components].T.astype(np.float32)
+    projected = np.empty((len(data), n_components), dtype=np.float32)
+    for start in range(0, len(data), chunk_size):
+        stop = min(start + chunk_size, len(data))
+        np.dot(np.asarray(data[start:stop], dtype=np.float32) - mean, components, out=projected[start:stop])
+    return projected
+
+def pca_path(event, condition):
+    """
+    Return the path to the saved PCA of an event and condition
+
+    Args:
+        event (str): The event id (e.g., '45358')
+        condition (str): The condition determining the features (e.g., 'ndwi_pca')
+
+    Returns:
+        str: The path to the NumPy archive
+    """
+    return os.path.join(pca_dir, f'{event}_{condition}.npz')
+
+def save_pca(event, condition, moments, feature_columns):
+    """
+    Fit the PCA from the (pooled) moments of an event and save it with its moments
+
+    Args:
+        event (str): The event id (e.g., '45358')
+        condition (str): The condition determining the features (e.g., 'ndwi_pca')
+        moments (dict): The moments of the features of the event (see `pool_moments`)
+        feature_columns (list of str): The names of the features (checked when the PCA is loaded)
+
+    Returns:
+        str: The path to the saved PCA
+    """
+    pca = fit_pca(moments)
+    path = pca_path(event, condition)
+    os.makedirs(pca_dir, exist_ok=True)
+    np.savez(path, n=moments['n'], sum=moments['sum'], outer=moments['outer'], feature_columns=np.array(feature_columns), **pca)
+    return path
+
+def load_pca(event, condition, feature_columns):
+    """
+    Load the saved PCA of an event and condition
+
+    Args:
+        event (str): The event id (e.g., '45358')
+        condition (str): The condition determining the features (e.g., 'ndwi_pca')
+        feature_columns (list of str): The names of the features
+
+    Returns:
+        dict: The fitted PCA (see `fit_pca`), None if missing or fitted on other features
+    """
+    path = pca_path(event, condition)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        if saved['feature_columns'].tolist() != list(feature_columns):
+            return None
+        return {key: saved[key] for key in ['mean', 'components', 'explained_variance', 'explained_variance_ratio']}
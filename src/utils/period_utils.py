@@ -0,0 +1,95 @@
+"""
+This script includes the vectorized functions used to label the flood event periods of the observations and images.
+
+The dates are parsed once into datetime64 columns and the labels are assigned with array comparisons, so relabeling
+after changing the day adjustment only takes a few milliseconds, even for hundreds of thousands of images.
+
+This file can be imported as a module and contains the following functions:
+    * map_event_periods - return a DataFrame with the 'formed' and 'dissipated' dates of the flood events joined;
+    * parse_event_days - return the start and end dates parsed from the 'event_day' column;
+    * add_collection_window - return a DataFrame with the 'start_day' and 'end_day' used to collect the images;
+    * label_periods - return the labels indicating whether the images were taken before, during, or after the flood events.
+"""
+
+# import libraries
+import numpy as np
+import pandas as pd
+
+def map_event_periods(df, date_range):
+    """
+    Add the formed and dissipated dates of the flood events with a join
+
+    Args:
+        df (pd.DataFrame): The DataFrame with an 'event' column
+        date_range (dict): A dictionary representing the date ranges for each event (e.g., {'2021 Henri': ['2021-08-15', '2021-08-23']})
+
+    Returns:
+        pd.DataFrame: The DataFrame with the 'formed' and 'dissipated' columns (datetime64) added
+    """
+    periods = pd.DataFrame(
+        [(event, formed, dissipated) for event, (formed, dissipated) in date_range.items()],
+        columns=['event', 'formed', 'dissipated'])
+    periods['formed'] = pd.to_datetime(periods['formed'])
+    periods['dissipated'] = pd.to_datetime(periods['dissipated'])
+    return df.merge(periods, on='event', how='left')
+
+def parse_event_days(event_day):
+    """
+    Parse the start and end dates of the flood events
+
+    Args:
+        event_day (pd.Series): The event days, either a single date ('2023-07-10', gauge) or a range ('2023-07-10 to 2023-07-11', stn)
+
+    Returns:
+        event_start (pd.Series): The start dates (datetime64)
+        event_end (pd.Series): The end dates (datetime64), equal to the start dates for single dates
+    """
+    parts = event_day.astype(str).str.partition(' to ')
+    event_start = pd.to_datetime(parts[0], format='%Y-%m-%d', errors='coerce')
+    event_end = pd.to_datetime(parts[2].where(parts[2] != '', parts[0]), format='%Y-%m-%d', errors='coerce')
+    return event_start, event_end
+
+def add_collection_window(df, before_days, after_days):
+    """
+    Add the time window used to collect the images around the flood events
+
+    Args:
+        df (pd.DataFrame): The DataFrame with an 'event_day' column
+        before_days (int): The number of days before the start of the flood event
+        after_days (int): The number of days after the end of the flood event
+
+    Returns:
+        pd.DataFrame: The DataFrame with the 'start_day' and 'end_day' columns (datetime64) added
+    """
+    df_mod = df.copy()
+    event_start, event_end = parse_event_days(df_mod['event_day'])
+    df_mod['start_day'] = event_start - pd.Timedelta(days=before_days)
+    df_mod['end_day'] = event_end + pd.Timedelta(days=after_days)
+    return df_mod
+
+def label_periods(df, day_adjust_dict):
+    """
+    Assign labels to the images indicating whether they were taken before, during, or after a flood event
+
+    Args:
+        df (pd.DataFrame): The DataFrame with the 'date' (e.g., '20230711'), 'event_day' and 'source' columns
+        day_adjust_dict (dict): A dictionary mapping each source to the days (start_adjust, end_adjust) used to widen the flood period
+                                (e.g., {'gauge': (1, 1), 'stn': (0, 0)})
+
+    Returns:
+        pd.Series: The labels ('before flood', 'during flood' or 'after flood'), None for sources missing in day_adjust_dict
+    """
+    date = pd.to_datetime(df['date'].astype(str), format='%Y%m%d')
+    event_start, event_end = parse_event_days(df['event_day'])
+
+    # widen the flood period with the adjustment of each source
+    start_adjust = pd.to_timedelta(df['source'].map({source: adjust[0] for source, adjust in day_adjust_dict.items()}), unit='D')
+    end_adjust = pd.to_timedelta(df['source'].map({source: adjust[1] for source, adjust in day_adjust_dict.items()}), unit='D')
+    period_start = event_start - start_adjust
+    period_end = event_end + end_adjust
+
+    labels = np.select(
+        [date < period_start, date <= period_end, date > period_end],
+        ['before flood', 'during flood', 'after flood'],
+        default=None)
+    return pd.Series(labels, index=df.index, dtype=object)
@@ -0,0 +1,120 @@
+"""
+This script includes the functions used to cache the coordinate transformations.
+
+The images of Maine and Vermont straddle the UTM zones 18N and 19N, so consecutive rows often switch CRS. The transformers
+are built once per CRS pair, the layers (e.g., flowlines) are reprojected once per target CRS, and the observation
+locations are transformed in one vectorized call per CRS.
+
+This file can be imported as a module and contains the following functions:
+    * crs_key - return a hashable string representing a CRS;
+    * get_transformer - return a cached transformer between two CRS;
+    * transform_points - return the coordinates of the points transformed from longitude/latitude;
+    * project_points - return the coordinates of the observation locations in the CRS of their images;
+    * to_crs - return a layer reprojected to a CRS (cached per target CRS).
+"""
+
+# import libraries
+import numpy as np
+from functools import lru_cache
+from collections import OrderedDict
+from pyproj import Transformer
+
+# number of reprojected layers kept in memory
+max_layers = 8
+_layers = OrderedDict()
+
+def crs_key(crs):
+    """
+    Convert a CRS into a hashable string
+
+    Args:
+        crs (rasterio.crs.CRS, pyproj.CRS or str): The coordinate reference system
+
+    Returns:
+        str: The authority code (e.g., 'EPSG:32619') or the WKT of the CRS
+    """
+    if isinstance(crs, str):
+        return crs
+    return crs.to_string()
+
+@lru_cache(maxsize=None)
+def _transformer(src_key, dst_key):
+    # one transformer per CRS pair (the keys are hashable strings from `crs_key`)
+    return Transformer.from_crs(src_key, dst_key, always_xy=True)
+
+def get_transformer(src_crs, dst_crs):
+    """
+    Return the transformer between two CRS, built once per CRS pair
+
+    Args:
+        src_crs (rasterio.crs.CRS, pyproj.CRS or str): The source coordinate reference system
+        dst_crs (rasterio.crs.CRS, pyproj.CRS or str): The target coordinate reference system
+
+    Returns:
+        pyproj.Transformer: The transformer (x/y or longitude/latitude axis order)
+    """
+    return _transformer(crs_key(src_crs), crs_key(dst_crs))
+
+def transform_points(lons, lats, crs):
+    """
+    Transform the longitude/latitude of points to a CRS in one vectorized call
+
+    Args:
+        lons (array-like): The longitudes (EPSG:4326)
+        lats (array-like): The latitudes (EPSG:4326)
+        crs (rasterio.crs.CRS, pyproj.CRS or str): The target coordinate reference system
+
+    Returns:
+        xs (np.ndarray): The x coordinates in the target CRS
+        ys (np.ndarray): The y coordinates in the target CRS
+    """
+    return get_transformer('EPSG:4326', crs).transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+
+def project_points(df, crs_list=None):
+    """
+    Transform the observation locations of each row to the CRS of its image, with one call per CRS
+
+    Args:
+        df (pd.DataFrame): The DataFrame with the 'longitude' and 'latitude' columns (and the 'crs' column from the image catalog)
+        crs_list (list): The CRS of each row (defaults to the 'crs' column)
+
+    Returns:
+        xs (np.ndarray): The x coordinates in the CRS of each image
+        ys (np.ndarray): The y coordinates in the CRS of each image
+    """
+    crs_keys = np.array([crs_key(crs) for crs in (df['crs'] if crs_list is None else crs_list)], dtype=object)
+    lons = df['longitude'].to_numpy(dtype=float)
+    lats = df['latitude'].to_numpy(dtype=float)
+    xs = np.full(len(df), np.nan)
+    ys = np.full(len(df), np.nan)
+    for key in set(crs_keys):
+        rows = crs_keys == key
+        xs[rows], ys[rows] = transform_points(lons[rows], lats[rows], key)
+    return xs, ys
+
+def to_crs(gdf, crs):
+    """
+    Reproject a layer to a CRS, keeping the last reprojected layers in memory
+
+    Args:
+        gdf (gpd.GeoDataFrame): The layer (e.g., flowlines)
+        crs (rasterio.crs.CRS, pyproj.CRS or str): The target coordinate reference system
+
+    Returns:
+        gpd.GeoDataFrame: The layer in the target CRS
+
+    Notes:
+        The cache is keyed on the layer object, so the reprojections are reused while switching between UTM zones
+    """
+    if gdf.crs == crs:
+        return gdf
+    key = (id(gdf), crs_key(crs))
+    if key in _layers and _layers[key][0] is gdf:
+        _layers.move_to_end(key)
+        return _layers[key][1]
+
+    projected = gdf.to_crs(crs)
+    _layers[key] = (gdf, projected)
+    if len(_layers) > max_layers:
+        _layers.popitem(last=False)
+    return projected
@@ -0,0 +1,310 @@
+"""
+This script includes the functions used to render the inspection figures in parallel.
+
+The plotting functions (e.g., `global_utils.plot_helper`, `eda_s2_utils.add_nhd_layer_s2`) turn each figure into a job
+(a dictionary of panels built from cached arrays decimated to the figure resolution). The jobs are rendered in a process pool with the Agg backend,
+so the workers never reopen the GeoTIFFs.
+
+A job is a dictionary with the following keys:
+    * output (str) - the file where the figure is saved;
+    * figsize (tuple) - the figure size;
+    * suptitle (str, optional) - the title of the figure;
+    * panels (list of dict) - one panel per subplot with the keys 'image' (2D array or (height, width, 3) array),
+      and optionally 'extent', 'cmap', 'bad_color', 'threshold', 'lines', 'points', 'title', 'axis_off' and 'limits';
+    * cache_key (str, optional) - the key recorded in the figure cache once the figure is saved.
+
+The figure cache (`figs/.cache/manifest.json`) maps each figure to a key hashed from its input files, parameters and
+plotting code, so the plotting functions can skip the figures whose key is unchanged before loading any array.
+The cache can be bypassed with the RENDER_CACHE=0 environment variable.
+
+This file can be imported as a module and contains the following functions:
+    * file_hash - return the content hash of a file (memoized on its size and modification time);
+    * figure_key - return the cache key of a figure from its input files, parameters and arrays;
+    * is_cached - check whether a figure is up to date;
+    * record_figure - record the cache key of a saved figure;
+    * save_manifest - write the figure cache to disk;
+    * target_size - return the number of pixels needed along each axis of a panel for a figure size;
+    * load_image - return a cached array of an image decimated to the figure resolution with its extent and CRS;
+    * clip_lines - return the coordinates of the line geometries intersecting an extent;
+    * render_figure - render and save a single job;
+    * render_jobs - render the jobs in a process pool.
+"""
+
+# import libraries
+import os
+import json
+import shapely
+import hashlib
+import rasterio
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+from functools import lru_cache
+from rasterio.enums import Resampling
+from matplotlib.collections import LineCollection
+from concurrent.futures import ProcessPoolExecutor
+from utils import global_utils
+
+# number of worker processes (can be set with the RENDER_WORKERS environment variable)
+n_workers = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+
+# figure cache (can be disabled with the RENDER_CACHE environment variable)
+use_cache = os.environ.get('RENDER_CACHE', '1') != '0'
+manifest_path = 'figs/.cache/manifest.json'
+_manifest = None
+
+def _get_manifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = {'files': {}, 'figures': {}}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                _manifest.update(json.load(f))
+    return _manifest
+
+def file_hash(file_path):
+    """
+    Compute the content hash of a file
+
+    Args:
+        file_path (str): The path to the file
+
+    Returns:
+        str: The SHA-1 hex digest of the file content
+
+    Notes:
+        The hash is stored in the manifest with the size and modification time of the file,
+        so an unchanged file is only read once
+    """
+    stat = os.stat(file_path)
+    files = _get_manifest()['files']
+    entry = files.get(file_path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['hash']
+
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    files[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+    return files[file_path]['hash']
+
+def figure_key(inputs=(), params=None, arrays=(), sources=()):
+    """
+    Compute the cache key of a figure
+
+    Args:
+        inputs (list of str): The input files (e.g., images and masks) of the figure
+        params (dict): The parameters changing the figure (e.g., thresholds, titles), serialized to JSON
+        arrays (list of np.ndarray or bytes): The in-memory inputs of the figure (e.g., cluster labels)
+        sources (list of str): The modules building the figure (their source is part of the key, as well as this module)
+
+    Returns:
+        str: The SHA-1 hex digest of the figure inputs
+    """
+    digest = hashlib.sha1()
+    for source in (__file__, *sources):
+        digest.update(file_hash(source).encode())
+    for file_path in inputs:
+        digest.update(file_hash(file_path).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    for array in arrays:
+        if isinstance(array, np.ndarray):
+            digest.update(f'{array.dtype}{array.shape}'.encode())
+            array = np.ascontiguousarray(array).tobytes()
+        digest.update(array)
+    return digest.hexdigest()
+
+def is_cached(output, key):
+    """
+    Check whether a figure is up to date
+
+    Args:
+        output (str): The file where the figure is saved
+        key (str): The cache key of the figure (see `figure_key`)
+
+    Returns:
+        bool: True if the figure exists and was saved with the same key
+    """
+    return use_cache and _get_manifest()['figures'].get(output) == key and os.path.exists(output)
+
+def record_figure(output, key):
+    """
+    Record the cache key of a saved figure (written to disk by `save_manifest`)
+
+    Args:
+        output (str): The file where the figure is saved
+        key (str): The cache key of the figure
+    """
+    _get_manifest()['figures'][output] = key
+
+def save_manifest():
+    """
+    Write the figure cache to disk
+    """
+    if _manifest is None:
+        return
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(_manifest, f)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+def target_size(figsize, n_panels=1, dpi=None):
+    """
+    Compute the number of pixels along the longest axis of a panel for a figure size
+
+    Args:
+        figsize (tuple): The figure size (width, height) in inches
+        n_panels (int): The number of panels side by side
+        dpi (float): The resolution of the saved figure (defaults to the matplotlib savefig/figure dpi)
+
+    Returns:
+        int: The maximum number of pixels needed along each axis of a panel
+    """
+    if dpi is None:
+        dpi = plt.rcParams['savefig.dpi']
+        if dpi == 'figure':
+            dpi = plt.rcParams['figure.dpi']
+    return int(np.ceil(max(figsize[0] / n_panels, figsize[1]) * dpi))
+
+@lru_cache(maxsize=64)
+def load_image(file_path, max_size=1000):
+    """
+    Read an image decimated to the figure resolution
+
+    Args:
+        file_path (str): The path to the GeoTIFF or NumPy image
+        max_size (int): The maximum number of pixels along each axis of the returned array (see `target_size`)
+
+    Returns:
+        image (np.ndarray): The decimated image ((height, width, 3) for RGB images, (height, width) for single bands)
+        extent (tuple): The extent of the image (left, right, bottom, top) in map coordinates
+        crs (rasterio.crs.CRS): The coordinate reference system
+
+    Notes:
+        GeoTIFFs are read with `out_shape`, so GDAL picks the closest overview (built at download time by
+        `global_utils.build_overviews`) and only reads the pixels needed; NumPy images are sliced from the memory map.
+        The results are cached, so all the figures of a scene share a single read
+    """
+    if file_path.endswith('.npy'):
+        data, bounds, crs, _, _ = global_utils.read_npy(file_path)
+        step = max(1, int(np.ceil(max(data.shape[1:]) / max_size)))
+        data = np.ascontiguousarray(data[:, ::step, ::step])
+    else:
+        with rasterio.open(file_path) as src:
+            step = max(1, int(np.ceil(max(src.height, src.width) / max_size)))
+            out_shape = (src.count, int(np.ceil(src.height / step)), int(np.ceil(src.width / step)))
+            data = src.read(out_shape=out_shape, resampling=Resampling.nearest)
+            bounds, crs = src.bounds, src.crs
+
+    image = data.transpose(1, 2, 0) if data.shape[0] == 3 else data[0]
+    return image, (bounds.left, bounds.right, bounds.bottom, bounds.top), crs
+
+def clip_lines(gdf, extent):
+    """
+    Extract the coordinates of the line geometries intersecting an extent (lighter to send to the workers than a GeoDataFrame)
+
+    Args:
+        gdf (gpd.GeoDataFrame): The line geometries (e.g., flowlines) in the CRS of the image
+        extent (tuple): The extent (left, right, bottom, top)
+
+    Returns:
+        list of np.ndarray: The (n, 2) coordinate arrays of the lines
+    """
+    left, right, bottom, top = extent
+    clipped = gdf.cx[left:right, bottom:top]
+    return [shapely.get_coordinates(part) for part in shapely.get_parts(clipped.geometry.values)]
+
+def render_figure(job):
+    """
+    Render a figure and save it
+
+    Args:
+        job (dict): The figure to be rendered (see the module docstring)
+
+    Returns:
+        str: The file where the figure is saved
+    """
+    panels = job['panels']
+    fig, axes = plt.subplots(1, len(panels), figsize=job['figsize'], squeeze=False)
+    if job.get('suptitle'):
+        fig.suptitle(job['suptitle'])
+
+    for ax, panel in zip(axes[0], panels):
+        image = panel['image']
+        if 'threshold' in panel:
+            image = image > panel['threshold']
+        cmap = None
+        if panel.get('cmap'):
+            cmap = plt.get_cmap(panel['cmap']).copy()
+            if panel.get('bad_color'):
+                cmap.set_bad(color=panel['bad_color'])
+        ax.imshow(image, cmap=cmap, extent=panel.get('extent'), interpolation='nearest')
+
+        if panel.get('lines'):
+            ax.add_collection(LineCollection(panel['lines'], colors='cyan', linewidths=panel.get('linewidth', 0.5)))
+        for x, y in panel.get('points', []):
+            ax.plot(x, y, 'ro', markersize=6, zorder=3)
+        if panel.get('title'):
+            ax.set_title(panel['title'])
+        if panel.get('limits'):
+            left, right, bottom, top = panel['limits']
+            ax.set_xlim(left, right)
+            ax.set_ylim(bottom, top)
+        if panel.get('axis_off'):
+            ax.axis('off')
+
+    plt.tight_layout()
+    plt.savefig(job['output'])
+    plt.close(fig)
+    return job['output']
+
+def init_worker():
+    """
+    Use the non-interactive Agg backend in the worker processes
+    """
+    matplotlib.use('Agg')
+
+def render_jobs(jobs, workers=None):
+    """
+    Render the figures in a process pool
+
+    Args:
+        jobs (iterable of dict): The figures to be rendered (a generator keeps only a few scenes in memory)
+        workers (int): The number of worker processes (defaults to `n_workers`), 1 renders in the main process
+
+    Returns:
+        list of str: The files where the figures are saved, in the order of the jobs
+
+    Notes:
+        The jobs with a 'cache_key' are recorded in the figure cache once saved
+    """
+    workers = workers or n_workers
+    outputs = []
+
+    def complete(output, key):
+        outputs.append(output)
+        if key is not None:
+            record_figure(output, key)
+        print(f'complete - {output}')
+
+    try:
+        if workers <= 1:
+            init_worker()
+            for job in jobs:
+                complete(render_figure(job), job.get('cache_key'))
+            return outputs
+
+        # submit the jobs with a bounded number of figures in flight
+        pending = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            for job in jobs:
+                pending.append((executor.submit(render_figure, job), job.get('cache_key')))
+                if len(pending) >= 2 * workers:
+                    future, key = pending.pop(0)
+                    complete(future.result(), key)
+            for future, key in pending:
+                complete(future.result(), key)
+        return outputs
+    finally:
+        save_manifest()
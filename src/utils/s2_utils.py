@@ -3,7 +3,6 @@ This script includes the functions used to download Sentinel 2 imagery (True Col
 NDWI Index, and Cloud Mask.
 
 This file can be imported as a module and contains the following functions:
-    * map_dates - returns a pandas Series representing the 'formed' and 'dissipated' dates for the flood event;
     * map_color - returns a visualization of the image based on the specified visualization parameters;
     * check_region - returns True if the percentage of valid pixels in the region meets or exceeds the threshold; otherwise, False;
     * cal_overlap - returns the percentage of overlap between two specified regions;
@@ -14,30 +13,27 @@ This file can be imported as a module and contains the following functions:
     * export_image_vis - download the image (True Color);
     * export_image_ndwi - download the water mask (ndwi) for the image;
     * export_image_cloud - download the cloud and shadow mask for the image;
+    * get_pixel_grid - returns the pixel grid (CRS, affine transform, dimensions) covering the region;
+    * export_image_npy - download the image pixels as a NumPy array with a JSON georeferencing sidecar;
+    * screen_collection - returns the valid pixel coverage and cloud percentage of each image computed at preview resolution;
+    * export_image_preview - download a low-resolution preview (PNG) of the image;
+    * collect_region - collect the imagery for a single region of interest and time window;
     * collect_sentinel2 - collect the imagery for each event;
     * collect_sentinel2_by_event - iterate over the event list to collect imagery;
+    * cal_overlap_local - returns the percentage of overlap between two buffered locations without Earth Engine requests;
+    * plan_sentinel2_by_event - build a collection plan (dry run) with request, scene, pixel and byte estimates;
+    * collect_sentinel2_from_plan - collect the imagery listed in a saved plan.
 """
 
 # import libraries
 import ee 
 import os
+import json
+import math
 import requests
+import numpy as np
 import pandas as pd
-
-def map_dates(event, date_range):
-    """
-    Add the formed and dissipated dates for the flood events
- 
-    Args:
-        event (str): The event name for which the dates need to be mapped.
-        date_range (dict): A dictionary representing the date ranges for each event.
-
-    Returns:
-        pd.Series: A pandas Series representing the 'formed' and 'dissipated' dates for the event.
-    """
-    if event in date_range:
-        formed, dissipated = date_range[event]
-        return pd.Series([formed, dissipated], index=['formed', 'dissipated'])
+from utils import global_utils, catalog_utils
 
 def map_color(image, select_vis):
     """
@@ -296,7 +292,246 @@ def export_image_cloud(image, dir, scale, region, key):
     with open(file_path, 'wb') as fd:
         fd.write(res.content)
 
-def collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, data, buffer_dis, overlap_threshold, pixel_threshold, scale):
+def get_pixel_grid(image, region, scale):
+    """
+    Define the pixel grid covering the region in the native projection of the image
+
+    Args:
+        image (ee.Image): The image whose projection (CRS) is used for the grid
+        region (ee.Geometry): The region of interest
+        scale (int): The image resolution
+
+    Returns:
+        dict: A grid definition (dimensions, affineTransform, crsCode) accepted by ee.data.computePixels
+
+    Notes:
+        The grid is computed once per image and shared by the VIS, NDWI and CLOUD products so that they stay pixel-aligned
+    """
+    proj = image.select(0).projection()
+    info = ee.Dictionary({
+        'crs': proj.crs(),
+        'bounds': region.bounds(ee.ErrorMargin(1), proj).coordinates().get(0)
+    }).getInfo()
+
+    # snap the bounding box of the region to the pixel grid
+    xs = [coord[0] for coord in info['bounds']]
+    ys = [coord[1] for coord in info['bounds']]
+    x_min = math.floor(min(xs) / scale) * scale
+    y_max = math.ceil(max(ys) / scale) * scale
+    width = math.ceil((max(xs) - x_min) / scale)
+    height = math.ceil((y_max - min(ys)) / scale)
+
+    return {
+        'dimensions': {'width': width, 'height': height},
+        'affineTransform': {
+            'scaleX': scale,
+            'shearX': 0,
+            'translateX': x_min,
+            'shearY': 0,
+            'scaleY': -scale,
+            'translateY': y_max
+        },
+        'crsCode': info['crs']
+    }
+
+def export_image_npy(image, dir, grid, file_name):
+    """
+    Download the image pixels directly as a NumPy array (no GeoTIFF encoding) and save the georeferencing as a JSON sidecar
+
+    Args:
+        image (ee.Image): the selected image to be downloaded (already reduced to the bands of the product)
+        dir (str): the directory where the array is saved
+        grid (dict): The pixel grid returned by `get_pixel_grid`
+        file_name (str): The filename without extension (e.g., '{key}_{image id}_VIS')
+
+    Notes:
+        The array is saved with shape (bands, height, width) so that `np.load(..., mmap_mode='r')` can memory-map it
+        https://developers.google.com/earth-engine/apidocs/ee-data-computepixels
+    """
+    data = ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': grid
+    })
+
+    # convert the structured array (one field per band) to (bands, height, width)
+    bands = list(data.dtype.names)
+    array = np.stack([data[band] for band in bands])
+
+    np.save(os.path.join(dir, f'{file_name}.npy'), array)
+
+    affine = grid['affineTransform']
+    meta = {
+        'crs': grid['crsCode'],
+        'transform': [affine['scaleX'], affine['shearX'], affine['translateX'], affine['shearY'], affine['scaleY'], affine['translateY']],
+        'width': array.shape[2],
+        'height': array.shape[1],
+        'count': array.shape[0],
+        'dtype': str(array.dtype),
+        'bands': bands
+    }
+    with open(os.path.join(dir, f'{file_name}.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+
+def screen_collection(dataset, region, select_vis, preview_scale):
+    """
+    Compute the valid pixel coverage and cloud percentage of every image in the collection at preview resolution
+
+    Args:
+        dataset (ee.ImageCollection): The collection with the 'cloudmask' band added by `add_cld_shdw_mask`
+        region (ee.Geometry): The region of interest
+        select_vis (dict): The visualization parameters used to define valid (non-dark) pixels
+        preview_scale (int): The preview resolution (e.g., 60 or 100 meters)
+
+    Returns:
+        dict: The (coverage ratio, cloud percentage) of each image keyed by its 'system:index'
+
+    Notes:
+        All statistics are computed server-side and returned with a single request instead of one request per image.
+        The images with a null statistic (e.g., no pixel in the region) are dropped by `reduceColumns` and missing from the dictionary
+    """
+    total_area = region.area(ee.ErrorMargin(1))
+
+    def add_stats(image):
+        # area-weighted coverage of valid (non-dark) pixels
+        valid_area = (map_color(image, select_vis).select(0).mask().gt(0)
+            .multiply(ee.Image.pixelArea())
+            .reduceRegion(reducer=ee.Reducer.sum(), geometry=region, scale=preview_scale)
+            .values().get(0))
+
+        # cloud and shadow percentage (same definition as eda_s2_utils.check_cloud_cover)
+        cloud_mean = (image.select('cloudmask').unmask(0)
+            .reduceRegion(reducer=ee.Reducer.mean(), geometry=region, scale=preview_scale)
+            .get('cloudmask'))
+
+        return image.set({
+            'coverage': ee.Number(valid_area).divide(total_area),
+            'cloud_percentage': ee.Number(cloud_mean).multiply(100)
+        })
+
+    stats = dataset.map(add_stats).reduceColumns(ee.Reducer.toList(3), ['system:index', 'coverage', 'cloud_percentage'])
+    return {scene_id: (coverage, cloud_percentage) for scene_id, coverage, cloud_percentage in stats.get('list').getInfo()}
+
+def export_image_preview(image, dir, preview_scale, region, file_name):
+    """
+    Download a low-resolution preview (PNG) of the image for visual inspection
+
+    Args:
+        image (ee.Image): The image with visualization applied
+        dir (str): The directory where the preview is saved
+        preview_scale (int): The preview resolution
+        region (ee.Geometry): The region of interest
+        file_name (str): The filename without extension
+    """
+    url = image.getThumbURL({
+        'region': region,
+        'scale': preview_scale,
+        'format': 'png'
+    })
+    res = requests.get(url)
+    with open(os.path.join(dir, f'{file_name}.png'), 'wb') as fd:
+        fd.write(res.content)
+
+def collect_region(dir_vis, dir_ndwi, dir_cloud, region, key, start_day, end_day, pixel_threshold, scale, fetch_mode='geotiff', screen_params=None, scene_ids=None):
+    """
+    Collect Sentinel-2 imagery for a single region of interest and time window
+
+    Args:
+        dir_vis (str): The directory where the image (True Color) will be saved
+        dir_ndwi (str): The directory where the water mask will be saved
+        dir_cloud (str): The directory where the cloud and shadow mask will be saved
+        region (ee.Geometry): The region of interest
+        key (str): The flood event observation id used as the prefix in the filenames
+        start_day (str): The start date of the time window (included)
+        end_day (str): The end date of the time window (excluded)
+        pixel_threshold (float): The coverage ratio of valid pixels 
+        scale (int): The resolution
+        fetch_mode (str): 'geotiff' to download GeoTIFF files, 'npy' to retrieve the pixels as NumPy arrays
+        screen_params (dict): The preview screening parameters (see `collect_sentinel2`)
+        scene_ids (list of str): If set, only the scenes with these 'system:index' values are collected (used to execute a plan)
+
+    Returns:
+        list of dict: The screening results of the candidates (empty if screening is disabled)
+    """
+    screening_list = []
+    if screen_params is not None:
+        dir_preview = dir_vis.rstrip('/') + '_PREVIEW/'
+        os.makedirs(dir_preview, exist_ok=True)
+
+    # obtain the Sentinel-2 collection with cloud and shadow mask
+    s2_sr_cld_col_eval = get_s2_sr_cld_col(region, start_day, end_day)
+    if scene_ids is not None:
+        s2_sr_cld_col_eval = s2_sr_cld_col_eval.filter(ee.Filter.inList('system:index', ee.List(scene_ids)))
+    dataset = s2_sr_cld_col_eval.map(add_cld_shdw_mask)
+
+    # define and apply visualization parameters
+    select_vis = {
+        'min': 0,
+        'max': 3000,
+        'bands': ['B4', 'B3', 'B2']
+    }
+    dataset_vis = dataset.map(lambda image: map_color(image, select_vis))
+
+    # screen all the candidates at preview resolution (coverage and cloud percentage)
+    if screen_params is not None:
+        screening = screen_collection(dataset, region, select_vis, screen_params['preview_scale'])
+
+    # list the scene ids with a single request and select each image by id
+    for scene_id in dataset.aggregate_array('system:index').getInfo():
+      scene_filter = ee.Filter.eq('system:index', scene_id)
+      image_vis = ee.Image(dataset_vis.filter(scene_filter).first())
+      image = ee.Image(dataset.filter(scene_filter).first())
+
+      file_name = f'{key}_{scene_id}'
+
+      # only the candidates passing the screening are downloaded at full resolution (no statistics - screened out)
+      if screen_params is not None:
+          coverage, cloud_percentage = screening.get(scene_id, (None, None))
+          export_image_preview(image_vis, dir_preview, screen_params['preview_scale'], region, f'{file_name}_PREVIEW')
+          passed = ((coverage is not None) and (cloud_percentage <= screen_params['cloud_threshold'])
+                    and (coverage >= pixel_threshold - screen_params['coverage_tolerance']))
+          screening_list.append({
+              'id': key,
+              'filename': file_name,
+              'coverage': coverage,
+              'cloud_percentage': cloud_percentage,
+              'passed': passed
+          })
+          if coverage is None:
+              print(f'{file_name} screened out (no screening statistics) - skip')
+              continue
+          if not passed:
+              print(f'{file_name} screened out (coverage: {coverage:.2f}, cloud: {cloud_percentage:.1f}%) - skip')
+              continue
+
+      # check valid pixels
+      if check_region(image_vis, region, pixel_threshold).getInfo():
+        
+        # download images
+        if fetch_mode == 'npy':
+            grid = get_pixel_grid(image, region, scale)
+            export_image_npy(image_vis, dir_vis, grid, f'{file_name}_VIS')
+            export_image_npy(image.normalizedDifference(['B3', 'B8']), dir_ndwi, grid, f'{file_name}_NDWI')
+            export_image_npy(image.select('cloudmask'), dir_cloud, grid, f'{file_name}_CLOUD')
+            extension = 'npy'
+        else:
+            export_image_vis(image_vis, dir_vis, scale, region, key)
+            export_image_ndwi(image, dir_ndwi, scale, region, key)
+            export_image_cloud(image, dir_cloud, scale, region, key)
+            extension = 'tif'
+
+            # build the overviews used by the figures (the masks keep their values with nearest resampling)
+            global_utils.build_overviews(os.path.join(dir_vis, f'{file_name}_VIS.tif'))
+            global_utils.build_overviews(os.path.join(dir_ndwi, f'{file_name}_NDWI.tif'))
+            global_utils.build_overviews(os.path.join(dir_cloud, f'{file_name}_CLOUD.tif'), resampling='nearest')
+
+        # store the cloud statistics in the cloud mask metadata and add the image to the catalog
+        global_utils.write_cloud_stats(os.path.join(dir_cloud, f'{file_name}_CLOUD.{extension}'))
+        catalog_utils.register_scene(f'{file_name}_VIS.{extension}', dir_vis, dir_ndwi, dir_cloud)
+
+    return screening_list
+
+def collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, data, buffer_dis, overlap_threshold, pixel_threshold, scale, fetch_mode='geotiff', screen_params=None):
     """
     Collect Sentinel-2 imagery for the specified flood event observations and region
     
@@ -309,8 +544,15 @@ def collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, data, buffer_dis, overlap_th
         overlap_threshold (int): The percentage threshold for region overlap
         pixel_threshold (float): The coverage ratio of valid pixels 
         scale (int): The resolution
+        fetch_mode (str): 'geotiff' to download GeoTIFF files, 'npy' to retrieve the pixels as NumPy arrays
+        screen_params (dict): If set, screen the images at preview resolution before the full-resolution download (e.g., {
+                                'preview_scale': 60,
+                                'cloud_threshold': 50,
+                                'coverage_tolerance': 0.05
+                            })
     """
     region_list = {}
+    screening_list = []
     for index, row in data.iterrows():
         
         # define the region of interest
@@ -325,33 +567,14 @@ def collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, data, buffer_dis, overlap_th
         if overlap:
             print(f'{index}_{key} overlapping - skip')
         else:
-            
-            # obtain the Sentinel-2 collection with cloud and shadow mask
-            s2_sr_cld_col_eval = get_s2_sr_cld_col(region, row['start_day'], row['end_day'])
-            dataset = s2_sr_cld_col_eval.map(add_cld_shdw_mask)
-
-            # define and apply visualization parameters
-            select_vis = {
-                'min': 0,
-                'max': 3000,
-                'bands': ['B4', 'B3', 'B2']
-            }
-            dataset_vis = dataset.map(lambda image: map_color(image, select_vis))
-
-            for i in range(dataset_vis.size().getInfo()):
-              image_vis = ee.Image(dataset_vis.toList(dataset_vis.size()).get(i))
-              image = ee.Image(dataset.toList(dataset.size()).get(i))
-
-              # check valid pixels
-              if check_region(image_vis, region, pixel_threshold).getInfo():
-                
-                # download images
-                export_image_vis(image_vis, dir_vis, scale, region, key)
-                export_image_ndwi(image, dir_ndwi, scale, region, key)
-                export_image_cloud(image, dir_cloud, scale, region, key)
+            screening_list += collect_region(dir_vis, dir_ndwi, dir_cloud, region, key, row['start_day'], row['end_day'], pixel_threshold, scale, fetch_mode, screen_params)
             region_list[key] = {'region': region, 'event': event}   
 
-def collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshold, scale):
+    # save the screening results
+    if screen_params is not None:
+        pd.DataFrame(screening_list).to_csv(dir_vis.rstrip('/') + '_screening.csv', index=False)
+
+def collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshold, scale, fetch_mode='geotiff', screen_params=None):
     """
     Collect Sentinel-2 imagery by unique event ids
 
@@ -361,6 +584,8 @@ def collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshol
         overlap_threshold (int): The percentage threshold for region overlap
         pixel_threshold (float): The coverage ratio of valid pixels 
         scale (int): The resolution
+        fetch_mode (str): 'geotiff' to download GeoTIFF files, 'npy' to retrieve the pixels as NumPy arrays
+        screen_params (dict): The preview screening parameters (see `collect_sentinel2`), None to download every valid image
     """
 
     # get the list of unique flood events
@@ -379,5 +604,167 @@ def collect_sentinel2_by_event(df, buffer_dis, overlap_threshold, pixel_threshol
         os.makedirs(dir_cloud, exist_ok=True)
 
         # collect and download Sentinel-2 imagery for the current event
-        collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, event_df, buffer_dis, overlap_threshold, pixel_threshold, scale)
+        collect_sentinel2(dir_vis, dir_ndwi, dir_cloud, event_df, buffer_dis, overlap_threshold, pixel_threshold, scale, fetch_mode, screen_params)
+        print(f"Finished processing for event: {event}")
+
+def cal_overlap_local(lat1, lon1, lat2, lon2, buffer_dis):
+    """
+    Calculate the percentage of overlap between two buffered locations locally (no Earth Engine request)
+
+    Args:
+        lat1 (float): The latitude of the first location
+        lon1 (float): The longitude of the first location
+        lat2 (float): The latitude of the second location
+        lon2 (float): The longitude of the second location
+        buffer_dis (int): The buffer distance (radius in meters) around each location
+
+    Returns:
+        float: The percentage of overlap between the two circular regions (same definition as `cal_overlap`)
+    """
+    # great-circle distance between the two centers (haversine)
+    earth_radius = 6371008.8
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    dis = 2 * earth_radius * math.asin(math.sqrt(a))
+
+    # area of the intersection of two circles with the same radius
+    r = buffer_dis
+    if dis >= 2 * r:
+        return 0.0
+    intersect_area = 2 * r**2 * math.acos(dis / (2 * r)) - (dis / 2) * math.sqrt(4 * r**2 - dis**2)
+    return intersect_area / (math.pi * r**2) * 100
+
+def plan_sentinel2_by_event(df, buffer_dis, overlap_threshold, scale, plan_path):
+    """
+    Build the collection plan (dry run) from collection metadata and local geometry, report the estimates, and save the plan
+
+    Args:
+        df (pd.DataFrame): The DataFrame used to collect images
+        buffer_dis (int): The distance to buffer around each location to define the region of interest
+        overlap_threshold (int): The percentage threshold for region overlap
+        scale (int): The resolution
+        plan_path (str): The JSON file where the plan is saved
+
+    Returns:
+        pd.DataFrame: The estimated observations, scenes, requests, pixels and bytes per event
+
+    Notes:
+        - The overlap between regions is computed locally (`cal_overlap_local`), only one metadata request is sent per kept observation;
+        - The scene counts are upper bounds because the valid pixel check and the cloud screening need pixel computation;
+        - Bytes are uncompressed estimates (VIS 3 x uint8, NDWI float32, CLOUD uint8 per pixel).
+    """
+    global_utils.print_func_header('build the Sentinel-2 collection plan (dry run)')
+
+    # pixels in the bounding box of the buffered region and bytes per pixel of all the products
+    pixels_per_scene = math.ceil(2 * buffer_dis / scale) ** 2
+    bytes_per_pixel = 3 + 4 + 1
+
+    # requests per scene: check_region + 3 products x (download url + image id + download)
+    requests_per_scene = 1 + 3 * 3
+
+    tasks = []
+    summary = []
+    for event in df['event'].unique():
+        event_df = df[df['event'] == event].reset_index(drop=True)
+        kept = []
+        n_scenes = 0
+        for _, row in event_df.iterrows():
+            lat = float(row['latitude'])
+            lon = float(row['longitude'])
+
+            # check the overlap between regions (same rule as `collect_sentinel2`)
+            if any(cal_overlap_local(lat, lon, task['latitude'], task['longitude'], buffer_dis) > overlap_threshold for task in kept):
+                continue
+
+            # list the scenes in the time window from the collection metadata
+            region = ee.Geometry.Point(lon, lat).buffer(buffer_dis)
+            start_day = str(row['start_day'])[:10]
+            end_day = str(row['end_day'])[:10]
+            scenes = (get_s2_sr_cld_col(region, start_day, end_day)
+                .reduceColumns(ee.Reducer.toList(2), ['system:index', 'CLOUDY_PIXEL_PERCENTAGE'])
+                .get('list').getInfo())
+
+            task = {
+                'event': event,
+                'id': row['id'],
+                'latitude': lat,
+                'longitude': lon,
+                'start_day': start_day,
+                'end_day': end_day,
+                'scene_ids': [scene[0] for scene in scenes],
+                'cloudy_pixel_percentage': [scene[1] for scene in scenes]
+            }
+            kept.append(task)
+            n_scenes += len(scenes)
+            print(f"{event} - {row['id']}: {len(scenes)} scenes")
+
+        tasks += kept
+        summary.append({
+            'event': event,
+            'observations': len(event_df),
+            'observations_kept': len(kept),
+            'scenes': n_scenes,
+            'requests': len(kept) + n_scenes * requests_per_scene,
+            'pixels': n_scenes * pixels_per_scene,
+            'bytes': n_scenes * pixels_per_scene * bytes_per_pixel
+        })
+
+    summary_df = pd.DataFrame(summary)
+    total = summary_df.drop(columns='event').sum()
+    print('\ncollection plan by event:\n', summary_df)
+    print(f"\ntotal: {total['observations_kept']} observations, {total['scenes']} scenes, {total['requests']} requests, "
+          f"{total['pixels'] / 1e6:.1f} M pixels, {total['bytes'] / 1e9:.2f} GB (uncompressed)")
+
+    # save the plan
+    plan = {
+        'params': {'buffer_dis': buffer_dis, 'overlap_threshold': overlap_threshold, 'scale': scale},
+        'summary': summary,
+        'tasks': tasks
+    }
+    with open(plan_path, 'w') as f:
+        json.dump(plan, f, indent=4, default=int)
+    print(f'\nplan saved to {plan_path}')
+
+    return summary_df
+
+def collect_sentinel2_from_plan(plan_path, pixel_threshold, fetch_mode='geotiff', screen_params=None):
+    """
+    Collect the Sentinel-2 imagery listed in a plan saved by `plan_sentinel2_by_event`
+
+    Args:
+        plan_path (str): The JSON file storing the plan
+        pixel_threshold (float): The coverage ratio of valid pixels 
+        fetch_mode (str): 'geotiff' to download GeoTIFF files, 'npy' to retrieve the pixels as NumPy arrays
+        screen_params (dict): The preview screening parameters (see `collect_sentinel2`), None to download every valid image
+    """
+    with open(plan_path) as f:
+        plan = json.load(f)
+    buffer_dis = plan['params']['buffer_dis']
+    scale = plan['params']['scale']
+
+    for event in dict.fromkeys(task['event'] for task in plan['tasks']):
+        event_tasks = [task for task in plan['tasks'] if task['event'] == event]
+        print(f'{event} has {len(event_tasks)} planned observations.')
+
+        # create the directory
+        dir_event = event.replace(' ', '_')
+        dir_vis = f'data/img_s2/{dir_event}/'
+        dir_ndwi = f'data/img_s2/{dir_event}_NDWI/'
+        dir_cloud = f'data/img_s2/{dir_event}_CLOUD/'
+        os.makedirs(dir_vis, exist_ok=True)
+        os.makedirs(dir_ndwi, exist_ok=True)
+        os.makedirs(dir_cloud, exist_ok=True)
+
+        screening_list = []
+        for task in event_tasks:
+            if not task['scene_ids']:
+                continue
+            region = ee.Geometry.Point(task['longitude'], task['latitude']).buffer(buffer_dis)
+            screening_list += collect_region(dir_vis, dir_ndwi, dir_cloud, region, task['id'], task['start_day'], task['end_day'],
+                                             pixel_threshold, scale, fetch_mode, screen_params, task['scene_ids'])
+
+        if screen_params is not None:
+            pd.DataFrame(screening_list).to_csv(dir_vis.rstrip('/') + '_screening.csv', index=False)
         print(f"Finished processing for event: {event}")
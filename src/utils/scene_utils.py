@@ -0,0 +1,206 @@
+"""
+This script includes the functions used to load the scene (image) arrays on demand with a bounded memory.
+
+The arrays of a scene (image, masks, features) are materialized when first requested and kept in a least recently
+used cache with a byte budget, so the DataFrames only store the metadata and the KMeans stage runs in constant memory
+regardless of the number of scenes.
+
+The files of a scene (True Color image, NDWI and cloud mask) are read together with `read_scene`, so each file is
+opened and decoded once and the cloud mask is shared by all the products.
+
+This file can be imported as a module and contains the following functions:
+    * read_scene - return the bands, masks and georeferencing of a scene, opening each file once;
+    * read_scene_level - return the bands, masks and georeferencing of a scene at a coarser level or in a full-resolution window;
+    * gather_valid - return the valid pixels of an array as a float32 feature matrix;
+    * nbytes - return the number of bytes of the arrays of a scene;
+    * get_scene - return the arrays of a scene from the cache (loaded on demand);
+    * clear_scenes - remove all the scenes from the cache;
+    * cache_info - return the number of scenes and bytes in the cache.
+"""
+
+# import libraries
+import os
+import rasterio
+import numpy as np
+from affine import Affine
+from collections import OrderedDict, namedtuple
+from rasterio.enums import Resampling
+from rasterio.coords import BoundingBox
+from rasterio.windows import transform as window_transform
+from rasterio.transform import array_bounds
+from utils import global_utils
+
+# byte budget of the cache (can be set in MB with the SCENE_CACHE_MB environment variable)
+max_bytes = int(float(os.environ.get('SCENE_CACHE_MB', 2048)) * 1024 ** 2)
+_scenes = OrderedDict()
+_total_bytes = 0
+
+# the bands, masks and georeferencing of a scene
+Scene = namedtuple('Scene', ['vis', 'ndwi', 'cloud_mask', 'bounds', 'crs', 'transform', 'profile'])
+
+def read_scene(row):
+    """
+    Read the True Color image, NDWI and cloud mask of a scene, opening each file once
+
+    Args:
+        row (pd.Series): The image metadata with the 'dir', 'filename', 'dir_ndwi', 'filename_ndwi', 'dir_cloud' and 'filename_cloud' columns
+
+    Returns:
+        Scene: The True Color bands ('vis', (bands, height, width)), the NDWI band ('ndwi'), the cloud mask ('cloud_mask'),
+               and the 'bounds', 'crs', 'transform' and 'profile' of the image
+    """
+    image_path = os.path.join(row['dir'], row['filename'])
+    if image_path.endswith('.npy'):
+        vis, bounds, crs, transform, profile = global_utils.read_npy(image_path)
+    else:
+        with rasterio.open(image_path) as src:
+            vis, bounds, crs, transform, profile = src.read(), src.bounds, src.crs, src.transform, src.profile
+
+    ndwi = global_utils.read_band(os.path.join(row['dir_ndwi'], row['filename_ndwi']))
+    cloud_mask = global_utils.read_band(os.path.join(row['dir_cloud'], row['filename_cloud']))
+    return Scene(vis, ndwi, cloud_mask, bounds, crs, transform, profile)
+
+def read_scene_level(row, factor=1, window=None):
+    """
+    Read the True Color image, NDWI and cloud mask of a scene at a coarser level or in a window at full resolution
+
+    Args:
+        row (pd.Series): The image metadata with the 'dir', 'filename', 'dir_ndwi', 'filename_ndwi', 'dir_cloud' and 'filename_cloud' columns
+        factor (int): The number of pixels along each axis of a coarse pixel (e.g., 4 - 40 m pixels at 10 m), 1 for full resolution
+        window (rasterio.windows.Window): The window read at full resolution, None to read the whole scene
+
+    Returns:
+        Scene: The bands and masks of the level (or window) with its 'bounds' and 'transform' (see `read_scene`), the
+               'profile' of the image
+
+    Notes:
+        GeoTIFFs are read with `out_shape` (ceil(height / factor), ceil(width / factor)), so GDAL reads the overview built at
+        download time (`global_utils.build_overviews`): averaged bands and NDWI, nearest cloud mask. NumPy images are
+        decimated from the memory map. The windows are read without the rest of the image
+    """
+    if factor == 1 and window is None:
+        return read_scene(row)
+
+    paths = [os.path.join(row['dir'], row['filename']), os.path.join(row['dir_ndwi'], row['filename_ndwi']),
+             os.path.join(row['dir_cloud'], row['filename_cloud'])]
+    methods = [Resampling.average, Resampling.average, Resampling.nearest]
+    arrays = []
+    for path, method in zip(paths, methods):
+        if path.endswith('.npy'):
+            data, _, crs, transform, profile = global_utils.read_npy(path)
+            if window is not None:
+                data = data[:, window.row_off:window.row_off + window.height, window.col_off:window.col_off + window.width]
+            else:
+                data = data[:, ::factor, ::factor]
+            data = np.ascontiguousarray(data)
+        else:
+            with rasterio.open(path) as src:
+                crs, transform, profile = src.crs, src.transform, src.profile
+                if window is not None:
+                    data = src.read(window=window)
+                else:
+                    out_shape = (src.count, -(-src.height // factor), -(-src.width // factor))
+                    data = src.read(out_shape=out_shape, resampling=method)
+        arrays.append(data)
+
+    # georeferencing of the level (or window)
+    vis, ndwi, cloud_mask = arrays[0], arrays[1][0], arrays[2][0]
+    height, width = vis.shape[1:]
+    if window is not None:
+        transform = window_transform(window, transform)
+    else:
+        transform = transform * Affine.scale(profile['width'] / width, profile['height'] / height)
+    bounds = BoundingBox(*array_bounds(height, width, transform))
+    return Scene(vis, ndwi, cloud_mask, bounds, crs, transform, profile)
+
+def gather_valid(array, valid_pixels, dtype=np.float32):
+    """
+    Gather the valid pixels of an array into a feature matrix
+
+    Args:
+        array (np.ndarray): The array with shape (bands, height, width) or (height, width), in its native dtype
+        valid_pixels (np.ndarray): The boolean mask of the valid pixels, with shape (height * width,) or (height, width)
+        dtype (np.dtype): The dtype of the feature matrix
+
+    Returns:
+        np.ndarray: The valid pixels with shape (num_valid_pixels, bands) or (num_valid_pixels,)
+
+    Notes:
+        Only the valid pixels are converted, the full array is never copied to float
+    """
+    valid_pixels = valid_pixels.ravel()
+    if array.ndim == 2:
+        return array.ravel()[valid_pixels].astype(dtype)
+    flat = array.reshape(array.shape[0], -1)
+    return flat[:, valid_pixels].T.astype(dtype, order='C')
+
+def nbytes(scene):
+    """
+    Count the bytes of the arrays of a scene
+
+    Args:
+        scene (dict): The arrays (and other values) of a scene
+
+    Returns:
+        int: The number of bytes of the arrays
+
+    Notes:
+        The views (e.g., columns of a feature matrix) are counted once with the array owning their memory
+    """
+    owners = {}
+    for value in scene.values():
+        if not isinstance(value, np.ndarray):
+            continue
+        while isinstance(value.base, np.ndarray):
+            value = value.base
+        owners[id(value)] = value.nbytes
+    return sum(owners.values())
+
+def get_scene(key, loader):
+    """
+    Return the arrays of a scene, loading them on demand and evicting the least recently used scenes over the budget
+
+    Args:
+        key (str): The scene key (e.g., the image filename)
+        loader (callable): The function (without arguments) returning the arrays of the scene as a dictionary
+
+    Returns:
+        dict: The arrays of the scene
+
+    Notes:
+        A scene larger than the budget is returned without being cached
+    """
+    global _total_bytes
+    if key in _scenes:
+        _scenes.move_to_end(key)
+        return _scenes[key]
+
+    scene = loader()
+    size = nbytes(scene)
+    if size > max_bytes:
+        return scene
+
+    # evict the least recently used scenes
+    while _scenes and _total_bytes + size > max_bytes:
+        _, evicted = _scenes.popitem(last=False)
+        _total_bytes -= nbytes(evicted)
+    _scenes[key] = scene
+    _total_bytes += size
+    return scene
+
+def clear_scenes():
+    """
+    Remove all the scenes from the cache
+    """
+    global _total_bytes
+    _scenes.clear()
+    _total_bytes = 0
+
+def cache_info():
+    """
+    Return the state of the cache
+
+    Returns:
+        dict: The number of scenes ('scenes'), the bytes used ('bytes') and the budget ('max_bytes')
+    """
+    return {'scenes': len(_scenes), 'bytes': _total_bytes, 'max_bytes': max_bytes}